@@ -0,0 +1,80 @@
+import sys
+import argparse
+import asyncio
+import json
+import logging
+logger = logging.getLogger(__name__)
+
+import cloudlanguagetools.servicemanager
+import cloudlanguagetools.options
+import cloudlanguagetools.languages
+import cloudlanguagetools_chatbot.chatmodel
+import cloudlanguagetools_chatbot.cache
+import cloudlanguagetools_chatbot.batch
+
+# runs a list of sentences through the chatbot, for example a whole deck:
+#
+# with the LLM following an instruction:
+# python batch_chatbot.py deck.csv --output results.jsonl --audio-dir audio --instruction "translate, transliterate and pronounce"
+#
+# calling the functions directly, much faster, the languages can also be columns of the input:
+# python batch_chatbot.py deck.csv --output results.jsonl --audio-dir audio \
+#     --functions translate_or_lookup,transliterate,pronounce --source-language zh_cn --target-language en
+#
+# interrupted runs are resumed by running the same command again, rows already in the output are skipped
+
+def get_language_value(language):
+    """the queries take the language names (French), accept the codes (fr) as well"""
+    if language in cloudlanguagetools.languages.CommonLanguage.__members__:
+        return cloudlanguagetools.languages.CommonLanguage[language].value
+    return language
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='process a CSV or JSONL file of sentences with the chatbot')
+    parser.add_argument('input', help='CSV file with a header, or JSONL file')
+    parser.add_argument('--output', required=True, help='JSONL file the results are appended to')
+    parser.add_argument('--audio-dir', default=None, help='directory for the generated audio')
+    parser.add_argument('--text-column', default='text')
+    parser.add_argument('--instruction', default=None, help='instruction for the LLM, instead of the default one')
+    parser.add_argument('--functions', default=None,
+                        help=f'comma separated functions to call directly, without the LLM: {",".join(cloudlanguagetools_chatbot.batch.FUNCTION_ARGUMENTS.keys())}')
+    parser.add_argument('--source-language', default=None, help='language of the sentences, for example zh_cn, unless given by a column')
+    parser.add_argument('--target-language', default='en')
+    parser.add_argument('--audio-format', default='mp3', choices=[audio_format.name for audio_format in cloudlanguagetools.options.AudioFormat])
+    parser.add_argument('--concurrency', type=int, default=8, help='sentences processed at the same time')
+    args = parser.parse_args(argv)
+    if args.functions != None:
+        args.functions = args.functions.split(',')
+        for function_name in args.functions:
+            if function_name not in cloudlanguagetools_chatbot.batch.FUNCTION_ARGUMENTS:
+                parser.error(f'unknown function: {function_name}')
+    return args
+
+async def run(args):
+    manager = cloudlanguagetools.servicemanager.ServiceManager()
+    manager.configure_default()
+    # results are shared between the sentences, repeated words are only translated once
+    result_cache = cloudlanguagetools_chatbot.cache.FunctionCallCache()
+    audio_format = cloudlanguagetools.options.AudioFormat[args.audio_format]
+    def create_chat_model():
+        return cloudlanguagetools_chatbot.chatmodel.ChatModel(manager, audio_format=audio_format, result_cache=result_cache)
+    items = cloudlanguagetools_chatbot.batch.read_items(args.input, text_column=args.text_column,
+        source_language=args.source_language, target_language=args.target_language)
+    for item in items:
+        item['source_language'] = get_language_value(item['source_language'])
+        item['target_language'] = get_language_value(item['target_language'])
+    processor = cloudlanguagetools_chatbot.batch.BatchProcessor(create_chat_model, args.output,
+        audio_dir=args.audio_dir, instruction=args.instruction, functions=args.functions, concurrency=args.concurrency)
+    try:
+        stats = await processor.run(items)
+    finally:
+        await cloudlanguagetools_chatbot.chatmodel.get_shared_llm_client().close()
+    logger.info(f'done: {json.dumps(stats)}')
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
+                        datefmt='%Y%m%d-%H:%M:%S',
+                        stream=sys.stdout,
+                        level=logging.INFO)
+
+    asyncio.run(run(parse_args()))
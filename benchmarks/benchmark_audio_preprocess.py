@@ -0,0 +1,123 @@
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import cloudlanguagetools.options
+import cloudlanguagetools_chatbot.audio_preprocess
+import cloudlanguagetools_chatbot.audiodata
+from benchmark_chatmodel import get_percentiles, get_git_revision
+
+logger = logging.getLogger(__name__)
+
+# offline benchmark of the voice note preprocessing, on sample ogg/opus files, for example voice notes
+# saved from telegram. reports the size and duration of the notes before and after, and the processing time.
+# with --recognize, both versions are also sent to the speech recognizer, which needs the cloudlanguagetools keys.
+#
+# python benchmarks/benchmark_audio_preprocess.py samples/*.ogg --output results.json
+# python benchmarks/benchmark_audio_preprocess.py samples/*.ogg --sample-rate 8000 --max-duration 15 --recognize
+
+def recognize(chatapi, audio, audio_format):
+    start_time = time.monotonic()
+    text = chatapi.recognize_audio(audio, audio_format)
+    return text, time.monotonic() - start_time
+
+def run(args):
+    preprocessor = cloudlanguagetools_chatbot.audio_preprocess.AudioPreprocessor(
+        sample_rate=args.sample_rate, max_duration_seconds=args.max_duration,
+        silence_threshold_db=args.silence_threshold, output_format=args.output_format, output_bitrate=args.bitrate)
+    chatapi = None
+    if args.recognize:
+        import cloudlanguagetools.servicemanager
+        import cloudlanguagetools.chatapi
+        manager = cloudlanguagetools.servicemanager.ServiceManager()
+        manager.configure_default()
+        chatapi = cloudlanguagetools.chatapi.ChatAPI(manager)
+
+    files = []
+    for path in args.files:
+        audio = cloudlanguagetools_chatbot.audiodata.AudioData.from_path(path)
+        for i in range(args.repeat):
+            start_time = time.monotonic()
+            preprocessed = preprocessor.preprocess(audio)
+            preprocess_time = time.monotonic() - start_time
+        file_result = {
+            'file': path,
+            'input_bytes': preprocessed.input_size,
+            'output_bytes': preprocessed.output_size,
+            'input_duration': preprocessed.input_duration,
+            'output_duration': preprocessed.output_duration,
+            'preprocess_time': preprocess_time
+        }
+        if chatapi != None:
+            file_result['original_text'], file_result['original_recognize_time'] = recognize(chatapi, audio, cloudlanguagetools.options.AudioFormat.ogg_opus)
+            if preprocessed.audio != None:
+                file_result['preprocessed_text'], file_result['preprocessed_recognize_time'] = recognize(chatapi, preprocessed.audio, preprocessed.audio_format)
+        if preprocessed.audio != None:
+            preprocessed.audio.close()
+        files.append(file_result)
+
+    stats = preprocessor.get_stats()
+    results = {
+        'preprocessor': stats,
+        'size_ratio': stats['output_bytes'] / stats['input_bytes'] if stats['input_bytes'] > 0 else None,
+        'duration_ratio': stats['output_duration'] / stats['input_duration'] if stats['input_duration'] > 0 else None,
+        'preprocess_time': get_percentiles([file_result['preprocess_time'] for file_result in files]),
+        'files': files
+    }
+    if chatapi != None:
+        results['original_recognize_time'] = get_percentiles([file_result['original_recognize_time'] for file_result in files])
+        results['preprocessed_recognize_time'] = get_percentiles([file_result['preprocessed_recognize_time'] for file_result in files
+                                                                   if 'preprocessed_recognize_time' in file_result])
+    return {
+        'benchmark': 'audio_preprocess',
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'git_revision': get_git_revision(),
+        'python_version': platform.python_version(),
+        'config': {
+            'sample_rate': args.sample_rate,
+            'max_duration': args.max_duration,
+            'silence_threshold': args.silence_threshold,
+            'output_format': args.output_format,
+            'bitrate': args.bitrate,
+            'repeat': args.repeat,
+            'recognize': args.recognize
+        },
+        'results': results
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='offline benchmark of the voice note preprocessing')
+    parser.add_argument('files', nargs='+', help='sample voice notes, ogg/opus like the telegram ones')
+    parser.add_argument('--sample-rate', type=int, default=cloudlanguagetools_chatbot.audio_preprocess.DEFAULT_SAMPLE_RATE)
+    parser.add_argument('--max-duration', type=int, default=cloudlanguagetools_chatbot.audio_preprocess.DEFAULT_MAX_DURATION_SECONDS)
+    parser.add_argument('--silence-threshold', type=float, default=cloudlanguagetools_chatbot.audio_preprocess.DEFAULT_SILENCE_THRESHOLD_DB,
+                        help='dB below the loudest part of the note')
+    parser.add_argument('--output-format', default=cloudlanguagetools_chatbot.audio_preprocess.DEFAULT_OUTPUT_FORMAT,
+                        choices=cloudlanguagetools_chatbot.audio_preprocess.OUTPUT_FORMATS)
+    parser.add_argument('--bitrate', default=cloudlanguagetools_chatbot.audio_preprocess.DEFAULT_OUTPUT_BITRATE)
+    parser.add_argument('--repeat', type=int, default=1, help='preprocess each file this many times, the last time is reported')
+    parser.add_argument('--recognize', action='store_true', help='also recognize the original and preprocessed notes')
+    parser.add_argument('--output', default=None, help='write the results to this json file')
+    return parser.parse_args(argv)
+
+def main():
+    args = parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.WARNING)
+
+    results = run(args)
+    results_json = json.dumps(results, indent=4, ensure_ascii=False)
+    if args.output != None:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(results_json)
+    print(results_json)
+
+if __name__ == '__main__':
+    main()
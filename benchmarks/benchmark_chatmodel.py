@@ -0,0 +1,323 @@
+import argparse
+import asyncio
+import datetime
+import gc
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import cloudlanguagetools_chatbot.chatmodel
+import cloudlanguagetools_chatbot.cache
+import cloudlanguagetools_chatbot.audio_cache
+import cloudlanguagetools_chatbot.executor
+import cloudlanguagetools_chatbot.singleflight
+import cloudlanguagetools_chatbot.client
+import cloudlanguagetools_chatbot.plan
+import cloudlanguagetools_chatbot.turn_cache
+import cloudlanguagetools_chatbot.recording
+import cloudlanguagetools_chatbot.audiodata
+import fakes
+
+logger = logging.getLogger(__name__)
+
+# offline end to end benchmark of ChatModel.process_message: the model, the language services and
+# the telegram callbacks are replaced by local fakes with configurable latencies.
+#
+# python benchmarks/benchmark_chatmodel.py --sessions 100 --concurrency 20 --output results.json
+# python benchmarks/benchmark_chatmodel.py --llm-latency lognormal:0.8:0.5 --tool-latency uniform:0.1:0.4
+#
+# with --replay, the chats of a traffic recording (see cloudlanguagetools_chatbot.recording) are replayed
+# instead, with the recorded inputs, arrival times, responses and latencies, all multiplied by --time-scale:
+# python benchmarks/benchmark_chatmodel.py --replay traffic.jsonl --time-scale 0.5
+
+TOOL_FUNCTION_NAMES = ['translate_or_lookup', 'transliterate', 'breakdown', 'audio', 'recognize_audio']
+
+def get_percentiles(values):
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    def percentile(p):
+        return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values),
+        'p50': percentile(50),
+        'p90': percentile(90),
+        'p95': percentile(95),
+        'p99': percentile(99),
+        'max': values[-1]
+    }
+
+def get_git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(__file__), stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+class Benchmark():
+    def __init__(self, args):
+        self.args = args
+        self.scenario = fakes.DEFAULT_SCENARIO
+        if args.scenario != None:
+            with open(args.scenario, 'r', encoding='utf-8') as f:
+                self.scenario = json.load(f)
+        scale = args.time_scale
+        self.recording = None
+        self.llm_server = None
+        if args.replay != None:
+            self.recording = cloudlanguagetools_chatbot.recording.TrafficRecording.load(args.replay)
+            self.chatapi = cloudlanguagetools_chatbot.recording.ReplayChatAPI(self.recording, latency_scale=scale)
+        else:
+            self.llm_server = fakes.FakeChatCompletionServer(self.scenario,
+                latency=fakes.Latency.parse(args.llm_latency, scale),
+                stream_chunk_latency=fakes.Latency.parse(args.stream_chunk_latency, scale))
+            tool_latency = fakes.Latency.parse(args.tool_latency, scale)
+            self.chatapi = fakes.FakeChatAPI({function_name: tool_latency for function_name in TOOL_FUNCTION_NAMES})
+        self.send_latency = fakes.Latency.parse(args.send_latency, scale)
+        # everything shared between the chats is created for this run
+        self.result_cache = cloudlanguagetools_chatbot.cache.FunctionCallCache()
+        self.tool_executor = cloudlanguagetools_chatbot.executor.ToolExecutor()
+        self.single_flight = cloudlanguagetools_chatbot.singleflight.SingleFlight()
+        self.tool_plan_cache = cloudlanguagetools_chatbot.plan.ToolPlanCache()
+        self.turn_cache = cloudlanguagetools_chatbot.turn_cache.TurnCache() if args.turn_cache else None
+        self.audio_cache = None
+        if args.audio_cache:
+            self.audio_cache_dir = tempfile.TemporaryDirectory(prefix='clt_chatbot_benchmark_')
+            self.audio_cache = cloudlanguagetools_chatbot.audio_cache.AudioCache(self.audio_cache_dir.name)
+        # --record: record the scenario run, to check a replay against it
+        self.recorder = None
+        if args.record != None:
+            self.recorder = cloudlanguagetools_chatbot.recording.TrafficRecorder(args.record)
+            self.chatapi = cloudlanguagetools_chatbot.recording.RecordingChatAPI(self.chatapi, self.recorder)
+        self.turn_results = []
+        self.session_states = []
+        self.errors = 0
+
+    def create_chat_model(self, llm_client):
+        chat_model = cloudlanguagetools_chatbot.chatmodel.ChatModel(None,
+            result_cache=self.result_cache,
+            audio_cache=self.audio_cache,
+            tool_executor=self.tool_executor,
+            single_flight=self.single_flight,
+            speculative_execution=self.args.speculative_execution,
+            streaming=self.args.streaming,
+            tool_plans=self.args.tool_plans,
+            tool_plan_cache=self.tool_plan_cache,
+            turn_cache=self.turn_cache,
+            llm_client=llm_client)
+        chat_model.chatapi = self.chatapi
+        return chat_model
+
+    async def run_session(self, session_index, llm_client):
+        if self.recorder != None:
+            llm_client = cloudlanguagetools_chatbot.recording.RecordingLLMClient(llm_client, self.recorder)
+        counting_llm_client = fakes.CountingLLMClient(llm_client)
+        chat_model = self.create_chat_model(counting_llm_client)
+        callbacks = fakes.FakeCallbacks(self.send_latency)
+        callbacks.set_callbacks(chat_model)
+        for turn in self.scenario:
+            input_text = turn['input']
+            if self.args.unique_inputs:
+                # defeats the caches and the coalescing of identical calls
+                input_text = f'{input_text} #{session_index}'
+            if self.recorder != None:
+                self.recorder.record_input(session_index, text=input_text)
+            await self.run_turn(turn['input_type'], chat_model.process_message(input_text), callbacks, counting_llm_client)
+            await asyncio.sleep(self.args.think_time * self.args.time_scale)
+        self.session_states.append(chat_model.get_state())
+
+    async def run_turn(self, input_type, process_coroutine, callbacks, counting_llm_client):
+        request_count = counting_llm_client.request_count
+        status_count = len(callbacks.status_messages)
+        callbacks.start_turn()
+        await process_coroutine
+        latency = time.monotonic() - callbacks.turn_start_time
+        # process_message reports errors with send_status
+        errors = [status for status in callbacks.status_messages[status_count:] if status.startswith('error')]
+        self.errors += len(errors)
+        self.turn_results.append({
+            'input_type': input_type,
+            'latency': latency,
+            'time_to_first_output': callbacks.get_time_to_first_output(),
+            'llm_round_trips': counting_llm_client.request_count - request_count,
+        })
+
+    async def replay_session(self, inputs, llm_client, start_time):
+        """the inputs of a recorded chat, each one sent at its recorded time (scaled), or when the previous one is done"""
+        counting_llm_client = fakes.CountingLLMClient(llm_client)
+        chat_model = self.create_chat_model(counting_llm_client)
+        callbacks = fakes.FakeCallbacks(self.send_latency)
+        callbacks.set_callbacks(chat_model)
+        for entry in inputs:
+            delay = start_time + entry['time'] * self.args.time_scale - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if 'audio_key' in entry:
+                # the recorded transcript is found with the key of the voice note
+                audio = cloudlanguagetools_chatbot.audiodata.AudioData(data=b'', suffix='.ogg', key=entry['audio_key'])
+                await self.run_turn('VOICE', chat_model.process_audio(audio), callbacks, counting_llm_client)
+            else:
+                await self.run_turn('TEXT', chat_model.process_message(entry['text']), callbacks, counting_llm_client)
+        self.session_states.append(chat_model.get_state())
+
+    async def run_replay(self):
+        llm_client = cloudlanguagetools_chatbot.recording.ReplayLLMClient(self.recording,
+            cloudlanguagetools_chatbot.chatmodel.ChatModel.build_openai_functions(), latency_scale=self.args.time_scale)
+        sessions = self.recording.get_sessions()
+        start_time = time.monotonic()
+        await asyncio.gather(*[self.replay_session(inputs, llm_client, start_time) for inputs in sessions.values()])
+        wall_time = time.monotonic() - start_time
+        return wall_time, None
+
+    async def run_load(self):
+        api_base = await self.llm_server.start()
+        llm_client = cloudlanguagetools_chatbot.client.LLMClient(
+            cloudlanguagetools_chatbot.chatmodel.ChatModel.build_openai_functions(),
+            azure_openai_config={'azure_endpoint': api_base, 'azure_api_key': 'benchmark', 'azure_deployment_name': 'benchmark'})
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+        async def run_session_limited(session_index):
+            async with semaphore:
+                await self.run_session(session_index, llm_client)
+        try:
+            start_time = time.monotonic()
+            await asyncio.gather(*[run_session_limited(i) for i in range(self.args.sessions)])
+            wall_time = time.monotonic() - start_time
+        finally:
+            await llm_client.close()
+            await self.llm_server.stop()
+            if self.recorder != None:
+                self.recorder.close()
+        return wall_time, llm_client.get_stats()
+
+    def measure_session_memory(self):
+        """memory used by the chat models of idle sessions, restored from the states at the end of the run.
+        measured separately, tracemalloc would slow down the timed run"""
+        llm_client = fakes.CountingLLMClient(cloudlanguagetools_chatbot.client.LLMClient(
+            cloudlanguagetools_chatbot.chatmodel.ChatModel.build_openai_functions(),
+            azure_openai_config={'azure_endpoint': 'http://127.0.0.1', 'azure_api_key': 'benchmark', 'azure_deployment_name': 'benchmark'}))
+        state_json_list = [json.dumps(state, ensure_ascii=False) for state in self.session_states]
+        gc.collect()
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        chat_models = []
+        for state_json in state_json_list:
+            chat_model = self.create_chat_model(llm_client)
+            # like the session store, which restores the state from json
+            chat_model.load_state(json.loads(state_json))
+            chat_models.append(chat_model)
+        gc.collect()
+        used = tracemalloc.get_traced_memory()[0] - baseline
+        tracemalloc.stop()
+        state_sizes = [len(state_json.encode('utf-8')) for state_json in state_json_list]
+        return {
+            'memory_per_session_bytes': used / len(chat_models) if len(chat_models) > 0 else 0,
+            'state_bytes_per_session': sum(state_sizes) / len(state_sizes) if len(state_sizes) > 0 else 0
+        }
+
+    def run(self):
+        if self.recording != None:
+            wall_time, llm_client_stats = asyncio.run(self.run_replay())
+        else:
+            wall_time, llm_client_stats = asyncio.run(self.run_load())
+        turn_count = len(self.turn_results)
+        input_types = sorted(set([turn_result['input_type'] for turn_result in self.turn_results]))
+        round_trips = [turn_result['llm_round_trips'] for turn_result in self.turn_results]
+        results = {
+            'turns': turn_count,
+            'sessions': len(self.session_states),
+            'errors': self.errors,
+            'wall_time': wall_time,
+            'throughput_turns_per_second': turn_count / wall_time if wall_time > 0 else 0.0,
+            'latency': get_percentiles([turn_result['latency'] for turn_result in self.turn_results]),
+            'time_to_first_output': get_percentiles([turn_result['time_to_first_output'] for turn_result in self.turn_results
+                                                     if turn_result['time_to_first_output'] != None]),
+            'llm_round_trips_per_turn': sum(round_trips) / turn_count if turn_count > 0 else 0.0,
+            'by_input_type': {input_type: {
+                'latency': get_percentiles([turn_result['latency'] for turn_result in self.turn_results if turn_result['input_type'] == input_type]),
+                'llm_round_trips_per_turn': get_percentiles([turn_result['llm_round_trips'] for turn_result in self.turn_results if turn_result['input_type'] == input_type])['mean']
+            } for input_type in input_types},
+            'llm_requests': self.llm_server.request_count if self.llm_server != None else sum(round_trips),
+            'llm_categorize_requests': self.llm_server.categorize_count if self.llm_server != None else None,
+            'llm_compile_requests': self.llm_server.compile_count if self.llm_server != None else None,
+            'llm_detect_language_requests': self.llm_server.detect_language_count if self.llm_server != None else None,
+            'tool_plan_cache': self.tool_plan_cache.get_stats(),
+            'turn_cache': self.turn_cache.get_stats() if self.turn_cache != None else None,
+            'tool_calls': getattr(self.chatapi, 'call_counts', None),
+            'llm_client': llm_client_stats,
+            'result_cache': self.result_cache.get_stats(),
+            'single_flight': self.single_flight.get_stats(),
+            'tool_executor': self.tool_executor.get_stats(),
+            'audio_cache': self.audio_cache.get_stats() if self.audio_cache != None else None,
+            'replay': self.recording.get_stats() if self.recording != None else None,
+        }
+        results.update(self.measure_session_memory())
+        return {
+            'benchmark': 'chatmodel',
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'git_revision': get_git_revision(),
+            'python_version': platform.python_version(),
+            'config': {
+                'sessions': self.args.sessions,
+                'concurrency': self.args.concurrency,
+                'replay': self.args.replay,
+                'llm_latency': self.llm_server.latency.to_json() if self.llm_server != None else None,
+                'stream_chunk_latency': self.llm_server.stream_chunk_latency.to_json() if self.llm_server != None else None,
+                'tool_latency': fakes.Latency.parse(self.args.tool_latency, self.args.time_scale).to_json() if self.llm_server != None else None,
+                'send_latency': self.send_latency.to_json(),
+                'think_time': self.args.think_time,
+                'time_scale': self.args.time_scale,
+                'streaming': self.args.streaming,
+                'speculative_execution': self.args.speculative_execution,
+                'tool_plans': self.args.tool_plans,
+                'turn_cache': self.args.turn_cache,
+                'unique_inputs': self.args.unique_inputs,
+                'audio_cache': self.args.audio_cache,
+                'scenario_turns': len(self.scenario) if self.recording == None else None
+            },
+            'results': results
+        }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='offline benchmark of ChatModel.process_message')
+    parser.add_argument('--sessions', type=int, default=50, help='number of simulated chats')
+    parser.add_argument('--concurrency', type=int, default=10, help='chats running at the same time')
+    parser.add_argument('--llm-latency', default='lognormal:0.6:0.3', help='latency of a chat completion, see fakes.Latency')
+    parser.add_argument('--stream-chunk-latency', default='constant:0.02')
+    parser.add_argument('--tool-latency', default='lognormal:0.3:0.3', help='latency of the language services')
+    parser.add_argument('--send-latency', default='constant:0.05', help='latency of a telegram call')
+    parser.add_argument('--think-time', type=float, default=0.0, help='seconds between two messages of a chat')
+    parser.add_argument('--time-scale', type=float, default=1.0, help='multiplies all latencies, for quick runs')
+    parser.add_argument('--scenario', default=None, help='json file with the turns of a chat, see fakes.DEFAULT_SCENARIO')
+    parser.add_argument('--unique-inputs', action='store_true')
+    parser.add_argument('--audio-cache', action='store_true', help='use an audio cache, in a temporary directory')
+    parser.add_argument('--no-streaming', dest='streaming', action='store_false')
+    parser.add_argument('--speculative-execution', action='store_true')
+    parser.add_argument('--turn-cache', action='store_true', help='replay the outputs of new sentences seen before')
+    parser.add_argument('--tool-plans', action='store_true', help='run the plan compiled from the instruction on new sentences')
+    parser.add_argument('--replay', nargs='+', default=None, help='replay the chats of these traffic recordings instead of the scenario')
+    parser.add_argument('--record', default=None, help='record the traffic of the scenario run to this file')
+    parser.add_argument('--output', default=None, help='write the results to this json file')
+    return parser.parse_args(argv)
+
+def main():
+    args = parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.WARNING)
+
+    results = Benchmark(args).run()
+    results_json = json.dumps(results, indent=4, ensure_ascii=False)
+    if args.output != None:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(results_json)
+    print(results_json)
+
+if __name__ == '__main__':
+    main()
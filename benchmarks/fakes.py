@@ -0,0 +1,324 @@
+import asyncio
+import json
+import logging
+import random
+import tempfile
+import time
+
+import aiohttp.web
+import cloudlanguagetools.languages
+
+logger = logging.getLogger(__name__)
+
+# local stand-ins for Azure OpenAI, the cloudlanguagetools ChatAPI and the telegram callbacks,
+# used by the offline benchmarks
+
+CATEGORIZE_FUNCTION_NAME = 'category_input_type'
+COMPILE_FUNCTION_NAME = 'compile_instructions'
+DETECT_LANGUAGE_FUNCTION_NAME = 'detect_input_language'
+
+# what any instruction compiles to, like the default instruction: translate to english, then pronounce
+# the query models accept the CommonLanguage values, such as 'Chinese' or 'English', not the member names
+ZH_CN = cloudlanguagetools.languages.CommonLanguage.zh_cn.value
+EN = cloudlanguagetools.languages.CommonLanguage.en.value
+FR = cloudlanguagetools.languages.CommonLanguage.fr.value
+
+DEFAULT_TOOL_PLAN = {
+    'applicable': True,
+    'input_language': None,
+    'steps': [
+        {'function_name': 'translate_or_lookup', 'target_language': cloudlanguagetools.languages.CommonLanguage.en.value},
+        {'function_name': 'pronounce'}
+    ]
+}
+
+"""
+a latency distribution, in seconds. specified as a string:
+constant:0.5  uniform:0.2:1.0  normal:0.5:0.1  lognormal:0.5:0.4 (median, sigma)
+"""
+class Latency():
+    def __init__(self, distribution='constant', parameters=(0.0,), scale=1.0):
+        self.distribution = distribution
+        self.parameters = [float(p) for p in parameters]
+        self.scale = scale
+
+    @classmethod
+    def parse(cls, spec, scale=1.0) -> 'Latency':
+        components = spec.split(':')
+        if components[0] not in ['constant', 'uniform', 'normal', 'lognormal']:
+            raise ValueError(f'unknown latency distribution: {spec}')
+        return cls(components[0], components[1:], scale=scale)
+
+    def sample(self) -> float:
+        if self.distribution == 'constant':
+            value = self.parameters[0]
+        elif self.distribution == 'uniform':
+            value = random.uniform(self.parameters[0], self.parameters[1])
+        elif self.distribution == 'normal':
+            value = random.gauss(self.parameters[0], self.parameters[1])
+        else:
+            value = random.lognormvariate(0, self.parameters[1]) * self.parameters[0]
+        return max(0.0, value * self.scale)
+
+    def to_json(self):
+        return {'distribution': self.distribution, 'parameters': self.parameters, 'scale': self.scale}
+
+# a turn: the user input, how the model categorizes it, and the responses of the model for this input,
+# one per round trip. '{input}' in the tool call arguments is replaced by the user input
+DEFAULT_SCENARIO = [
+    {
+        'input': '我想吃中餐',
+        'input_type': 'NEW_SENTENCE',
+        'steps': [
+            {'tool_calls': [
+                ['translate_or_lookup', {'input_text': '{input}', 'source_language': ZH_CN, 'target_language': EN}],
+                ['transliterate', {'input_text': '{input}', 'language': ZH_CN}],
+                ['pronounce', {'input_text': '{input}', 'language': ZH_CN}],
+            ]},
+            {'content': 'I want to eat Chinese food.'}
+        ]
+    },
+    {
+        'input': 'what does 中餐 mean?',
+        'input_type': 'QUESTION_OR_COMMAND',
+        'steps': [
+            {'tool_calls': [
+                ['translate_or_lookup', {'input_text': '中餐', 'source_language': ZH_CN, 'target_language': EN}],
+            ]},
+            {'content': '中餐 means Chinese food, 中 is short for 中国 (China) and 餐 means meal.'}
+        ]
+    },
+    {
+        'input': 'Je ne suis pas intéressé.',
+        'input_type': 'NEW_SENTENCE',
+        'steps': [
+            {'tool_calls': [
+                ['translate_or_lookup', {'input_text': '{input}', 'source_language': FR, 'target_language': EN}],
+                ['breakdown', {'input_text': '{input}', 'language': FR}],
+            ]},
+            {'content': 'I am not interested.'}
+        ]
+    },
+    {
+        'input': 'explain the grammar of this sentence',
+        'input_type': 'QUESTION_OR_COMMAND',
+        'steps': [
+            {'content': 'The sentence uses the negation ne ... pas around the verb être, conjugated in the first person: '
+                        'je suis. Intéressé is the past participle of intéresser, used as an adjective, and agrees with the subject.'}
+        ]
+    },
+]
+
+def get_turn(scenario, input_text):
+    # inputs may carry a suffix, to make them unique per session
+    for turn in scenario:
+        if input_text.startswith(turn['input']):
+            return turn
+    return None
+
+def get_turn_language(turn):
+    """the language of the input of a turn, from the arguments of its first tool call"""
+    for step in turn['steps']:
+        for function_name, arguments in step.get('tool_calls', []):
+            language = arguments.get('source_language', arguments.get('language', None))
+            if language != None:
+                return language
+    return cloudlanguagetools.languages.CommonLanguage.en.value
+
+def format_arguments(arguments, input_text):
+    return {key: value.replace('{input}', input_text) if isinstance(value, str) else value for key, value in arguments.items()}
+
+"""
+an HTTP server which answers chat completion requests like Azure OpenAI, following a scenario.
+the response is chosen from the last user message (the current input) and the number of assistant
+messages which follow it (the round trip within the turn). supports streaming (server-sent events).
+"""
+class FakeChatCompletionServer():
+    def __init__(self, scenario=DEFAULT_SCENARIO, latency=None, stream_chunk_latency=None):
+        self.scenario = scenario
+        self.latency = latency if latency != None else Latency()
+        # delay between two streamed chunks
+        self.stream_chunk_latency = stream_chunk_latency if stream_chunk_latency != None else Latency()
+        self.request_count = 0
+        self.categorize_count = 0
+        self.compile_count = 0
+        self.detect_language_count = 0
+        self.call_id = 0
+        self.runner = None
+
+    def build_response_message(self, request_data):
+        messages = request_data['messages']
+        user_indices = [i for i, message in enumerate(messages) if message['role'] == 'user']
+        input_text = messages[user_indices[-1]]['content'] if len(user_indices) > 0 else ''
+        turn = get_turn(self.scenario, input_text)
+        forced_function_name = request_data['function_call']['name'] if request_data.get('function_call', None) not in [None, 'auto'] else None
+        if forced_function_name == COMPILE_FUNCTION_NAME:
+            self.compile_count += 1
+            return {'role': 'assistant', 'content': None,
+                    'function_call': {'name': COMPILE_FUNCTION_NAME, 'arguments': json.dumps(DEFAULT_TOOL_PLAN)}}
+        if forced_function_name == DETECT_LANGUAGE_FUNCTION_NAME:
+            self.detect_language_count += 1
+            arguments = {'language': get_turn_language(turn) if turn != None else cloudlanguagetools.languages.CommonLanguage.en.value}
+            return {'role': 'assistant', 'content': None,
+                    'function_call': {'name': DETECT_LANGUAGE_FUNCTION_NAME, 'arguments': json.dumps(arguments)}}
+        if forced_function_name != None:
+            self.categorize_count += 1
+            input_type = turn['input_type'] if turn != None else 'QUESTION_OR_COMMAND'
+            arguments = {'input_type': input_type, 'instructions': None}
+            return {'role': 'assistant', 'content': None,
+                    'function_call': {'name': CATEGORIZE_FUNCTION_NAME, 'arguments': json.dumps(arguments)}}
+        if turn == None:
+            return {'role': 'assistant', 'content': 'ok'}
+        step_index = len([message for message in messages[user_indices[-1]:] if message['role'] == 'assistant'])
+        step = turn['steps'][min(step_index, len(turn['steps']) - 1)]
+        if 'tool_calls' in step:
+            tool_calls = []
+            for function_name, arguments in step['tool_calls']:
+                self.call_id += 1
+                tool_calls.append({'id': f'call_{self.call_id}', 'type': 'function',
+                                   'function': {'name': function_name, 'arguments': json.dumps(format_arguments(arguments, input_text), ensure_ascii=False)}})
+            return {'role': 'assistant', 'content': None, 'tool_calls': tool_calls}
+        return {'role': 'assistant', 'content': step['content']}
+
+    async def handle_chat_completion(self, request):
+        self.request_count += 1
+        request_data = await request.json()
+        message = self.build_response_message(request_data)
+        await asyncio.sleep(self.latency.sample())
+        if not request_data.get('stream', False):
+            return aiohttp.web.json_response({
+                'id': f'chatcmpl-{self.request_count}',
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'choices': [{'index': 0, 'finish_reason': 'stop', 'message': message}],
+                'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
+            })
+        response = aiohttp.web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        deltas = []
+        if message.get('content', None) != None:
+            words = message['content'].split(' ')
+            deltas = [{'content': word if i == 0 else ' ' + word} for i, word in enumerate(words)]
+        for index, tool_call in enumerate(message.get('tool_calls', None) or []):
+            deltas.append({'tool_calls': [dict(tool_call, index=index)]})
+        for delta in deltas:
+            chunk = {'id': f'chatcmpl-{self.request_count}', 'object': 'chat.completion.chunk',
+                     'choices': [{'index': 0, 'finish_reason': None, 'delta': delta}]}
+            await response.write(f'data: {json.dumps(chunk)}\n\n'.encode('utf-8'))
+            await asyncio.sleep(self.stream_chunk_latency.sample())
+        await response.write(b'data: [DONE]\n\n')
+        await response.write_eof()
+        return response
+
+    async def start(self) -> str:
+        """returns the endpoint, to be used as azure_endpoint"""
+        web_application = aiohttp.web.Application()
+        web_application.router.add_post('/openai/deployments/{deployment}/chat/completions', self.handle_chat_completion)
+        self.runner = aiohttp.web.AppRunner(web_application, access_log=None)
+        await self.runner.setup()
+        site = aiohttp.web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        return f'http://127.0.0.1:{port}'
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+"""
+stands in for cloudlanguagetools.chatapi.ChatAPI. the calls block, like the real ones, and run on the tool executor
+"""
+class FakeChatAPI():
+    def __init__(self, latencies=None, audio_size=20000):
+        # function name -> Latency
+        self.latencies = latencies if latencies != None else {}
+        self.audio_size = audio_size
+        self.call_counts = {}
+
+    def simulate_call(self, function_name):
+        self.call_counts[function_name] = self.call_counts.get(function_name, 0) + 1
+        latency = self.latencies.get(function_name, None)
+        if latency != None:
+            time.sleep(latency.sample())
+
+    def translate_or_lookup(self, query):
+        self.simulate_call('translate_or_lookup')
+        return f'translation of {query.input_text}'
+
+    def transliterate(self, query):
+        self.simulate_call('transliterate')
+        return f'transliteration of {query.input_text}'
+
+    def breakdown(self, query):
+        self.simulate_call('breakdown')
+        return f'breakdown of {query.input_text}: ' + ', '.join(query.input_text.split(' '))
+
+    def audio(self, query, format):
+        self.simulate_call('audio')
+        audio_tempfile = tempfile.NamedTemporaryFile(prefix='clt_chatbot_benchmark_', suffix='.mp3')
+        audio_tempfile.write(bytes(random.getrandbits(8) for i in range(self.audio_size)))
+        audio_tempfile.flush()
+        return audio_tempfile
+
+    def recognize_audio(self, audio, audio_format):
+        self.simulate_call('recognize_audio')
+        return DEFAULT_SCENARIO[0]['input']
+
+"""
+the send_* callbacks of a chat, like the telegram ones. records when the user first sees an output
+"""
+class FakeCallbacks():
+    def __init__(self, latency=None):
+        self.latency = latency if latency != None else Latency()
+        self.turn_start_time = None
+        self.first_output_time = None
+        self.message_count = 0
+        self.audio_count = 0
+        self.status_messages = []
+
+    def start_turn(self):
+        self.turn_start_time = time.monotonic()
+        self.first_output_time = None
+
+    def get_time_to_first_output(self):
+        if self.first_output_time == None:
+            return None
+        return self.first_output_time - self.turn_start_time
+
+    async def output(self):
+        if self.first_output_time == None:
+            self.first_output_time = time.monotonic()
+        await asyncio.sleep(self.latency.sample())
+
+    async def send_message(self, message):
+        self.message_count += 1
+        await self.output()
+
+    async def send_audio(self, audio):
+        self.audio_count += 1
+        await self.output()
+
+    async def send_status(self, message):
+        self.status_messages.append(message)
+        await asyncio.sleep(self.latency.sample())
+
+    async def send_message_update(self, text, final):
+        if final:
+            self.message_count += 1
+        await self.output()
+
+    def set_callbacks(self, chat_model):
+        chat_model.set_send_message_callback(self.send_message, self.send_audio, self.send_status, self.send_message_update)
+
+"""
+wraps the LLM client shared by all chats, counting the round trips of one chat
+"""
+class CountingLLMClient():
+    def __init__(self, llm_client):
+        self.llm_client = llm_client
+        self.functions = llm_client.functions
+        self.tools = llm_client.tools
+        self.request_count = 0
+
+    async def chat_completion(self, **kwargs):
+        self.request_count += 1
+        return await self.llm_client.chat_completion(**kwargs)
@@ -0,0 +1,221 @@
+import asyncio
+import collections
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+# a file returned by the cache may still be queued for upload, for as long as the outbound retries take
+DEFAULT_EVICTION_GRACE_PERIOD = 300.0
+# the directory is scanned again at this interval, to count the files added by the other processes
+DEFAULT_SCAN_INTERVAL = 60.0
+
+"""
+content-addressed cache of text to speech audio files. the key is a hash of the audio query
+(input text, language, service, voice options) and the audio format. files are stored in a directory,
+and the least recently used files are deleted when the total size exceeds the byte budget.
+the modification time of a file is its last use. files used within the grace period aren't deleted, the
+cache can go over the budget meanwhile. processes sharing the directory, such as the webhook workers, share
+the budget: each one scans the directory regularly and evicts from all the files. the scans and the
+writes of get_or_synthesize run on a thread.
+"""
+class AudioCache():
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES, eviction_grace_period=DEFAULT_EVICTION_GRACE_PERIOD,
+                 scan_interval=DEFAULT_SCAN_INTERVAL):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.eviction_grace_period = eviction_grace_period
+        self.scan_interval = scan_interval
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # key -> (path, size), in least recently used order
+        self.entries = collections.OrderedDict()
+        self.total_bytes = 0
+        self.last_scan_time = None
+        self.lock = threading.Lock()
+        # one lock per key being synthesized, so that concurrent requests for the same audio only synthesize once
+        self.key_locks = {}
+        self.key_lock_users = collections.Counter()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.load_entries()
+
+    def load_entries(self):
+        """pick up the files left by a previous run or added by other processes, oldest first.
+        blocks on the directory scan, not to be called from the event loop"""
+        file_list = []
+        for filename in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, filename)
+            if filename.startswith('.') or not os.path.isfile(path):
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                # evicted by another process meanwhile
+                continue
+            file_list.append((stat.st_mtime, os.path.splitext(filename)[0], path, stat.st_size))
+        # the directory is scanned without the lock, get_path isn't held up
+        with self.lock:
+            previous_entries = self.entries
+            self.entries = collections.OrderedDict()
+            self.total_bytes = 0
+            for mtime, key, path, size in sorted(file_list):
+                self.entries[key] = (path, size)
+                self.total_bytes += size
+            # files stored during the scan
+            for key, (path, size) in previous_entries.items():
+                if key not in self.entries and os.path.exists(path):
+                    self.entries[key] = (path, size)
+                    self.total_bytes += size
+            self.last_scan_time = time.monotonic()
+            self.evict()
+
+    @staticmethod
+    def get_key(query, audio_format) -> str:
+        key_data = {
+            'query': query.model_dump(mode='json'),
+            'audio_format': audio_format.name
+        }
+        return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def get_path(self, key):
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry != None:
+                path, size = entry
+                try:
+                    # the modification time records the LRU order across restarts and processes,
+                    # and protects the file from eviction while it's being sent
+                    os.utime(path)
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    metrics.cache_requests.inc(cache='audio', function='pronounce', result='hit')
+                    return path
+                except FileNotFoundError:
+                    # evicted by another process
+                    pass
+                del self.entries[key]
+                self.total_bytes -= size
+            self.misses += 1
+            metrics.cache_requests.inc(cache='audio', function='pronounce', result='miss')
+            return None
+
+    def put_file(self, key, source_path):
+        """copy the audio file into the cache, returns the path of the cached file"""
+        suffix = os.path.splitext(source_path)[1]
+        path = os.path.join(self.cache_dir, key + suffix)
+        # write to a temporary file in the cache directory, then rename, so that readers never see a partial file
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, prefix='.', suffix=suffix)
+        with os.fdopen(fd, 'wb') as temp_file:
+            with open(source_path, 'rb') as source_file:
+                shutil.copyfileobj(source_file, temp_file)
+        os.replace(temp_path, path)
+        self.add_entry(key, path)
+        return path
+
+    def add_entry(self, key, path):
+        size = os.path.getsize(path)
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entries[key][1]
+            self.entries[key] = (path, size)
+            self.entries.move_to_end(key)
+            self.total_bytes += size
+            scan = time.monotonic() - self.last_scan_time >= self.scan_interval
+            if scan:
+                # only one thread scans
+                self.last_scan_time = time.monotonic()
+            else:
+                self.evict()
+        if scan:
+            # the new file is found again by the scan
+            self.load_entries()
+
+    def put_audio(self, key, audio_data):
+        """store an AudioData, returns the path of the cached file"""
+        if not audio_data.in_memory:
+            return self.put_file(key, audio_data.path)
+        path = os.path.join(self.cache_dir, key + audio_data.suffix)
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, prefix='.', suffix=audio_data.suffix)
+        with os.fdopen(fd, 'wb') as temp_file:
+            audio_data.write_to(temp_file)
+        os.replace(temp_path, path)
+        self.add_entry(key, path)
+        return path
+
+    def evict(self):
+        # must be called with the lock held
+        now = time.time()
+        # each entry is looked at once at most, they may all be in use
+        candidate_count = len(self.entries)
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1 and candidate_count > 0:
+            candidate_count -= 1
+            key, (path, size) = next(iter(self.entries.items()))
+            try:
+                last_used_time = os.path.getmtime(path)
+            except FileNotFoundError:
+                # evicted by another process
+                del self.entries[key]
+                self.total_bytes -= size
+                continue
+            if now - last_used_time < self.eviction_grace_period:
+                # returned recently, here or by another process, it may not have been sent yet
+                self.entries.move_to_end(key)
+                continue
+            del self.entries[key]
+            self.total_bytes -= size
+            self.evictions += 1
+            logger.debug(f'evicting audio cache entry {key}')
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    async def get_or_synthesize(self, key, synthesize_fn):
+        """return the path of the cached audio, calling synthesize_fn (async, returns an AudioData)
+        on a miss. concurrent calls for the same key wait for the first one to finish."""
+        path = self.get_path(key)
+        if path != None:
+            return path
+        key_lock = self.key_locks.setdefault(key, asyncio.Lock())
+        # the lock is shared until its last user is done, a released lock can still have waiters
+        self.key_lock_users[key] += 1
+        try:
+            async with key_lock:
+                # another coroutine may have synthesized it while we were waiting
+                with self.lock:
+                    entry = self.entries.get(key, None)
+                if entry != None and os.path.exists(entry[0]):
+                    return entry[0]
+                audio_data = await synthesize_fn()
+                def store():
+                    try:
+                        return self.put_audio(key, audio_data)
+                    finally:
+                        audio_data.close()
+                # the file is written, and the directory may be scanned, on a thread
+                return await asyncio.get_running_loop().run_in_executor(None, store)
+        finally:
+            self.key_lock_users[key] -= 1
+            if self.key_lock_users[key] == 0:
+                del self.key_lock_users[key]
+                del self.key_locks[key]
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'total_bytes': self.total_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
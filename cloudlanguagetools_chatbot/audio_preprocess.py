@@ -0,0 +1,136 @@
+import io
+import logging
+import threading
+import time
+from typing import Optional
+
+import pydub
+import pydub.silence
+import pydub.utils
+import cloudlanguagetools.options
+
+from . import audiodata
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# speech recognizers work at 16kHz, mono
+DEFAULT_SAMPLE_RATE = 16000
+DEFAULT_MAX_DURATION_SECONDS = 60
+# a chunk is silent when its energy is this far below the loudest part of the voice note
+DEFAULT_SILENCE_THRESHOLD_DB = -35
+SILENCE_CHUNK_MS = 10
+# kept around the speech, so that the first and last syllables aren't cut
+SILENCE_PADDING_MS = 200
+# mp3 is decoded by all the recognizers, and at this bitrate it's smaller than the telegram ogg/opus
+DEFAULT_OUTPUT_FORMAT = 'mp3'
+DEFAULT_OUTPUT_BITRATE = '32k'
+# also the names of the cloudlanguagetools AudioFormat members, looked up when a voice note is encoded:
+# older cloudlanguagetools versions don't have AudioFormat.wav
+OUTPUT_FORMATS = ['mp3', 'wav']
+
+def is_available() -> bool:
+    """pydub needs ffmpeg to decode the telegram voice notes"""
+    return pydub.utils.which('ffmpeg') != None
+
+"""
+a voice note, ready to be recognized
+"""
+class PreprocessedAudio():
+    def __init__(self, audio: Optional[audiodata.AudioData], audio_format: Optional[cloudlanguagetools.options.AudioFormat], input_duration, output_duration, input_size, output_size):
+        # None if the voice note is silent, and so is the format
+        self.audio = audio
+        self.audio_format = audio_format
+        self.input_duration = input_duration
+        self.output_duration = output_duration
+        self.input_size = input_size
+        self.output_size = output_size
+
+"""
+shrinks voice notes before speech recognition: the leading and trailing silence is trimmed, with an energy threshold
+relative to the loudest part of the note, the audio is downmixed to mono, resampled to the rate of the recognizer,
+capped to a maximum duration and encoded at a low bitrate. runs on an executor thread, ffmpeg does the decoding
+and encoding.
+"""
+class AudioPreprocessor():
+    def __init__(self, sample_rate=DEFAULT_SAMPLE_RATE, max_duration_seconds=DEFAULT_MAX_DURATION_SECONDS,
+                 silence_threshold_db=DEFAULT_SILENCE_THRESHOLD_DB, output_format=DEFAULT_OUTPUT_FORMAT,
+                 output_bitrate=DEFAULT_OUTPUT_BITRATE):
+        self.sample_rate = sample_rate
+        self.max_duration_seconds = max_duration_seconds
+        self.silence_threshold_db = silence_threshold_db
+        self.output_format = output_format
+        self.output_bitrate = output_bitrate
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f'unsupported output format: {output_format}')
+        self.lock = threading.Lock()
+        self.processed_count = 0
+        self.silent_count = 0
+        self.total_input_bytes = 0
+        self.total_output_bytes = 0
+        self.total_input_duration = 0.0
+        self.total_output_duration = 0.0
+        self.total_time = 0.0
+
+    def trim_silence(self, segment: pydub.AudioSegment) -> pydub.AudioSegment:
+        if len(segment) == 0 or segment.max_dBFS == float('-inf'):
+            # digital silence
+            return segment[0:0]
+        silence_threshold = segment.max_dBFS + self.silence_threshold_db
+        start = pydub.silence.detect_leading_silence(segment, silence_threshold=silence_threshold, chunk_size=SILENCE_CHUNK_MS)
+        if start >= len(segment):
+            return segment[0:0]
+        end = len(segment) - pydub.silence.detect_leading_silence(segment.reverse(), silence_threshold=silence_threshold, chunk_size=SILENCE_CHUNK_MS)
+        return segment[max(0, start - SILENCE_PADDING_MS):min(len(segment), end + SILENCE_PADDING_MS)]
+
+    def preprocess(self, audio: audiodata.AudioData) -> PreprocessedAudio:
+        start_time = time.monotonic()
+        input_size = audio.get_size()
+        with audio.open() as audio_file:
+            segment = pydub.AudioSegment.from_file(audio_file, format=audio.suffix.lstrip('.'))
+        input_duration = segment.duration_seconds
+        segment = segment.set_channels(1).set_frame_rate(self.sample_rate)
+        segment = self.trim_silence(segment)
+        if segment.duration_seconds > self.max_duration_seconds:
+            logger.info(f'voice note of {segment.duration_seconds:.1f}s truncated to {self.max_duration_seconds}s')
+            segment = segment[:self.max_duration_seconds * 1000]
+
+        preprocessed_audio = None
+        audio_format = None
+        output_size = 0
+        if len(segment) > 0:
+            audio_format = cloudlanguagetools.options.AudioFormat[self.output_format]
+            output_file = io.BytesIO()
+            export_kwargs = {}
+            if self.output_format == 'mp3':
+                export_kwargs['bitrate'] = self.output_bitrate
+            segment.export(output_file, format=self.output_format, **export_kwargs)
+            # same voice note, the transcript is cached with the key of the original
+            preprocessed_audio = audiodata.AudioData(data=output_file.getvalue(), suffix=f'.{self.output_format}', key=audio.key)
+            output_size = preprocessed_audio.get_size()
+
+        with self.lock:
+            self.processed_count += 1
+            if preprocessed_audio == None:
+                self.silent_count += 1
+            self.total_input_bytes += input_size
+            self.total_output_bytes += output_size
+            self.total_input_duration += input_duration
+            self.total_output_duration += segment.duration_seconds
+            self.total_time += time.monotonic() - start_time
+        metrics.audio_preprocess_bytes.inc(input_size, stage='input')
+        metrics.audio_preprocess_bytes.inc(output_size, stage='output')
+        logger.info(f'preprocessed voice note: {input_duration:.1f}s {input_size} bytes -> {segment.duration_seconds:.1f}s {output_size} bytes')
+        return PreprocessedAudio(preprocessed_audio, audio_format, input_duration, segment.duration_seconds, input_size, output_size)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'processed': self.processed_count,
+                'silent': self.silent_count,
+                'input_bytes': self.total_input_bytes,
+                'output_bytes': self.total_output_bytes,
+                'input_duration': self.total_input_duration,
+                'output_duration': self.total_output_duration,
+                'total_time': self.total_time
+            }
@@ -0,0 +1,105 @@
+import io
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+# audio larger than this is kept on disk rather than in memory
+DEFAULT_MAX_IN_MEMORY_BYTES = 5 * 1024 * 1024
+
+"""
+a voice note or a text to speech output. the audio is kept in memory, unless it's larger than the threshold,
+then it stays in a file. the cloudlanguagetools functions expect a file with a .name: for audio held in memory,
+a temporary file is only written when .name is accessed, and deleted with this object.
+"""
+class AudioData():
+    def __init__(self, data: bytes = None, path: str = None, suffix='.mp3', owned_file=None, key=None):
+        # data, path or both (once a file has been written for audio held in memory)
+        self.data = data
+        self.path = path
+        self.suffix = suffix
+        # for text to speech audio, the hash of the request (see AudioCache.get_key),
+        # for telegram voice notes, the file_unique_id
+        self.key = key
+        # temporary file holding the audio, kept open so that it's not deleted while the audio is used
+        self.owned_file = owned_file
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_bytes(cls, data, suffix='.mp3', max_in_memory_bytes=DEFAULT_MAX_IN_MEMORY_BYTES) -> 'AudioData':
+        data = bytes(data)
+        if len(data) <= max_in_memory_bytes:
+            return cls(data=data, suffix=suffix)
+        audio_tempfile = tempfile.NamedTemporaryFile(prefix='clt_chatbot_audio_', suffix=suffix)
+        audio_tempfile.write(data)
+        audio_tempfile.flush()
+        return cls(path=audio_tempfile.name, suffix=suffix, owned_file=audio_tempfile)
+
+    @classmethod
+    def from_tempfile(cls, audio_tempfile, max_in_memory_bytes=DEFAULT_MAX_IN_MEMORY_BYTES) -> 'AudioData':
+        """take over a NamedTemporaryFile, such as the ones returned by chatapi.audio. small files are
+        read into memory, and the temporary file is closed (and deleted) right away"""
+        suffix = os.path.splitext(audio_tempfile.name)[1]
+        if os.path.getsize(audio_tempfile.name) > max_in_memory_bytes:
+            return cls(path=audio_tempfile.name, suffix=suffix, owned_file=audio_tempfile)
+        with open(audio_tempfile.name, 'rb') as f:
+            data = f.read()
+        audio_tempfile.close()
+        return cls(data=data, suffix=suffix)
+
+    @classmethod
+    def from_path(cls, path, key=None) -> 'AudioData':
+        """a file which is managed by someone else, for example the audio cache. it's read when needed"""
+        return cls(path=path, suffix=os.path.splitext(path)[1], key=key)
+
+    @property
+    def in_memory(self) -> bool:
+        return self.data != None
+
+    @property
+    def name(self) -> str:
+        """path of a file containing the audio"""
+        with self.lock:
+            if self.path == None:
+                self.owned_file = tempfile.NamedTemporaryFile(prefix='clt_chatbot_audio_', suffix=self.suffix)
+                self.owned_file.write(self.data)
+                self.owned_file.flush()
+                self.path = self.owned_file.name
+            return self.path
+
+    def get_bytes(self) -> bytes:
+        if self.data != None:
+            return self.data
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def open(self):
+        """a binary file object to read the audio from"""
+        if self.data != None:
+            return io.BytesIO(self.data)
+        return open(self.path, 'rb')
+
+    def read(self) -> bytes:
+        return self.get_bytes()
+
+    def write_to(self, file_obj):
+        if self.data != None:
+            file_obj.write(self.data)
+        else:
+            with open(self.path, 'rb') as f:
+                shutil.copyfileobj(f, file_obj)
+
+    def get_size(self) -> int:
+        if self.data != None:
+            return len(self.data)
+        return os.path.getsize(self.path)
+
+    def close(self):
+        if self.owned_file != None:
+            self.owned_file.close()
+            self.owned_file = None
+            if self.data != None:
+                self.path = None
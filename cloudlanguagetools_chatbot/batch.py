@@ -0,0 +1,198 @@
+import asyncio
+import csv
+import json
+import logging
+import os
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+# the arguments of each function, when the functions are called directly rather than chosen by the LLM
+FUNCTION_ARGUMENTS = {
+    'translate_or_lookup': lambda item: {'input_text': item['text'], 'source_language': item['source_language'], 'target_language': item['target_language']},
+    'transliterate': lambda item: {'input_text': item['text'], 'language': item['source_language']},
+    'breakdown': lambda item: {'input_text': item['text'], 'language': item['source_language'], 'translation_language': item['target_language']},
+    'pronounce': lambda item: {'input_text': item['text'], 'language': item['source_language']},
+}
+
+def read_items(path, text_column='text', source_language=None, target_language=None):
+    """sentences from a CSV file with a header, or a JSONL file. besides the text, rows may have an id,
+    and a source_language / target_language overriding the defaults"""
+    if path.endswith('.jsonl'):
+        with open(path, 'r', encoding='utf-8') as f:
+            rows = [json.loads(line) for line in f if len(line.strip()) > 0]
+    else:
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            rows = list(csv.DictReader(f))
+    items = []
+    for index, row in enumerate(rows):
+        text = row.get(text_column, None)
+        if text == None or len(text.strip()) == 0:
+            logger.warning(f'row {index}: no {text_column}, skipping')
+            continue
+        items.append({
+            'index': index,
+            'id': row.get('id', None) or str(index),
+            'text': text.strip(),
+            'source_language': row.get('source_language', None) or source_language,
+            'target_language': row.get('target_language', None) or target_language,
+        })
+    return items
+
+def read_completed_indices(output_path):
+    """the output doubles as the checkpoint: rows with a result are not processed again, failed ones are"""
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if len(line.strip()) == 0:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.decoder.JSONDecodeError:
+                # the last line may be truncated if the previous run was killed
+                continue
+            if entry.get('error', None) == None:
+                completed.add(entry['index'])
+    return completed
+
+def group_by_language_pair(items):
+    """the language services have no batch API, the sentences of a language pair are processed together instead,
+    so that the service selection and the connections to a provider are reused, and the rate limits of one
+    provider are reached one pair at a time. the order is kept within a pair"""
+    return sorted(items, key=lambda item: (item['source_language'] or '', item['target_language'] or ''))
+
+def get_audio_filename(item_id, audio_index, suffix):
+    safe_id = re.sub(r'[^\w.-]', '_', item_id)
+    return f'{safe_id}_{audio_index}{suffix}'
+
+"""
+collects the outputs of a chat model for one sentence
+"""
+class BatchOutput():
+    def __init__(self):
+        self.messages = []
+        self.audio_list = []
+        self.status_messages = []
+
+    async def send_message(self, message):
+        self.messages.append(message)
+
+    async def send_audio(self, audio):
+        self.audio_list.append(audio)
+
+    async def send_status(self, message):
+        self.status_messages.append(message)
+
+"""
+runs a list of sentences through chat models, with bounded concurrency. each sentence gets a new chat model,
+from create_chat_model_fn, so that sentences don't share history. either the LLM follows the instruction, or
+the given functions are called directly, which skips the LLM round trips.
+results are appended to a JSONL file as they complete, audio is written to audio_dir.
+"""
+class BatchProcessor():
+    def __init__(self, create_chat_model_fn, output_path, audio_dir=None, instruction=None, functions=None, concurrency=8):
+        self.create_chat_model_fn = create_chat_model_fn
+        self.output_path = output_path
+        self.audio_dir = audio_dir
+        self.instruction = instruction
+        self.functions = functions
+        self.concurrency = concurrency
+        self.output_file = None
+        self.completed_count = 0
+        self.error_count = 0
+        self.skipped_count = 0
+        self.start_time = None
+
+    async def process_item(self, item):
+        chat_model = self.create_chat_model_fn()
+        output = BatchOutput()
+        chat_model.set_send_message_callback(output.send_message, output.send_audio, output.send_status)
+        entry = {'index': item['index'], 'id': item['id'], 'input': item['text']}
+        try:
+            if self.functions != None:
+                # the function calls of one sentence run concurrently, like the tool calls of one LLM response
+                function_call_results = await asyncio.gather(*[chat_model.run_function_call(function_name, FUNCTION_ARGUMENTS[function_name](item))
+                                                              for function_name in self.functions])
+                entry['results'] = {}
+                for function_name, function_call_result in zip(self.functions, function_call_results):
+                    if function_call_result.audio != None:
+                        output.audio_list.append(function_call_result.audio)
+                    else:
+                        entry['results'][function_name] = function_call_result.result
+            else:
+                if self.instruction != None:
+                    chat_model.set_instruction(self.instruction)
+                await chat_model.process_message(item['text'])
+                entry['messages'] = output.messages
+                # process_message reports errors with send_status
+                errors = [status for status in output.status_messages if status.startswith('error')]
+                if len(errors) > 0:
+                    entry['error'] = errors[0]
+            entry['audio'] = self.write_audio(item, output.audio_list)
+        except Exception as e:
+            logger.exception(f'error processing row {item["index"]}')
+            entry['error'] = str(e)
+        finally:
+            for audio in output.audio_list:
+                audio.close()
+        return entry
+
+    def write_audio(self, item, audio_list):
+        filenames = []
+        if self.audio_dir == None:
+            return filenames
+        for audio_index, audio in enumerate(audio_list):
+            filename = get_audio_filename(item['id'], audio_index, audio.suffix)
+            with open(os.path.join(self.audio_dir, filename), 'wb') as f:
+                audio.write_to(f)
+            filenames.append(filename)
+        return filenames
+
+    def write_entry(self, entry):
+        self.output_file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self.output_file.flush()
+        if entry.get('error', None) != None:
+            self.error_count += 1
+        else:
+            self.completed_count += 1
+        processed_count = self.completed_count + self.error_count
+        if processed_count % 100 == 0:
+            elapsed = time.monotonic() - self.start_time
+            logger.info(f'processed {processed_count} rows ({self.error_count} errors), {processed_count / elapsed:.1f} rows/s')
+
+    async def worker(self, item_queue):
+        while True:
+            try:
+                item = item_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            self.write_entry(await self.process_item(item))
+
+    async def run(self, items):
+        completed_indices = read_completed_indices(self.output_path)
+        pending_items = [item for item in items if item['index'] not in completed_indices]
+        self.skipped_count = len(items) - len(pending_items)
+        if self.skipped_count > 0:
+            logger.info(f'resuming, {self.skipped_count} rows already processed')
+        if self.audio_dir != None:
+            os.makedirs(self.audio_dir, exist_ok=True)
+        item_queue = asyncio.Queue()
+        for item in group_by_language_pair(pending_items):
+            item_queue.put_nowait(item)
+        self.start_time = time.monotonic()
+        with open(self.output_path, 'a', encoding='utf-8') as self.output_file:
+            await asyncio.gather(*[self.worker(item_queue) for i in range(self.concurrency)])
+        return self.get_stats()
+
+    def get_stats(self):
+        elapsed = time.monotonic() - self.start_time if self.start_time != None else 0
+        return {
+            'completed': self.completed_count,
+            'errors': self.error_count,
+            'skipped': self.skipped_count,
+            'elapsed': elapsed,
+            'rows_per_second': (self.completed_count + self.error_count) / elapsed if elapsed > 0 else 0.0
+        }
@@ -0,0 +1,188 @@
+import asyncio
+import collections
+import concurrent.futures
+import logging
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_TTL_SECONDS = 24 * 3600
+# the sqlite table holds more entries than memory, they're purged every PURGE_INTERVAL inserts
+DISK_ENTRIES_FACTOR = 10
+PURGE_INTERVAL = 1000
+
+"""
+process-wide cache for the results of text-based function calls (translate, transliterate, breakdown).
+entries are kept in memory in LRU order, with a time to live. optionally, entries are also stored
+in an sqlite database, so that they survive restarts. the database is accessed from its own thread:
+the writes happen in the background, and get_async doesn't block the event loop on a memory miss.
+"""
+class FunctionCallCache():
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl_seconds=DEFAULT_TTL_SECONDS, sqlite_path: Optional[str] = None,
+                 max_disk_entries=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        if max_disk_entries == None:
+            max_disk_entries = max_entries * DISK_ENTRIES_FACTOR
+        self.max_disk_entries = max_disk_entries
+        # key -> (expiration time, result)
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.put_count = 0
+        self.db = None
+        self.db_lock = threading.Lock()
+        self.db_executor = None
+        if sqlite_path != None:
+            self.db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self.db.execute('CREATE TABLE IF NOT EXISTS function_call_cache (key TEXT PRIMARY KEY, expiration REAL, result TEXT)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS function_call_cache_expiration ON function_call_cache (expiration)')
+            self.db.commit()
+            # one thread, the writes are applied in order
+            self.db_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='clt_function_call_cache')
+
+    @staticmethod
+    def get_key(function_name, query) -> str:
+        """the key is the function name plus the normalized query, so that argument ordering or
+        default values don't produce different keys"""
+        return f'{function_name}:{query.model_dump_json()}'
+
+    def get(self, key) -> Optional[str]:
+        """blocks on the database on a memory miss, get_async from the event loop"""
+        result = self._get_memory(key)
+        if result == None and self.db != None:
+            result = self._get_disk(key)
+        self._count(result)
+        return result
+
+    async def get_async(self, key) -> Optional[str]:
+        result = self._get_memory(key)
+        if result == None and self.db != None:
+            result = await asyncio.get_running_loop().run_in_executor(self.db_executor, self._get_disk, key)
+        self._count(result)
+        return result
+
+    def put(self, key, result: str):
+        """the entry is in memory when put returns, it's written to the database in the background"""
+        expiration = time.time() + self.ttl_seconds
+        with self.lock:
+            self._store_memory(key, expiration, result)
+            self.put_count += 1
+            purge = self.put_count % PURGE_INTERVAL == 0
+        if self.db != None:
+            self.db_executor.submit(self._put_disk, key, expiration, result)
+            if purge:
+                self.db_executor.submit(self._purge_disk)
+
+    def flush(self):
+        """wait until the pending writes are in the database"""
+        if self.db_executor != None:
+            self.db_executor.submit(lambda: None).result()
+
+    def _get_memory(self, key) -> Optional[str]:
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry == None:
+                return None
+            expiration, result = entry
+            if expiration > now:
+                self.entries.move_to_end(key)
+                return result
+            del self.entries[key]
+            return None
+
+    def _get_disk(self, key) -> Optional[str]:
+        now = time.time()
+        with self.db_lock:
+            row = self.db.execute('SELECT expiration, result FROM function_call_cache WHERE key=?', (key,)).fetchone()
+            if row == None:
+                return None
+            expiration, result = row
+            if expiration <= now:
+                self.db.execute('DELETE FROM function_call_cache WHERE key=?', (key,))
+                self.db.commit()
+                return None
+        with self.lock:
+            self._store_memory(key, expiration, result)
+        return result
+
+    def _put_disk(self, key, expiration, result):
+        try:
+            with self.db_lock:
+                self.db.execute('INSERT OR REPLACE INTO function_call_cache (key, expiration, result) VALUES (?, ?, ?)',
+                                (key, expiration, result))
+                self.db.commit()
+        except Exception:
+            logger.exception('could not store function call result')
+
+    def _purge_disk(self):
+        """expired entries first, then the entries which expire first, beyond max_disk_entries"""
+        try:
+            with self.db_lock:
+                expired_count = self.db.execute('DELETE FROM function_call_cache WHERE expiration <= ?', (time.time(),)).rowcount
+                entry_count = self.db.execute('SELECT COUNT(*) FROM function_call_cache').fetchone()[0]
+                excess_count = max(0, entry_count - self.max_disk_entries)
+                if excess_count > 0:
+                    self.db.execute('DELETE FROM function_call_cache WHERE key IN '
+                                    '(SELECT key FROM function_call_cache ORDER BY expiration LIMIT ?)', (excess_count,))
+                self.db.commit()
+            logger.info(f'function call cache: purged {expired_count} expired and {excess_count} excess entries')
+        except Exception:
+            logger.exception('could not purge function call cache')
+
+    def _count(self, result):
+        with self.lock:
+            if result != None:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _store_memory(self, key, expiration, result):
+        self.entries[key] = (expiration, result)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def purge_expired(self):
+        now = time.time()
+        with self.lock:
+            expired_keys = [key for key, (expiration, result) in self.entries.items() if expiration <= now]
+            for key in expired_keys:
+                del self.entries[key]
+        if self.db != None:
+            self.flush()
+            self._purge_disk()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+        if self.db != None:
+            self.flush()
+            with self.db_lock:
+                self.db.execute('DELETE FROM function_call_cache')
+                self.db.commit()
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+    def close(self):
+        if self.db != None:
+            self.db_executor.shutdown(wait=True)
+            self.db.close()
+
+# shared by all ChatModel instances in the process, unless they are given their own cache
+shared_function_call_cache = FunctionCallCache()
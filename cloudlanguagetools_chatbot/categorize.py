@@ -0,0 +1,173 @@
+import re
+import logging
+import unicodedata
+import pydantic
+from typing import Optional
+from strenum import StrEnum
+from cloudlanguagetools_chatbot import prompts
+
+logger = logging.getLogger(__name__)
+
+class InputType(StrEnum):
+    new_sentence = 'NEW_SENTENCE',
+    question_or_command = 'QUESTION_OR_COMMAND'
+    instructions = 'INSTRUCTIONS'
+
+class CategorizeInputQuery(pydantic.BaseModel):
+    input_type: InputType = pydantic.Field(description=prompts.DESCRIPTION_FLD_IS_NEW_QUESTION)
+    instructions: Optional[str] = pydantic.Field(description=prompts.DESCRIPTION_FLD_INSTRUCTIONS)
+
+DEFAULT_CONFIDENCE_THRESHOLD = 0.8
+
+SCRIPT_LATIN = 'LATIN'
+SCRIPT_OTHER = 'OTHER'
+
+INSTRUCTIONS_PREFIX_RE = re.compile(r'^\s*(your\s+|my\s+|new\s+)?instructions?\s*:\s*', re.IGNORECASE)
+
+# first words of an english question or command about the previous sentence
+QUESTION_OR_COMMAND_WORDS = set([
+    'what', 'whats', "what's", 'how', 'why', 'when', 'where', 'which', 'who', 'whose',
+    'is', 'are', 'can', 'could', 'would', 'should', 'does', 'do', 'did',
+    'explain', 'pronounce', 'translate', 'transliterate', 'break', 'breakdown', 'lookup', 'look',
+    'say', 'repeat', 'tell', 'give', 'show', 'use', 'again', 'more', 'please',
+    'pinyin', 'jyutping', 'romaji', 'furigana', 'romanization', 'transliteration', 'translation', 'meaning',
+])
+
+# question words and commands in the languages learned in non-latin scripts, by script. they can start a question
+# about the previous sentence, asked in the foreign language. matched anywhere in the input for the scripts written
+# without spaces, as words otherwise
+QUESTION_OR_COMMAND_MARKERS = {
+    # chinese, cantonese and japanese kanji
+    'CJK': ['什么', '什麼', '甚麼', '吗', '嗎', '怎么', '怎麼', '怎样', '怎樣', '意思',
+            '解释', '解釋', '翻译', '翻譯', '点解', '點解', '点样', '點樣', '乜嘢', '咩', '何', '意味', '说明', '說明', '説明', '翻訳'],
+    'HIRAGANA': ['何', 'なに', 'なんで', 'どう', 'なぜ', 'どういう', '意味', '教えて', '説明', '翻訳', 'ですか'],
+    'KATAKANA': ['何', 'どう', 'なぜ', '意味', '教えて', '説明', '翻訳', 'ですか'],
+    'HANGUL': ['뭐', '무엇', '무슨', '어떻게', '왜', '설명', '번역', '의미', '뜻'],
+    'CYRILLIC': ['что', 'как', 'почему', 'зачем', 'где', 'когда', 'кто', 'какой', 'какая', 'какое',
+                 'объясни', 'объясните', 'переведи', 'переведите', 'скажи', 'значит', 'значение'],
+}
+SCRIPTS_WITH_SPACES = set(['CYRILLIC'])
+
+def get_script(character) -> Optional[str]:
+    """first word of the unicode name of a letter, for example LATIN, CJK, HIRAGANA, CYRILLIC.
+    returns None for punctuation, digits and spaces"""
+    if not character.isalpha():
+        return None
+    name = unicodedata.name(character, '')
+    if name == '':
+        return SCRIPT_OTHER
+    script = name.split(' ')[0]
+    if script in ['FULLWIDTH', 'HALFWIDTH']:
+        # fullwidth latin letters are still latin
+        script = name.split(' ')[1]
+    return script
+
+def get_dominant_script(text) -> Optional[str]:
+    script_counts = {}
+    for character in text:
+        script = get_script(character)
+        if script != None:
+            script_counts[script] = script_counts.get(script, 0) + 1
+    if len(script_counts) == 0:
+        return None
+    return max(script_counts, key=script_counts.get)
+
+def has_question_or_command_marker(input_sentence, script) -> bool:
+    markers = QUESTION_OR_COMMAND_MARKERS.get(script, [])
+    if script in SCRIPTS_WITH_SPACES:
+        words = re.findall(r"\w+", input_sentence.lower())
+        return any([word in markers for word in words])
+    return any([marker in input_sentence for marker in markers])
+
+"""
+categorizes the user input locally, without calling the LLM, when the answer is obvious:
+an explicit instructions: prefix, a sentence in a non-latin script, or an english question or command following one.
+returns None when the input is ambiguous, in which case the LLM must decide.
+"""
+class LocalInputClassifier():
+    def __init__(self, confidence_threshold=DEFAULT_CONFIDENCE_THRESHOLD):
+        self.confidence_threshold = confidence_threshold
+        self.classified_count = 0
+        self.fallback_count = 0
+
+    def predict(self, last_input_sentence, input_sentence):
+        """returns a tuple (CategorizeInputQuery, confidence). the query is None when there's no prediction at all"""
+        # explicit instructions
+        match = INSTRUCTIONS_PREFIX_RE.match(input_sentence)
+        if match != None:
+            instructions = input_sentence[match.end():].strip()
+            if len(instructions) > 0:
+                return CategorizeInputQuery(input_type=InputType.instructions, instructions=instructions), 0.95
+
+        input_script = get_dominant_script(input_sentence)
+        words = re.findall(r"[\w']+", input_sentence.lower())
+        looks_like_question = input_sentence.strip().endswith('?') or input_sentence.strip().endswith('？')
+
+        if last_input_sentence == None:
+            if input_script != None and input_script != SCRIPT_LATIN and not looks_like_question:
+                return CategorizeInputQuery(input_type=InputType.new_sentence, instructions=None), 0.95
+            # a first message in latin script could also be instructions or a question, such as "what can you do?"
+            return CategorizeInputQuery(input_type=InputType.new_sentence, instructions=None), 0.6
+
+        last_input_script = get_dominant_script(last_input_sentence)
+
+        if input_script != None and input_script != SCRIPT_LATIN:
+            # the learner is sending a sentence in a foreign language written in a non-latin script
+            if looks_like_question or has_question_or_command_marker(input_sentence, input_script):
+                # could be a question about the previous sentence, asked in the foreign language: 这个字什么意思
+                return CategorizeInputQuery(input_type=InputType.new_sentence, instructions=None), 0.6
+            return CategorizeInputQuery(input_type=InputType.new_sentence, instructions=None), 0.9
+
+        if input_script == SCRIPT_LATIN and last_input_script != SCRIPT_LATIN:
+            # switching from a foreign script to latin is usually an english question or command. a question mark
+            # alone isn't enough, it could be a question in a foreign language written in latin script: "Où est la gare ?"
+            if len(words) > 0 and words[0] in QUESTION_OR_COMMAND_WORDS:
+                return CategorizeInputQuery(input_type=InputType.question_or_command, instructions=None), 0.9
+            return CategorizeInputQuery(input_type=InputType.question_or_command, instructions=None), 0.6
+
+        if input_script == SCRIPT_LATIN and len(words) > 0 and words[0] in QUESTION_OR_COMMAND_WORDS and looks_like_question:
+            # latin script in both, english question
+            return CategorizeInputQuery(input_type=InputType.question_or_command, instructions=None), 0.7
+
+        return None, 0.0
+
+    def classify(self, last_input_sentence, input_sentence) -> Optional[CategorizeInputQuery]:
+        """returns the category if the confidence is high enough, otherwise None"""
+        result, confidence = self.predict(last_input_sentence, input_sentence)
+        if result != None and confidence >= self.confidence_threshold:
+            self.classified_count += 1
+            logger.info(f'input sentence: [{input_sentence}] input type: {result} (local, confidence: {confidence})')
+            return result
+        self.fallback_count += 1
+        return None
+
+    def get_stats(self):
+        return {
+            'classified': self.classified_count,
+            'fallback': self.fallback_count
+        }
+
+def evaluate_classifier(classifier, cases):
+    """offline evaluation. cases is a list of (last_input_sentence, input_sentence, expected InputType).
+    returns coverage (fraction of cases classified locally), accuracy of the local classifications, and the errors"""
+    classified = 0
+    correct = 0
+    errors = []
+    for last_input_sentence, input_sentence, expected_input_type in cases:
+        result, confidence = classifier.predict(last_input_sentence, input_sentence)
+        if result == None or confidence < classifier.confidence_threshold:
+            continue
+        classified += 1
+        if result.input_type == expected_input_type:
+            correct += 1
+        else:
+            errors.append((last_input_sentence, input_sentence, expected_input_type, result.input_type, confidence))
+    return {
+        'cases': len(cases),
+        'coverage': classified / len(cases) if len(cases) > 0 else 0.0,
+        'accuracy': correct / classified if classified > 0 else 1.0,
+        'errors': errors
+    }
+
+# shared by all ChatModel instances in the process, unless they are given their own classifier
+shared_input_classifier = LocalInputClassifier()
@@ -1,31 +1,74 @@
 import pydantic
+import asyncio
 import logging
 import json
 import pprint
-import openai
-import tempfile
 import time
 from typing import Optional
-from strenum import StrEnum
-from asgiref.sync import  sync_to_async
 import cloudlanguagetools.chatapi
 import cloudlanguagetools.options
-import cloudlanguagetools.encryption
 from cloudlanguagetools_chatbot import prompts
+from cloudlanguagetools_chatbot import cache
+from cloudlanguagetools_chatbot import executor
+from cloudlanguagetools_chatbot import categorize
+from cloudlanguagetools_chatbot import history
+from cloudlanguagetools_chatbot import client
+from cloudlanguagetools_chatbot import singleflight
+from cloudlanguagetools_chatbot import audiodata
+from cloudlanguagetools_chatbot import metrics
+from cloudlanguagetools_chatbot import plan
+from cloudlanguagetools_chatbot.categorize import InputType, CategorizeInputQuery
+from cloudlanguagetools_chatbot.audio_cache import AudioCache
 
 logger = logging.getLogger(__name__)
 
-class InputType(StrEnum):
-    new_sentence = 'NEW_SENTENCE',
-    question_or_command = 'QUESTION_OR_COMMAND'
-    instructions = 'INSTRUCTIONS'
-
-class CategorizeInputQuery(pydantic.BaseModel):
-    input_type: InputType = pydantic.Field(description=prompts.DESCRIPTION_FLD_IS_NEW_QUESTION)
-    instructions: Optional[str] = pydantic.Field(description=prompts.DESCRIPTION_FLD_INSTRUCTIONS)
-
-
-REQUEST_TIMEOUT=15
+def get_query_provider(query):
+    """the service requested by the model, for the metrics. 'auto' when chatapi picks it"""
+    service = getattr(query, 'service', None)
+    if service == None:
+        service = getattr(query, 'translation_service', None)
+    if service == None:
+        return 'auto'
+    return service.name
+
+class FunctionCallResult():
+    """result of a function call: the text echoed back to the model, and what should be shown to the user"""
+    def __init__(self, result, message=None, audio=None, audio_query=None):
+        self.result = result
+        self.message = message
+        self.audio = audio
+        # the text to speech query the audio was generated from
+        self.audio_query = audio_query
+        self.delivered = False
+
+class SpeculationStats():
+    """how often the speculative completion (assuming a new sentence) could be used"""
+    def __init__(self):
+        self.counts = {input_type: 0 for input_type in InputType}
+        self.wasted_tokens = 0
+
+    def record(self, input_type: InputType):
+        self.counts[input_type] += 1
+        result = 'hit' if input_type == InputType.new_sentence else 'miss'
+        metrics.speculative_completions.inc(result=result, input_type=input_type.value)
+
+    def record_wasted_tokens(self, tokens):
+        self.wasted_tokens += tokens
+        metrics.speculative_wasted_tokens.inc(tokens)
+
+    def get_stats(self):
+        hits = self.counts[InputType.new_sentence]
+        misses = sum(self.counts.values()) - hits
+        return {
+            'hits': hits,
+            'misses': misses,
+            'misses_question_or_command': self.counts[InputType.question_or_command],
+            'misses_instructions': self.counts[InputType.instructions],
+            'hit_rate': hits / (hits + misses) if hits + misses > 0 else 0.0,
+            'wasted_tokens': self.wasted_tokens
+        }
+
+shared_speculation_stats = SpeculationStats()
 
 """
 holds an instance of a conversation
@@ -36,28 +79,65 @@ class ChatModel():
     FUNCTION_NAME_BREAKDOWN = 'breakdown'
     FUNCTION_NAME_PRONOUNCE = 'pronounce'
 
-    def __init__(self, manager, audio_format=cloudlanguagetools.options.AudioFormat.mp3):
+    def __init__(self, manager, audio_format=cloudlanguagetools.options.AudioFormat.mp3, result_cache=None, audio_cache=None, tool_executor=None,
+                 input_classifier=categorize.shared_input_classifier,
+                 speculative_execution=False, speculation_stats=None, streaming=False,
+                 history_manager=None, llm_client=None, single_flight=None,
+                 max_in_memory_audio_bytes=audiodata.DEFAULT_MAX_IN_MEMORY_BYTES,
+                 tool_plans=False, tool_plan_cache=None, turn_cache=None, audio_preprocessor=None):
         self.manager = manager
+        # the LLM client, with its configuration and HTTP connections, is shared by all chat models
+        if llm_client == None:
+            llm_client = get_shared_llm_client()
+        self.llm_client = llm_client
         self.chatapi = cloudlanguagetools.chatapi.ChatAPI(self.manager)
+        # results of text-based functions are shared across all chat models, unless a cache is provided
+        if result_cache == None:
+            result_cache = cache.shared_function_call_cache
+        self.result_cache = result_cache
+        # optional cloudlanguagetools_chatbot.audio_cache.AudioCache
+        self.audio_cache = audio_cache
+        # blocking cloudlanguagetools calls run on dedicated thread pools
+        if tool_executor == None:
+            tool_executor = executor.shared_tool_executor
+        self.tool_executor = tool_executor
+        # identical cloudlanguagetools calls made at the same time by different chats share one call
+        if single_flight == None:
+            single_flight = singleflight.shared_single_flight
+        self.single_flight = single_flight
+        # classifies obvious inputs without calling the LLM. set to None to always use the LLM
+        self.input_classifier = input_classifier
+        # when the input needs to be categorized by the LLM, request the main completion at the same time
+        self.speculative_execution = speculative_execution
+        if speculation_stats == None:
+            speculation_stats = shared_speculation_stats
+        self.speculation_stats = speculation_stats
+        # stream the text of answers to send_message_update, if the callback is provided
+        self.streaming = streaming
+        self.send_message_update = None
+        # keeps the history sent to the model under a token budget
+        if history_manager == None:
+            history_manager = history.HistoryManager()
+        self.history_manager = history_manager
         self.instruction = prompts.DEFAULT_INSTRUCTIONS
         self.message_history = []
         self.last_call_messages = None
         self.last_input_sentence = None
         self.audio_format = audio_format
+        # generated audio is kept in memory up to this size
+        self.max_in_memory_audio_bytes = max_in_memory_audio_bytes
+        # compile the instruction into a plan of function calls, run directly on new sentences
+        self.tool_plans = tool_plans
+        if tool_plan_cache == None:
+            tool_plan_cache = plan.shared_tool_plan_cache
+        self.tool_plan_cache = tool_plan_cache
+        # optional cloudlanguagetools_chatbot.turn_cache.TurnCache, replays the outputs of new sentences seen before
+        self.turn_cache = turn_cache
+        # outputs of the current turn, while it's being recorded for the turn cache
+        self.turn_outputs = None
+        # optional cloudlanguagetools_chatbot.audio_preprocess.AudioPreprocessor, shrinks voice notes before recognition
+        self.audio_preprocessor = audio_preprocessor
 
-        # to use the Azure OpenAI API
-        use_azure_openai = True
-        if use_azure_openai:
-            # configure openai
-            # https://learn.microsoft.com/en-us/azure/ai-services/openai/how-to/function-calling
-            # https://github.com/openai/openai-python/issues/517#issuecomment-1645092367
-            azure_openai_config = cloudlanguagetools.encryption.decrypt()['OpenAI']
-            openai.api_type = "azure"
-            openai.api_base = azure_openai_config['azure_endpoint']
-            openai.api_version = "2023-07-01-preview"
-            openai.api_key = azure_openai_config['azure_api_key']
-            self.azure_openai_deployment_name = azure_openai_config['azure_deployment_name']
-    
     def set_instruction(self, instruction):
         self.instruction = instruction
 
@@ -67,10 +147,26 @@ class ChatModel():
     def get_last_call_messages(self):
         return self.last_call_messages
 
-    def set_send_message_callback(self, send_message_fn, send_audio_fn, send_status_fn):
-        self.send_message = send_message_fn
-        self.send_audio = send_audio_fn
-        self.send_status = send_status_fn
+    def get_state(self):
+        """the conversation state, in a form which can be serialized to json"""
+        return {
+            'instruction': self.instruction,
+            'last_input_sentence': self.last_input_sentence,
+            'message_history': self.history_manager.trim(self.message_history)
+        }
+
+    def load_state(self, state):
+        self.instruction = state['instruction']
+        self.last_input_sentence = state['last_input_sentence']
+        self.message_history = state['message_history']
+
+    def set_send_message_callback(self, send_message_fn, send_audio_fn, send_status_fn, send_message_update_fn=None):
+        self.send_message = metrics.timed('send_message', send_message_fn)
+        self.send_audio = metrics.timed('send_audio', send_audio_fn)
+        self.send_status = metrics.timed('send_status', send_status_fn)
+        # optional, send_message_update_fn(text, final) receives the partial text of a streamed answer.
+        # the first call for an answer should create a message, the following calls update it
+        self.send_message_update = metrics.timed('send_message_update', send_message_update_fn)
 
     def get_system_messages(self):
         # do we have any instructions ?
@@ -84,32 +180,95 @@ class ChatModel():
 
         return messages
 
-    async def call_openai(self):
+    async def call_openai(self, stream_text=False):
 
+        self.message_history = self.history_manager.trim(self.message_history)
         messages = self.get_system_messages()
         messages.extend(self.message_history)
 
         self.last_call_messages = messages
 
+        with metrics.span('call_openai'):
+            if stream_text:
+                return await self.request_completion_stream(messages)
+            return await self.request_completion(messages)
+
+    async def notify_queued(self):
+        await self.send_status('many requests at the moment, please wait')
+
+    async def request_completion(self, messages, notify_queued=True):
+        """send the messages to the model, without modifying the state of the conversation"""
         logger.debug(f"sending messages to openai: {pprint.pformat(messages)}")
 
-        response = await openai.ChatCompletion.acreate(
-            # for OpenAI:
-            # model="gpt-3.5-turbo-0613"
-            # for Azure:
-            engine=self.azure_openai_deployment_name,
+        response = await self.llm_client.chat_completion(
             messages=messages,
-            functions=self.get_openai_functions(),
-            function_call= "auto",
+            tools=self.get_openai_tools(),
+            tool_choice="auto",
             temperature=0.0,
-            request_timeout=REQUEST_TIMEOUT
+            notify_queued_fn=self.notify_queued if notify_queued else None
         )
 
         return response
 
-    async def categorize_input_type(self, last_input_sentence, input_sentence) -> InputType:
-        """return true if input is a new sentence. we'll use this to clear history"""
+    async def request_completion_stream(self, messages):
+        """stream the completion, sending the text to send_message_update as it arrives.
+        returns a response with the same structure as a non-streamed completion"""
+        logger.debug(f"streaming messages to openai: {pprint.pformat(messages)}")
+
+        response_stream = await self.llm_client.chat_completion(
+            messages=messages,
+            tools=self.get_openai_tools(),
+            tool_choice="auto",
+            temperature=0.0,
+            stream=True,
+            notify_queued_fn=self.notify_queued
+        )
 
+        content = None
+        # tool calls are assembled from the deltas, by index
+        tool_calls = {}
+        async for chunk in response_stream:
+            if len(chunk['choices']) == 0:
+                # azure sends the content filter results in a chunk without choices
+                continue
+            delta = chunk['choices'][0].get('delta', {})
+            if delta.get('content', None) != None:
+                content = (content or '') + delta['content']
+                await self.send_message_update(content, False)
+            for tool_call_delta in delta.get('tool_calls', None) or []:
+                tool_call = tool_calls.setdefault(tool_call_delta['index'], {'id': None, 'type': 'function', 'function': {'name': '', 'arguments': ''}})
+                if tool_call_delta.get('id', None) != None:
+                    tool_call['id'] = tool_call_delta['id']
+                function_delta = tool_call_delta.get('function', {})
+                if function_delta.get('name', None) != None:
+                    tool_call['function']['name'] += function_delta['name']
+                if function_delta.get('arguments', None) != None:
+                    tool_call['function']['arguments'] += function_delta['arguments']
+        if content != None:
+            await self.send_message_update(content, True)
+            self.record_turn_output({'type': 'message', 'text': content})
+
+        message = {'role': 'assistant', 'content': content}
+        if len(tool_calls) > 0:
+            message['tool_calls'] = [tool_calls[index] for index in sorted(tool_calls.keys())]
+        return {'choices': [{'message': message}]}
+
+    async def categorize_input_type(self, last_input_sentence, input_sentence) -> CategorizeInputQuery:
+        """return true if input is a new sentence. we'll use this to clear history"""
+        input_type_result = self.categorize_input_type_locally(last_input_sentence, input_sentence)
+        if input_type_result != None:
+            return input_type_result
+        return await self.categorize_input_type_llm(last_input_sentence, input_sentence)
+
+    def categorize_input_type_locally(self, last_input_sentence, input_sentence) -> Optional[CategorizeInputQuery]:
+        if self.input_classifier != None:
+            input_type_result = self.input_classifier.classify(last_input_sentence, input_sentence)
+            if input_type_result != None:
+                metrics.input_classifications.inc(method='local', input_type=input_type_result.input_type.value)
+            return input_type_result
+        return None
+
+    async def categorize_input_type_llm(self, last_input_sentence, input_sentence) -> CategorizeInputQuery:
         if last_input_sentence != None:
             last_input_sentence_entry = [{"role": "user", "content": last_input_sentence}]
         else:
@@ -123,21 +282,18 @@ class ChatModel():
 
         categorize_input_type_name = 'category_input_type'
 
-        response = await openai.ChatCompletion.acreate(
-            # for OpenAI:
-            # model="gpt-3.5-turbo-0613"
-            # for Azure:            
-            engine=self.azure_openai_deployment_name,
-            messages=messages,
-            functions=[{
-                'name': categorize_input_type_name,
-                'description': prompts.DESCRIPTION_FN_IS_NEW_QUESTION,
-                'parameters': CategorizeInputQuery.model_json_schema(),
-            }],
-            function_call={'name': categorize_input_type_name},
-            temperature=0.0,
-            request_timeout=REQUEST_TIMEOUT
-        )
+        with metrics.span('categorize_input_type'):
+            response = await self.llm_client.chat_completion(
+                messages=messages,
+                functions=[{
+                    'name': categorize_input_type_name,
+                    'description': prompts.DESCRIPTION_FN_IS_NEW_QUESTION,
+                    'parameters': CategorizeInputQuery.model_json_schema(),
+                }],
+                function_call={'name': categorize_input_type_name},
+                temperature=0.0,
+                notify_queued_fn=self.notify_queued
+            )
 
         message = response['choices'][0]['message']
         function_name = message['function_call']['name']
@@ -145,23 +301,205 @@ class ChatModel():
         logger.debug(f'categorize_input_type response: {pprint.pformat(message)}')
         arguments = json.loads(message["function_call"]["arguments"])
         input_type_result = CategorizeInputQuery(**arguments)
-        
+        metrics.input_classifications.inc(method='llm', input_type=input_type_result.input_type.value)
+
         logger.info(f'input sentence: [{input_sentence}] input type: {input_type_result}')
         return input_type_result
 
-    async def process_audio(self, audio_tempfile: tempfile.NamedTemporaryFile):
-        async_recognize_audio = sync_to_async(self.chatapi.recognize_audio)
-        text = await async_recognize_audio(audio_tempfile, self.audio_format)
+    def get_transcript_cache_key(self, audio_key) -> str:
+        return f'{executor.TOOL_TYPE_RECOGNIZE_AUDIO}:{audio_key}'
+
+    async def get_cached_transcript(self, audio_key) -> Optional[str]:
+        """transcripts are cached by the key of the voice note, telegram gives forwarded voice notes the same key"""
+        transcript = await self.result_cache.get_async(self.get_transcript_cache_key(audio_key))
+        metrics.cache_requests.inc(cache='result', function=executor.TOOL_TYPE_RECOGNIZE_AUDIO, result='hit' if transcript != None else 'miss')
+        return transcript
+
+    async def recognize_audio(self, audio: audiodata.AudioData) -> Optional[str]:
+        """returns None if the voice note is silent"""
+        audio_format = self.audio_format
+        preprocessed_audio = None
+        if self.audio_preprocessor != None:
+            try:
+                with metrics.span('audio_preprocess'):
+                    preprocessed = await self.tool_executor.run(executor.TOOL_TYPE_AUDIO_PREPROCESS, self.audio_preprocessor.preprocess, audio)
+                if preprocessed.audio == None:
+                    return None
+                preprocessed_audio = preprocessed.audio
+                audio = preprocessed_audio
+                audio_format = preprocessed.audio_format
+            except Exception:
+                # the original voice note is recognized instead
+                logger.exception('could not preprocess voice note')
+        # chatapi needs a file: for audio held in memory, it's written when recognize_audio accesses .name,
+        # on the executor thread
+        try:
+            with metrics.span('tool_call', function='recognize_audio'):
+                return await self.tool_executor.run(executor.TOOL_TYPE_RECOGNIZE_AUDIO, self.chatapi.recognize_audio, audio, audio_format)
+        finally:
+            if preprocessed_audio != None:
+                preprocessed_audio.close()
+
+    async def process_audio(self, audio: audiodata.AudioData):
+        text = None
+        if audio.key != None:
+            text = await self.get_cached_transcript(audio.key)
+        if text == None:
+            text = await self.recognize_audio(audio)
+            if text == None:
+                await self.send_status('no speech detected in the voice note')
+                return
+            if audio.key != None:
+                self.result_cache.put(self.get_transcript_cache_key(audio.key), text)
+        await self.process_transcript(text)
+
+    async def process_transcript(self, text):
         await self.send_status(f'recognized text: {text}')
         await self.process_message(text)
 
     async def process_instructions(self, instructions):
         self.set_instruction(instructions)
         await self.send_status(f'My instructions are now: {self.get_instruction()}')
+        if self.tool_plans:
+            # compiled now, rather than on the next sentence
+            await self.get_tool_plan()
+
+    async def get_tool_plan(self) -> Optional[plan.ToolPlan]:
+        """the plan compiled from the current instruction, with one LLM call the first time an instruction is seen.
+        returns None if it couldn't be compiled"""
+        if self.instruction == None:
+            return None
+        tool_plan = self.tool_plan_cache.get(self.instruction)
+        if tool_plan != None:
+            return tool_plan
+        # chats starting at the same time with the same instruction share the compilation
+        return await self.single_flight.do(f'{plan.COMPILE_FUNCTION_NAME}:{self.instruction}',
+            lambda: self.compile_instruction(self.instruction))
+
+    async def compile_instruction(self, instruction) -> Optional[plan.ToolPlan]:
+        messages = [
+            {"role": "system", "content": prompts.SYSTEM_MSG_ASSISTANT},
+            {"role": "user", "content": instruction}
+        ]
+        try:
+            with metrics.span('compile_instructions'):
+                response = await self.llm_client.chat_completion(
+                    messages=messages,
+                    functions=[{
+                        'name': plan.COMPILE_FUNCTION_NAME,
+                        'description': plan.DESCRIPTION_FN_COMPILE,
+                        'parameters': plan.ToolPlan.model_json_schema(),
+                    }],
+                    function_call={'name': plan.COMPILE_FUNCTION_NAME},
+                    temperature=0.0,
+                    notify_queued_fn=self.notify_queued
+                )
+            message = response['choices'][0]['message']
+            tool_plan = plan.ToolPlan(**json.loads(message['function_call']['arguments']))
+        except Exception as e:
+            logger.exception(f'could not compile instructions: {instruction}')
+            return None
+        logger.info(f'instructions: [{instruction}] tool plan: {tool_plan}')
+        self.tool_plan_cache.put(instruction, tool_plan)
+        return tool_plan
+
+    async def get_input_language(self, tool_plan, input_message):
+        """the language of a new sentence, or None if the plan doesn't apply to it"""
+        if tool_plan.input_language != None:
+            if not plan.is_language_script(input_message, tool_plan.input_language):
+                return None
+            if not plan.is_latin_language(tool_plan.input_language):
+                return tool_plan.input_language
+            # a sentence in latin script could be in english, the language has to be detected
+            if await self.detect_input_language(input_message) != tool_plan.input_language:
+                return None
+            return tool_plan.input_language
+        language = plan.detect_language_from_script(input_message)
+        if language != None:
+            return language
+        return await self.detect_input_language(input_message)
+
+    async def detect_input_language(self, input_message):
+        """the language of the sentence, with one LLM call"""
+        with metrics.span('detect_input_language'):
+            response = await self.llm_client.chat_completion(
+                messages=[{"role": "user", "content": input_message}],
+                functions=[{
+                    'name': plan.DETECT_LANGUAGE_FUNCTION_NAME,
+                    'description': plan.DESCRIPTION_FN_DETECT_LANGUAGE,
+                    'parameters': plan.InputLanguage.model_json_schema(),
+                }],
+                function_call={'name': plan.DETECT_LANGUAGE_FUNCTION_NAME},
+                temperature=0.0,
+                notify_queued_fn=self.notify_queued
+            )
+        message = response['choices'][0]['message']
+        return plan.InputLanguage(**json.loads(message['function_call']['arguments'])).language
+
+    async def run_tool_plan(self, input_message):
+        """run the function calls of the plan on a new sentence, instead of letting the LLM choose them.
+        returns (whether the plan ran, whether something was sent to the user)"""
+        tool_plan = await self.get_tool_plan()
+        if tool_plan == None or not tool_plan.applicable or len(tool_plan.steps) == 0:
+            return False, False
+        language = await self.get_input_language(tool_plan, input_message)
+        if language == None:
+            return False, False
+        # recorded in the history like tool calls requested by the model, for the follow-up questions
+        tool_call_list = [{
+            'id': f'call_plan_{index}',
+            'type': 'function',
+            'function': {'name': function_name, 'arguments': json.dumps(arguments, ensure_ascii=False)}
+        } for index, (function_name, arguments) in enumerate(tool_plan.get_tool_calls(input_message, language))]
+        self.message_history.append({"role": "assistant", "content": None, "tool_calls": tool_call_list})
+        tool_messages, sent_message_to_user = await self.process_tool_calls(tool_call_list, {})
+        self.message_history.extend(tool_messages)
+        return True, sent_message_to_user
+
+    async def categorize_input_type_speculative(self, input_message):
+        """categorize the input with the LLM, and at the same time, request the main completion assuming the input
+        is a new sentence (history cleared). returns the category, and the speculative response if it can be used"""
+        speculative_messages = self.get_system_messages() + [{"role": "user", "content": input_message}]
+        # the categorization notifies the user if the requests are queued, the speculative request may be discarded
+        speculative_task = asyncio.ensure_future(self.request_completion(speculative_messages, notify_queued=False))
+        speculation_used = False
+        try:
+            input_type_result = await self.categorize_input_type_llm(self.last_input_sentence, input_message)
+            self.speculation_stats.record(input_type_result.input_type)
+            if input_type_result.input_type != InputType.new_sentence:
+                # wrong guess, the speculative response is discarded before anything was sent to the user
+                return input_type_result, None
+            speculation_used = True
+            self.last_call_messages = speculative_messages
+            return input_type_result, speculative_task
+        finally:
+            if not speculation_used:
+                self.discard_speculative_task(speculative_task, speculative_messages)
+
+    def discard_speculative_task(self, speculative_task, speculative_messages):
+        """cancel the speculative completion, and count its tokens as wasted: the usage if it completed already,
+        otherwise the prompt, which may have been sent"""
+        if speculative_task.done() and not speculative_task.cancelled() and speculative_task.exception() == None:
+            wasted_tokens = speculative_task.result()['usage']['total_tokens']
+        else:
+            wasted_tokens = history.count_messages_tokens(speculative_messages)
+            speculative_task.cancel()
+        self.speculation_stats.record_wasted_tokens(wasted_tokens)
 
     async def process_message(self, input_message):
-    
-        input_type_result = await self.categorize_input_type(self.last_input_sentence, input_message)
+        with metrics.span('process_message'):
+            return await self.process_message_turn(input_message)
+
+    async def process_message_turn(self, input_message):
+
+        speculative_response_task = None
+        input_type_result = self.categorize_input_type_locally(self.last_input_sentence, input_message)
+        if input_type_result == None:
+            if self.speculative_execution:
+                input_type_result, speculative_response_task = await self.categorize_input_type_speculative(input_message)
+            else:
+                input_type_result = await self.categorize_input_type_llm(self.last_input_sentence, input_message)
+
         if input_type_result.input_type == InputType.new_sentence:
             # user is moving on to a new sentence, clear history
             self.message_history = []
@@ -172,6 +510,17 @@ class ChatModel():
         elif input_type_result.input_type == InputType.instructions:
             return await self.process_instructions(input_type_result.instructions)
 
+        turn_cache_key = None
+        if self.turn_cache != None and input_type_result.input_type == InputType.new_sentence:
+            turn_cache_key = self.turn_cache.get_key(self.instruction, input_message, getattr(self.llm_client, 'deployment_name', None), self.audio_format)
+            cached_turn = self.turn_cache.get(turn_cache_key)
+            metrics.cache_requests.inc(cache='turn', result='hit' if cached_turn != None else 'miss')
+            if cached_turn != None:
+                if speculative_response_task != None:
+                    self.discard_speculative_task(speculative_response_task, self.last_call_messages)
+                return await self.replay_turn(turn_cache_key, cached_turn)
+            self.turn_outputs = []
+
         max_calls = 10
         continue_processing = True
 
@@ -183,107 +532,254 @@ class ChatModel():
         at_least_one_message_to_user = False
 
         try:
+            if self.tool_plans and input_type_result.input_type == InputType.new_sentence:
+                plan_executed, at_least_one_message_to_user = await self.run_tool_plan(input_message)
+                if plan_executed and speculative_response_task != None:
+                    # the speculative response was requested without the results of the plan
+                    self.discard_speculative_task(speculative_response_task, self.last_call_messages)
+                    speculative_response_task = None
+                if plan_executed and at_least_one_message_to_user:
+                    continue_processing = False
+                # otherwise the LLM takes over, with the results of the plan in the history, if it ran
             while continue_processing and max_calls > 0:
                 max_calls -= 1
-                response = await self.call_openai()
+                stream_text = False
+                if speculative_response_task != None:
+                    # the first completion was requested while categorizing the input
+                    response = await speculative_response_task
+                    speculative_response_task = None
+                else:
+                    # stream the answer, unless the user has already received the output of a function call
+                    stream_text = self.streaming and self.send_message_update != None and not at_least_one_message_to_user
+                    response = await self.call_openai(stream_text=stream_text)
                 logger.debug(pprint.pformat(response))
                 message = response['choices'][0]['message']
                 message_content = message.get('content', None)
-                if 'function_call' in message:
-                    function_name = message['function_call']['name']
-                    logger.info(f'function_call: function_name: {function_name}')
-                    try:
-                        arguments = json.loads(message["function_call"]["arguments"])
-                    except json.decoder.JSONDecodeError as e:
-                        logger.exception(f'error decoding json: {message}')
-                    arguments_str = json.dumps(arguments, indent=4)
-                    # check whether we've called that function with exact same arguments before
-                    if arguments_str not in function_call_cache.get(function_name, {}):
-                        # haven't called it with these arguments before
-                        function_call_result, sent_message_to_user = await self.process_function_call(function_name, arguments)
-                        at_least_one_message_to_user = at_least_one_message_to_user or sent_message_to_user
-                        self.message_history.append({"role": "function", "name": function_name, "content": function_call_result})
-                        # cache function call results
-                        if function_name not in function_call_cache:
-                            function_call_cache[function_name] = {}
-                        function_call_cache[function_name][arguments_str] = function_call_result
-                    else:
-                        # we've called that function already with same arguments, we won't call again, but
-                        # add to history again, so that chatgpt doesn't call the function again
-                        self.message_history.append({"role": "function", "name": function_name, "content": function_call_result})
+                tool_calls = message.get('tool_calls', None)
+                if stream_text and message_content != None:
+                    # the text has been streamed to the user already
+                    at_least_one_message_to_user = True
+                if tool_calls:
+                    # the assistant message with the tool calls must precede the tool results in the history
+                    tool_call_list = [{
+                        'id': tool_call['id'],
+                        'type': 'function',
+                        'function': {'name': tool_call['function']['name'], 'arguments': tool_call['function']['arguments']}
+                    } for tool_call in tool_calls]
+                    self.message_history.append({"role": "assistant", "content": message_content, "tool_calls": tool_call_list})
+                    tool_messages, sent_message_to_user = await self.process_tool_calls(tool_call_list, function_call_cache)
+                    at_least_one_message_to_user = at_least_one_message_to_user or sent_message_to_user
+                    self.message_history.extend(tool_messages)
                 else:
                     continue_processing = False
-                    if at_least_one_message_to_user == False:
+                    if at_least_one_message_to_user == False and not stream_text:
                         # or nothing has been shown to the user yet, so we should show the final message. maybe chatgpt is trying to explain something
                         await self.send_message(message['content'])
-                
-                # if there was a message, append it to the history
-                if message_content != None:
-                    self.message_history.append({"role": "assistant", "content": message_content})
+                        self.record_turn_output({'type': 'message', 'text': message['content']})
+                    # if there was a message, append it to the history
+                    if message_content != None:
+                        self.message_history.append({"role": "assistant", "content": message_content})
+            if turn_cache_key != None and not continue_processing:
+                self.turn_cache.put(turn_cache_key, {'outputs': self.turn_outputs, 'message_history': self.message_history})
         except Exception as e:
             logger.exception(f'error processing function call')
             await self.send_status(f'error: {str(e)}')
+        finally:
+            self.turn_outputs = None
+
+    def record_turn_output(self, output):
+        if self.turn_outputs != None:
+            self.turn_outputs.append(output)
+
+    async def replay_turn(self, turn_cache_key, cached_turn):
+        """send the outputs of a cached turn, and restore the history it left"""
+        logger.info(f'replaying cached turn for: {self.last_input_sentence}')
+        try:
+            with metrics.span('replay_turn'):
+                for output in cached_turn['outputs']:
+                    if output['type'] == 'message':
+                        await self.send_message(output['text'])
+                    elif output['type'] == 'audio':
+                        audio = await self.get_audio(cloudlanguagetools.chatapi.AudioQuery(**output['query']))
+                        await self.send_audio(audio)
+            self.message_history = cached_turn['message_history']
+        except Exception as e:
+            logger.exception(f'error replaying cached turn')
+            self.turn_cache.invalidate(turn_cache_key)
+            await self.send_status(f'error: {str(e)}')
 
+    async def process_tool_calls(self, tool_call_list, function_call_cache):
+        """run all the tool calls requested by the model in one response concurrently. results are sent to
+        the user in the order of the tool calls, each one as soon as it and all the ones before it are done.
+        returns the tool messages to append to the history, and whether anything was sent to the user"""
+        tasks = []
+        for tool_call in tool_call_list:
+            function_name = tool_call['function']['name']
+            logger.info(f'function_call: function_name: {function_name}')
+            try:
+                arguments = json.loads(tool_call['function']['arguments'])
+            except json.decoder.JSONDecodeError as e:
+                logger.exception(f'error decoding json: {tool_call}')
+                # report the error back to the model
+                error_future = asyncio.get_running_loop().create_future()
+                error_future.set_result(FunctionCallResult(f'could not decode arguments: {str(e)}'))
+                tasks.append(error_future)
+                continue
+            cache_key = function_name + ':' + json.dumps(arguments, sort_keys=True)
+            if cache_key in function_call_cache:
+                # we've called that function already with same arguments, we won't call again, but
+                # add to history again, so that chatgpt doesn't call the function again
+                tasks.append(function_call_cache[cache_key])
+            else:
+                task = asyncio.ensure_future(self.run_function_call(function_name, arguments))
+                function_call_cache[cache_key] = task
+                tasks.append(task)
+
+        tool_messages = []
+        sent_message_to_user = False
+        try:
+            for tool_call, task in zip(tool_call_list, tasks):
+                function_call_result = await task
+                sent_message_to_user = await self.deliver_function_call_result(function_call_result) or sent_message_to_user
+                tool_messages.append({"role": "tool", "tool_call_id": tool_call['id'], "content": function_call_result.result})
+        finally:
+            # if one of the calls failed, don't leave the other ones running
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    # the errors of the calls after the failed one are not reported, but retrieved
+                    task.exception()
+        return tool_messages, sent_message_to_user
 
     async def process_function_call(self, function_name, arguments):
-        # by default, don't send output to user
-        send_message_to_user = False
+        function_call_result = await self.run_function_call(function_name, arguments)
+        send_message_to_user = await self.deliver_function_call_result(function_call_result)
+        # need to echo the result back to chatgpt
+        return function_call_result.result, send_message_to_user
+
+    async def run_function_call(self, function_name, arguments) -> 'FunctionCallResult':
+        """call the cloudlanguagetools function, without sending anything to the user yet"""
         if function_name == self.FUNCTION_NAME_PRONOUNCE:
             query = cloudlanguagetools.chatapi.AudioQuery(**arguments)
-            async_audio = sync_to_async(self.chatapi.audio)
-            audio_tempfile = await async_audio(query, self.audio_format)
-            result = query.input_text
-            await self.send_audio(audio_tempfile)
-            send_message_to_user = True
-        else:
-            # text-based functions
-            try:
-                if function_name == self.FUNCTION_NAME_TRANSLATE_OR_DICT:
-                    translate_query = cloudlanguagetools.chatapi.TranslateLookupQuery(**arguments)
-                    async_translate = sync_to_async(self.chatapi.translate_or_lookup)
-                    result = await async_translate(translate_query)
-                    send_message_to_user = True
-                elif function_name == self.FUNCTION_NAME_TRANSLITERATE:
-                    query = cloudlanguagetools.chatapi.TransliterateQuery(**arguments)
-                    async_transliterate = sync_to_async(self.chatapi.transliterate)
-                    result = await async_transliterate(query)
-                    send_message_to_user = True
-                elif function_name == self.FUNCTION_NAME_BREAKDOWN:
-                    query = cloudlanguagetools.chatapi.BreakdownQuery(**arguments)
-                    async_breakdown = sync_to_async(self.chatapi.breakdown)
-                    result = await async_breakdown(query)
-                    send_message_to_user = True
-                else:
-                    # report unknown function
-                    result = f'unknown function: {function_name}'
-            except cloudlanguagetools.chatapi.NoDataFoundException as e:
-                result = str(e)
-            logger.info(f'function: {function_name} result: {result}')
-            if send_message_to_user:
-                await self.send_message(result)
-        # need to echo the result back to chatgpt
-        return result, send_message_to_user    
+            with metrics.span('tool_call', function=function_name, provider=get_query_provider(query)):
+                audio = await self.get_audio(query)
+            return FunctionCallResult(query.input_text, audio=audio, audio_query=query)
+        # text-based functions
+        # by default, don't send output to user
+        send_message_to_user = False
+        try:
+            if function_name == self.FUNCTION_NAME_TRANSLATE_OR_DICT:
+                query = cloudlanguagetools.chatapi.TranslateLookupQuery(**arguments)
+                result = await self.cached_function_call(function_name, query, executor.TOOL_TYPE_TRANSLATE, self.chatapi.translate_or_lookup)
+                send_message_to_user = True
+            elif function_name == self.FUNCTION_NAME_TRANSLITERATE:
+                query = cloudlanguagetools.chatapi.TransliterateQuery(**arguments)
+                result = await self.cached_function_call(function_name, query, executor.TOOL_TYPE_TRANSLITERATE, self.chatapi.transliterate)
+                send_message_to_user = True
+            elif function_name == self.FUNCTION_NAME_BREAKDOWN:
+                query = cloudlanguagetools.chatapi.BreakdownQuery(**arguments)
+                result = await self.cached_function_call(function_name, query, executor.TOOL_TYPE_BREAKDOWN, self.chatapi.breakdown)
+                send_message_to_user = True
+            else:
+                # report unknown function
+                result = f'unknown function: {function_name}'
+        except cloudlanguagetools.chatapi.NoDataFoundException as e:
+            result = str(e)
+        logger.info(f'function: {function_name} result: {result}')
+        if send_message_to_user:
+            return FunctionCallResult(result, message=result)
+        return FunctionCallResult(result)
+
+    async def deliver_function_call_result(self, function_call_result) -> bool:
+        """send the output of a function call to the user, returns whether something was sent"""
+        # identical function calls share their result, which is only shown to the user once
+        if function_call_result.delivered:
+            return False
+        function_call_result.delivered = True
+        if function_call_result.audio != None:
+            await self.send_audio(function_call_result.audio)
+            self.record_turn_output({'type': 'audio', 'query': function_call_result.audio_query.model_dump(mode='json')})
+            return True
+        if function_call_result.message != None:
+            await self.send_message(function_call_result.message)
+            self.record_turn_output({'type': 'message', 'text': function_call_result.message})
+            return True
+        return False
+
+    async def cached_function_call(self, function_name, query, tool_type, function):
+        """look up the result in the process-wide cache before calling the cloud service"""
+        cache_key = self.result_cache.get_key(function_name, query)
+        result = await self.result_cache.get_async(cache_key)
+        if result != None:
+            logger.info(f'function: {function_name} cache hit')
+            metrics.cache_requests.inc(cache='result', function=function_name, result='hit')
+            return result
+        metrics.cache_requests.inc(cache='result', function=function_name, result='miss')
+        async def call_function():
+            result = await self.tool_executor.run(tool_type, function, query)
+            self.result_cache.put(cache_key, result)
+            return result
+        with metrics.span('tool_call', function=function_name, provider=get_query_provider(query)):
+            return await self.single_flight.do(cache_key, call_function)
+
+    async def get_audio(self, query):
+        """generate the audio, or reuse a previously generated file from the audio cache"""
+        cache_key = AudioCache.get_key(query, self.audio_format)
+        async def synthesize():
+            single_flight_key = f'{self.FUNCTION_NAME_PRONOUNCE}:{cache_key}'
+            return await self.single_flight.do(single_flight_key,
+                lambda: self.tool_executor.run(executor.TOOL_TYPE_AUDIO, self.synthesize_audio, query, cache_key))
+        if self.audio_cache == None:
+            return await synthesize()
+        audio_path = await self.audio_cache.get_or_synthesize(cache_key, synthesize)
+        # read when it's sent
+        return audiodata.AudioData.from_path(audio_path, key=cache_key)
+
+    def synthesize_audio(self, query, cache_key) -> audiodata.AudioData:
+        """runs on the executor thread. chatapi returns a temporary file, which is read into memory and deleted"""
+        audio_tempfile = self.chatapi.audio(query, self.audio_format)
+        audio = audiodata.AudioData.from_tempfile(audio_tempfile, self.max_in_memory_audio_bytes)
+        audio.key = cache_key
+        return audio
+
+    def get_openai_tools(self):
+        return self.llm_client.tools
 
     def get_openai_functions(self):
+        return self.llm_client.functions
+
+    @classmethod
+    def build_openai_functions(cls):
+        """the function schemas are built once per process, by the LLM client"""
         return [
             {
-                'name': self.FUNCTION_NAME_TRANSLATE_OR_DICT,
+                'name': cls.FUNCTION_NAME_TRANSLATE_OR_DICT,
                 'description': "Translate or do a dictionary lookup for input text from source language to target language",
                 'parameters': cloudlanguagetools.chatapi.TranslateLookupQuery.model_json_schema(),
             },
             {
-                'name': self.FUNCTION_NAME_TRANSLITERATE,
+                'name': cls.FUNCTION_NAME_TRANSLITERATE,
                 'description': "Transliterate the input text in the given language. This can be used for Pinyin or Jyutping for Chinese, or Romaji for Japanese",
                 'parameters': cloudlanguagetools.chatapi.TransliterateQuery.model_json_schema(),
             },
             {
-                'name': self.FUNCTION_NAME_BREAKDOWN,
+                'name': cls.FUNCTION_NAME_BREAKDOWN,
                 'description': "Breakdown the given sentence into words",
                 'parameters': cloudlanguagetools.chatapi.BreakdownQuery.model_json_schema(),
             },            
             {
-                'name': self.FUNCTION_NAME_PRONOUNCE,
+                'name': cls.FUNCTION_NAME_PRONOUNCE,
                 'description': "Pronounce input text in the given language (generate text to speech audio)",
                 'parameters': cloudlanguagetools.chatapi.AudioQuery.model_json_schema(),
             },
         ]
+
+shared_llm_client = None
+
+def get_shared_llm_client() -> client.LLMClient:
+    """created on first use, so that the configuration is only decrypted once per process"""
+    global shared_llm_client
+    if shared_llm_client == None:
+        shared_llm_client = client.LLMClient(ChatModel.build_openai_functions())
+    return shared_llm_client
@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import os
+import aiohttp
+import openai
+import openai.error
+import cloudlanguagetools.encryption
+
+from . import history
+from . import metrics
+from . import ratelimit
+
+logger = logging.getLogger(__name__)
+
+REQUEST_TIMEOUT=15
+AZURE_OPENAI_API_VERSION = "2023-12-01-preview"
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_KEEPALIVE_TIMEOUT = 60
+# quota of the Azure OpenAI deployment, not enforced on the client side if not set
+REQUESTS_PER_MINUTE = int(os.environ.get('AZURE_OPENAI_REQUESTS_PER_MINUTE', 0)) or None
+TOKENS_PER_MINUTE = int(os.environ.get('AZURE_OPENAI_TOKENS_PER_MINUTE', 0)) or None
+# azure counts the maximum completion length against the quota, we don't set max_tokens, use an estimate
+ESTIMATED_COMPLETION_TOKENS = 300
+# tell the user when a request has to wait longer than this for capacity
+QUEUED_NOTIFY_DELAY = 2.0
+
+def is_retryable_error(e) -> bool:
+    if isinstance(e, (openai.error.RateLimitError, openai.error.Timeout, openai.error.APIConnectionError,
+                      openai.error.ServiceUnavailableError, openai.error.TryAgain)):
+        return True
+    if isinstance(e, openai.error.APIError) and e.http_status != None and e.http_status >= 500:
+        return True
+    return False
+
+def estimate_request_tokens(kwargs) -> int:
+    tokens = history.count_messages_tokens(kwargs.get('messages', []))
+    # the function definitions are part of the prompt
+    for function in kwargs.get('functions', None) or [tool['function'] for tool in kwargs.get('tools', None) or []]:
+        tokens += history.count_text_tokens(str(function))
+    return tokens + ESTIMATED_COMPLETION_TOKENS
+
+"""
+process-wide Azure OpenAI client. it is created once and shared by all ChatModel instances:
+it holds the decrypted configuration, a pooled HTTP session which keeps connections (and TLS sessions)
+alive between requests, and the prebuilt function schemas.
+requests are rate limited on the client side (requests and tokens per minute, adaptive concurrency),
+and retried with backoff when throttled or when a transient error occurs.
+"""
+class LLMClient():
+    def __init__(self, functions, max_connections=DEFAULT_MAX_CONNECTIONS, keepalive_timeout=DEFAULT_KEEPALIVE_TIMEOUT,
+                 requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE,
+                 concurrency_limiter=None, retry_policy=None, azure_openai_config=None):
+        # https://learn.microsoft.com/en-us/azure/ai-services/openai/how-to/function-calling
+        # https://github.com/openai/openai-python/issues/517#issuecomment-1645092367
+        if azure_openai_config == None:
+            azure_openai_config = cloudlanguagetools.encryption.decrypt()['OpenAI']
+        # passed with each request, rather than configured globally on the openai module
+        self.api_settings = {
+            'api_type': 'azure',
+            'api_base': azure_openai_config['azure_endpoint'],
+            'api_version': AZURE_OPENAI_API_VERSION,
+            'api_key': azure_openai_config['azure_api_key'],
+        }
+        self.deployment_name = azure_openai_config['azure_deployment_name']
+        self.request_bucket = ratelimit.TokenBucket(requests_per_minute) if requests_per_minute != None else None
+        self.token_bucket = ratelimit.TokenBucket(tokens_per_minute) if tokens_per_minute != None else None
+        if concurrency_limiter == None:
+            concurrency_limiter = ratelimit.AdaptiveConcurrencyLimiter()
+        self.concurrency_limiter = concurrency_limiter
+        if retry_policy == None:
+            retry_policy = ratelimit.RetryPolicy()
+        self.retry_policy = retry_policy
+        self.request_count = 0
+        self.retry_count = 0
+        self.throttled_count = 0
+        self.failed_count = 0
+        self.functions = functions
+        self.tools = [{'type': 'function', 'function': function} for function in functions]
+        self.max_connections = max_connections
+        self.keepalive_timeout = keepalive_timeout
+        self.session = None
+        self.session_loop = None
+
+    def get_session(self) -> aiohttp.ClientSession:
+        """the session is bound to the event loop it was created in"""
+        loop = asyncio.get_running_loop()
+        if self.session == None or self.session.closed or self.session_loop != loop:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=self.keepalive_timeout)
+            self.session = aiohttp.ClientSession(connector=connector)
+            self.session_loop = loop
+        return self.session
+
+    async def acquire_capacity(self, estimated_tokens):
+        if self.request_bucket != None:
+            await self.request_bucket.acquire()
+        if self.token_bucket != None:
+            await self.token_bucket.acquire(estimated_tokens)
+        await self.concurrency_limiter.acquire()
+
+    async def wait_for_capacity(self, estimated_tokens, notify_queued_fn):
+        """requests over the quota wait in line rather than fail, the user is told if it takes a while"""
+        acquire_task = asyncio.ensure_future(self.acquire_capacity(estimated_tokens))
+        try:
+            done, pending = await asyncio.wait({acquire_task}, timeout=QUEUED_NOTIFY_DELAY)
+            if len(pending) > 0 and notify_queued_fn != None:
+                await notify_queued_fn()
+            await acquire_task
+        except asyncio.CancelledError:
+            if acquire_task.done() and not acquire_task.cancelled() and acquire_task.exception() == None:
+                # cancelled while notifying the user, the slot was taken already and send_request won't release it
+                self.concurrency_limiter.release()
+            else:
+                acquire_task.cancel()
+            raise
+
+    async def chat_completion(self, notify_queued_fn=None, **kwargs):
+        """notify_queued_fn: optional coroutine function, called if the request is delayed by the rate limits"""
+        estimated_tokens = estimate_request_tokens(kwargs)
+        attempt = 0
+        while True:
+            await self.wait_for_capacity(estimated_tokens, notify_queued_fn)
+            try:
+                response = await self.send_request(**kwargs)
+            except Exception as e:
+                retry_after = ratelimit.get_retry_after(getattr(e, 'headers', None))
+                if not is_retryable_error(e) or not self.retry_policy.should_retry(attempt, retry_after):
+                    self.failed_count += 1
+                    metrics.llm_requests.inc(result='failed')
+                    raise
+                delay = self.retry_policy.get_delay(attempt, retry_after)
+                logger.warning(f'openai request failed ({type(e).__name__}: {e}), retrying in {delay:.2f}s')
+                self.retry_count += 1
+                metrics.llm_retries.inc(reason=type(e).__name__)
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            if self.token_bucket != None and not kwargs.get('stream', False) and 'usage' in response:
+                # correct the estimate with the actual token count
+                self.token_bucket.adjust(response['usage']['total_tokens'] - estimated_tokens)
+            metrics.llm_requests.inc(result='success')
+            if not kwargs.get('stream', False) and 'usage' in response:
+                metrics.llm_tokens.inc(response['usage']['prompt_tokens'], type='prompt')
+                metrics.llm_tokens.inc(response['usage']['completion_tokens'], type='completion')
+            return response
+
+    async def send_request(self, **kwargs):
+        """one attempt, the concurrency slot taken by wait_for_capacity is released when it's done.
+        when streaming, this returns once the response starts, the slot isn't held while the rest of the stream is read"""
+        self.request_count += 1
+        throttled = False
+        try:
+            return await self.request_chat_completion(**kwargs)
+        except openai.error.RateLimitError:
+            throttled = True
+            self.throttled_count += 1
+            raise
+        finally:
+            self.concurrency_limiter.release(throttled=throttled)
+
+    async def request_chat_completion(self, **kwargs):
+        # openai uses the session from this context variable instead of opening a new one for every request
+        token = openai.aiosession.set(self.get_session())
+        try:
+            return await openai.ChatCompletion.acreate(
+                # for OpenAI:
+                # model="gpt-3.5-turbo-0613"
+                # for Azure:
+                engine=self.deployment_name,
+                request_timeout=REQUEST_TIMEOUT,
+                **self.api_settings,
+                **kwargs
+            )
+        finally:
+            openai.aiosession.reset(token)
+
+    def get_stats(self):
+        return {
+            'requests': self.request_count,
+            'retries': self.retry_count,
+            'throttled': self.throttled_count,
+            'failed': self.failed_count,
+            'concurrency': self.concurrency_limiter.get_stats(),
+            'request_bucket': self.request_bucket.get_stats() if self.request_bucket != None else None,
+            'token_bucket': self.token_bucket.get_stats() if self.token_bucket != None else None
+        }
+
+    async def close(self):
+        if self.session != None and not self.session.closed:
+            await self.session.close()
+        self.session = None
@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import time
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONCURRENT_CHATS = 32
+
+class ChatQueue():
+    def __init__(self):
+        # asyncio.Lock wakes up waiters in FIFO order, which keeps the messages of a chat in order
+        self.lock = asyncio.Lock()
+        self.waiting = 0
+        self.processed = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+
+"""
+processes updates from different chats concurrently, up to a limit, while the updates of a given chat
+are processed one at a time, in the order they were received, so that the state of its ChatModel stays consistent.
+"""
+class ChatDispatcher():
+    def __init__(self, max_concurrent_chats=DEFAULT_MAX_CONCURRENT_CHATS):
+        self.max_concurrent_chats = max_concurrent_chats
+        self.semaphore = None
+        self.chats = {}
+        self.active = 0
+        self.processed = 0
+        self.total_wait_time = 0.0
+
+    def get_semaphore(self) -> asyncio.Semaphore:
+        # created on first use, inside the event loop
+        if self.semaphore == None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrent_chats)
+        return self.semaphore
+
+    async def run(self, chat_id, coroutine_fn):
+        """run coroutine_fn() once all the previous updates of this chat are done, and a slot is available.
+        must be called before the handler awaits anything else, so that the order of the updates is preserved"""
+        chat_queue = self.chats.get(chat_id, None)
+        if chat_queue == None:
+            chat_queue = ChatQueue()
+            self.chats[chat_id] = chat_queue
+        metrics.chat_queue_depth.observe(chat_queue.waiting + (1 if chat_queue.lock.locked() else 0))
+        chat_queue.waiting += 1
+        metrics.chat_updates_queued.inc()
+        enqueue_time = time.monotonic()
+        started = False
+        try:
+            async with chat_queue.lock:
+                async with self.get_semaphore():
+                    started = True
+                    wait_time = time.monotonic() - enqueue_time
+                    chat_queue.waiting -= 1
+                    metrics.chat_updates_queued.dec()
+                    metrics.chat_update_queue_wait.observe(wait_time)
+                    chat_queue.total_wait_time += wait_time
+                    chat_queue.max_wait_time = max(chat_queue.max_wait_time, wait_time)
+                    self.total_wait_time += wait_time
+                    if wait_time > 1.0:
+                        logger.info(f'chat {chat_id}: update waited {wait_time:.2f}s, {chat_queue.waiting} updates still queued')
+                    self.active += 1
+                    metrics.chat_updates_active.inc()
+                    try:
+                        return await coroutine_fn()
+                    finally:
+                        self.active -= 1
+                        metrics.chat_updates_active.dec()
+                        chat_queue.processed += 1
+                        self.processed += 1
+        finally:
+            if not started:
+                # cancelled while waiting
+                chat_queue.waiting -= 1
+                metrics.chat_updates_queued.dec()
+            if chat_queue.waiting == 0 and not chat_queue.lock.locked():
+                # no more updates for this chat, don't keep it around
+                self.chats.pop(chat_id, None)
+
+    def get_chat_stats(self, chat_id):
+        chat_queue = self.chats.get(chat_id, None)
+        if chat_queue == None:
+            return None
+        return {
+            'queue_depth': chat_queue.waiting,
+            'processed': chat_queue.processed,
+            'average_wait_time': chat_queue.total_wait_time / chat_queue.processed if chat_queue.processed > 0 else 0.0,
+            'max_wait_time': chat_queue.max_wait_time
+        }
+
+    def get_stats(self):
+        return {
+            'active': self.active,
+            'queued': sum([chat_queue.waiting for chat_queue in self.chats.values()]),
+            'processed': self.processed,
+            'average_wait_time': self.total_wait_time / self.processed if self.processed > 0 else 0.0,
+            'chats': {chat_id: self.get_chat_stats(chat_id) for chat_id in self.chats.keys()}
+        }
@@ -0,0 +1,161 @@
+import asyncio
+import concurrent.futures
+import logging
+import threading
+import time
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+TOOL_TYPE_RECOGNIZE_AUDIO = 'recognize_audio'
+TOOL_TYPE_AUDIO_PREPROCESS = 'audio_preprocess'
+TOOL_TYPE_AUDIO = 'audio'
+TOOL_TYPE_TRANSLATE = 'translate'
+TOOL_TYPE_TRANSLITERATE = 'transliterate'
+TOOL_TYPE_BREAKDOWN = 'breakdown'
+
+# number of threads for each type of tool. speech is slow, so it gets its own larger pools,
+# so that a slow text to speech request doesn't hold up translations
+DEFAULT_POOL_SIZES = {
+    TOOL_TYPE_RECOGNIZE_AUDIO: 4,
+    TOOL_TYPE_AUDIO_PREPROCESS: 2,
+    TOOL_TYPE_AUDIO: 8,
+    TOOL_TYPE_TRANSLATE: 8,
+    TOOL_TYPE_TRANSLITERATE: 4,
+    TOOL_TYPE_BREAKDOWN: 4,
+}
+DEFAULT_POOL_SIZE = 4
+
+DEFAULT_TIMEOUTS = {
+    TOOL_TYPE_RECOGNIZE_AUDIO: 30,
+    TOOL_TYPE_AUDIO: 30,
+}
+DEFAULT_TIMEOUT = 15
+
+class ToolTimeoutException(Exception):
+    pass
+
+class PoolMetrics():
+    def __init__(self):
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.cancelled = 0
+        self.total_queue_wait_time = 0.0
+        self.total_run_time = 0.0
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+"""
+runs blocking cloudlanguagetools calls on dedicated thread pools, one per type of tool,
+instead of the single shared thread used by asgiref's thread sensitive sync_to_async
+"""
+class ToolExecutor():
+    def __init__(self, pool_sizes=None, timeouts=None):
+        self.pool_sizes = dict(DEFAULT_POOL_SIZES)
+        if pool_sizes != None:
+            self.pool_sizes.update(pool_sizes)
+        self.timeouts = dict(DEFAULT_TIMEOUTS)
+        if timeouts != None:
+            self.timeouts.update(timeouts)
+        self.pools = {}
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def get_pool(self, tool_type) -> concurrent.futures.ThreadPoolExecutor:
+        with self.lock:
+            if tool_type not in self.pools:
+                pool_size = self.pool_sizes.get(tool_type, DEFAULT_POOL_SIZE)
+                self.pools[tool_type] = concurrent.futures.ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix=f'clt_{tool_type}')
+                self.metrics[tool_type] = PoolMetrics()
+            return self.pools[tool_type]
+
+    def get_timeout(self, tool_type):
+        return self.timeouts.get(tool_type, DEFAULT_TIMEOUT)
+
+    async def run(self, tool_type, fn, *args, timeout=None):
+        """run fn(*args) on the pool for tool_type, raise ToolTimeoutException if it takes longer than the timeout.
+        the thread can't be interrupted, it will finish in the background, but the caller doesn't wait for it"""
+        pool = self.get_pool(tool_type)
+        pool_metrics = self.metrics[tool_type]
+        if timeout == None:
+            timeout = self.get_timeout(tool_type)
+        submit_time = time.monotonic()
+        # a call which timed out while still queued must not run anymore
+        state = {'started': False, 'abandoned': False}
+
+        def run_in_thread():
+            start_time = time.monotonic()
+            with self.lock:
+                if state['abandoned']:
+                    return None
+                state['started'] = True
+                pool_metrics.queued -= 1
+                pool_metrics.running += 1
+                pool_metrics.total_queue_wait_time += start_time - submit_time
+            metrics.tool_calls_queued.dec(tool_type=tool_type)
+            metrics.tool_calls_running.inc(tool_type=tool_type)
+            metrics.tool_call_queue_wait.observe(start_time - submit_time, tool_type=tool_type)
+            try:
+                return fn(*args)
+            finally:
+                run_time = time.monotonic() - start_time
+                with self.lock:
+                    pool_metrics.running -= 1
+                    pool_metrics.total_run_time += run_time
+                metrics.tool_calls_running.dec(tool_type=tool_type)
+                metrics.tool_call_run_duration.observe(run_time, tool_type=tool_type)
+
+        with self.lock:
+            pool_metrics.queued += 1
+        metrics.tool_calls_queued.inc(tool_type=tool_type)
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(pool, run_in_thread)
+        def abandon():
+            # must be called with the lock held
+            state['abandoned'] = True
+            if not state['started']:
+                pool_metrics.queued -= 1
+                metrics.tool_calls_queued.dec(tool_type=tool_type)
+
+        try:
+            result = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            with self.lock:
+                pool_metrics.timeouts += 1
+                abandon()
+            metrics.tool_calls.inc(tool_type=tool_type, result='timeout')
+            raise ToolTimeoutException(f'{tool_type} timed out after {timeout} seconds')
+        except asyncio.CancelledError:
+            # the caller is gone, for example the sibling of a failed tool call
+            with self.lock:
+                pool_metrics.cancelled += 1
+                abandon()
+            metrics.tool_calls.inc(tool_type=tool_type, result='cancelled')
+            raise
+        except Exception:
+            with self.lock:
+                pool_metrics.errors += 1
+            metrics.tool_calls.inc(tool_type=tool_type, result='error')
+            raise
+        with self.lock:
+            pool_metrics.completed += 1
+        metrics.tool_calls.inc(tool_type=tool_type, result='completed')
+        return result
+
+    def get_stats(self):
+        with self.lock:
+            return {tool_type: metrics.to_dict() for tool_type, metrics in self.metrics.items()}
+
+    def shutdown(self):
+        with self.lock:
+            for pool in self.pools.values():
+                pool.shutdown(wait=False)
+            self.pools = {}
+
+# shared by all ChatModel instances in the process, unless they are given their own executor
+shared_tool_executor = ToolExecutor()
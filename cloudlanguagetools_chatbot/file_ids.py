@@ -0,0 +1,57 @@
+import logging
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+"""
+remembers the file_id telegram returns for each uploaded voice note, keyed by the hash of the text to
+speech request (see AudioCache.get_key), so that the same audio can be sent to other chats without
+uploading it again. stored in sqlite, file_ids stay valid across restarts.
+"""
+class FileIdStore():
+    def __init__(self, sqlite_path=':memory:'):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(sqlite_path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS file_ids (key TEXT PRIMARY KEY, file_id TEXT, updated REAL)')
+        self.db.commit()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def get(self, key) -> Optional[str]:
+        with self.lock:
+            row = self.db.execute('SELECT file_id FROM file_ids WHERE key=?', (key,)).fetchone()
+            if row == None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, file_id):
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO file_ids (key, file_id, updated) VALUES (?, ?, ?)', (key, file_id, time.time()))
+            self.db.commit()
+
+    def remove_stale(self, key):
+        """the file_id was rejected by telegram"""
+        logger.info(f'removing stale file_id for {key}')
+        with self.lock:
+            self.db.execute('DELETE FROM file_ids WHERE key=?', (key,))
+            self.db.commit()
+            self.stale += 1
+
+    def get_stats(self):
+        with self.lock:
+            entries = self.db.execute('SELECT COUNT(*) FROM file_ids').fetchone()[0]
+            return {
+                'entries': entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale': self.stale
+            }
+
+    def close(self):
+        self.db.close()
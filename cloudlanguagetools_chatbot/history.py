@@ -0,0 +1,96 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+    encoding = tiktoken.get_encoding('cl100k_base')
+except ImportError:
+    # without tiktoken, approximate the token count from the text length
+    encoding = None
+
+DEFAULT_MAX_HISTORY_TOKENS = 3000
+DEFAULT_KEEP_RECENT_TURNS = 2
+DEFAULT_COMPACTED_RESULT_LENGTH = 200
+# tokens used by the message structure itself (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+OMITTED_TURNS_MESSAGE = 'Some earlier questions and answers about this sentence were omitted.'
+
+def count_text_tokens(text) -> int:
+    if text == None:
+        return 0
+    if encoding != None:
+        return len(encoding.encode(text))
+    return len(text) // 3 + 1
+
+def count_message_tokens(message) -> int:
+    tokens = MESSAGE_OVERHEAD_TOKENS + count_text_tokens(message.get('content', None))
+    for tool_call in message.get('tool_calls', None) or []:
+        tokens += count_text_tokens(tool_call['function']['name'])
+        tokens += count_text_tokens(tool_call['function']['arguments'])
+    return tokens
+
+def count_messages_tokens(messages) -> int:
+    return sum([count_message_tokens(message) for message in messages])
+
+def split_turns(message_history):
+    """a turn starts with a user message, and contains the assistant messages and tool results that follow"""
+    turns = []
+    for message in message_history:
+        if message['role'] == 'user' or len(turns) == 0:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+"""
+keeps the conversation history sent to the model under a token budget. the first turn (the input
+sentence and the results of the instructions) and the most recent turns are kept, tool results of
+older turns are shortened, and if that's not enough, the turns in between are dropped.
+"""
+class HistoryManager():
+    def __init__(self, max_history_tokens=DEFAULT_MAX_HISTORY_TOKENS,
+                 keep_recent_turns=DEFAULT_KEEP_RECENT_TURNS,
+                 compacted_result_length=DEFAULT_COMPACTED_RESULT_LENGTH):
+        self.max_history_tokens = max_history_tokens
+        self.keep_recent_turns = keep_recent_turns
+        self.compacted_result_length = compacted_result_length
+
+    def compact_message(self, message):
+        if message['role'] != 'tool' or len(message['content']) <= self.compacted_result_length:
+            return message
+        compacted_message = dict(message)
+        compacted_message['content'] = message['content'][:self.compacted_result_length] + '...'
+        return compacted_message
+
+    def trim(self, message_history):
+        """returns a new history which fits in the token budget, the current turn is always kept whole"""
+        if count_messages_tokens(message_history) <= self.max_history_tokens:
+            return message_history
+
+        turns = split_turns(message_history)
+        # turns which may be compacted: everything except the most recent ones
+        recent_turn_count = max(1, self.keep_recent_turns)
+        old_turn_count = max(0, len(turns) - recent_turn_count)
+        for i in range(old_turn_count):
+            turns[i] = [self.compact_message(message) for message in turns[i]]
+
+        # drop the turns between the first one and the recent ones, oldest first
+        dropped_turn_count = 0
+        while count_messages_tokens(sum(turns, [])) > self.max_history_tokens and len(turns) > recent_turn_count + 1:
+            del turns[1]
+            dropped_turn_count += 1
+
+        # still too large: compact all turns except the current one
+        if count_messages_tokens(sum(turns, [])) > self.max_history_tokens:
+            turns = [[self.compact_message(message) for message in turn] for turn in turns[:-1]] + [turns[-1]]
+
+        if dropped_turn_count > 0:
+            logger.info(f'dropped {dropped_turn_count} turns from the history')
+            omitted_turns_message = {'role': 'system', 'content': OMITTED_TURNS_MESSAGE}
+            # the note stays at the end of the first turn when the history is trimmed again
+            if turns[0][-1] != omitted_turns_message:
+                turns[0] = turns[0] + [omitted_turns_message]
+
+        trimmed_history = sum(turns, [])
+        logger.debug(f'history trimmed from {count_messages_tokens(message_history)} to {count_messages_tokens(trimmed_history)} tokens')
+        return trimmed_history
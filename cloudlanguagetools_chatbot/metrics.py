@@ -0,0 +1,246 @@
+import bisect
+import contextlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+try:
+    import opentelemetry.trace
+    tracer = opentelemetry.trace.get_tracer(__name__)
+except ImportError:
+    # without opentelemetry, spans are only recorded as prometheus metrics
+    tracer = None
+
+METRIC_PREFIX = 'clt_chatbot_'
+DEFAULT_LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+STARTUP_BUCKETS = [0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0]
+QUEUE_DEPTH_BUCKETS = [0, 1, 2, 5, 10, 20, 50]
+
+def format_labels(label_names, label_values, extra_labels=None):
+    labels = list(zip(label_names, label_values))
+    if extra_labels != None:
+        labels.extend(extra_labels)
+    if len(labels) == 0:
+        return ''
+    escaped_labels = [(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for name, value in labels]
+    return '{' + ','.join([f'{name}="{value}"' for name, value in escaped_labels]) + '}'
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter():
+    def __init__(self, name, help, label_names=()):
+        self.name = METRIC_PREFIX + name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple([labels.get(name, '') for name in self.label_names])
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        key = tuple([labels.get(name, '') for name in self.label_names])
+        return self.values.get(key, 0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{format_labels(self.label_names, key)} {format_value(value)}')
+        return lines
+
+class Gauge():
+    def __init__(self, name, help, label_names=()):
+        self.name = METRIC_PREFIX + name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple([labels.get(name, '') for name in self.label_names])
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = tuple([labels.get(name, '') for name in self.label_names])
+        with self.lock:
+            self.values[key] = value
+
+    def get(self, **labels):
+        key = tuple([labels.get(name, '') for name in self.label_names])
+        return self.values.get(key, 0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge']
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{format_labels(self.label_names, key)} {format_value(value)}')
+        return lines
+
+class Histogram():
+    def __init__(self, name, help, label_names=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        self.name = METRIC_PREFIX + name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = list(buckets)
+        # label values -> [bucket counts, sum, count]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple([labels.get(name, '') for name in self.label_names])
+        with self.lock:
+            entry = self.values.get(key, None)
+            if entry == None:
+                entry = [[0] * len(self.buckets), 0.0, 0]
+                self.values[key] = entry
+            bucket_index = bisect.bisect_left(self.buckets, value)
+            if bucket_index < len(self.buckets):
+                entry[0][bucket_index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def get_count(self, **labels):
+        key = tuple([labels.get(name, '') for name in self.label_names])
+        entry = self.values.get(key, None)
+        return entry[2] if entry != None else 0
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            for key, (bucket_counts, total, count) in sorted(self.values.items()):
+                cumulative_count = 0
+                for upper_bound, bucket_count in zip(self.buckets, bucket_counts):
+                    cumulative_count += bucket_count
+                    lines.append(f'{self.name}_bucket{format_labels(self.label_names, key, [("le", format_value(float(upper_bound)))])} {cumulative_count}')
+                lines.append(f'{self.name}_bucket{format_labels(self.label_names, key, [("le", "+Inf")])} {count}')
+                lines.append(f'{self.name}_sum{format_labels(self.label_names, key)} {format_value(total)}')
+                lines.append(f'{self.name}_count{format_labels(self.label_names, key)} {count}')
+        return lines
+
+"""
+the metrics of the process, rendered in the prometheus text format
+"""
+class MetricsRegistry():
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help, label_names=()) -> Counter:
+        counter = Counter(name, help, label_names)
+        self.metrics.append(counter)
+        return counter
+
+    def gauge(self, name, help, label_names=()) -> Gauge:
+        gauge = Gauge(name, help, label_names)
+        self.metrics.append(gauge)
+        return gauge
+
+    def histogram(self, name, help, label_names=(), buckets=DEFAULT_LATENCY_BUCKETS) -> Histogram:
+        histogram = Histogram(name, help, label_names, buckets)
+        self.metrics.append(histogram)
+        return histogram
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+registry = MetricsRegistry()
+
+span_duration = registry.histogram('span_duration_seconds', 'duration of the steps of a turn', ['span', 'function', 'provider'])
+span_errors = registry.counter('span_errors_total', 'steps of a turn which raised an exception', ['span', 'function', 'provider'])
+input_classifications = registry.counter('input_classifications_total', 'inputs categorized locally or by the LLM', ['method', 'input_type'])
+llm_requests = registry.counter('llm_requests_total', 'requests sent to Azure OpenAI', ['result'])
+llm_retries = registry.counter('llm_retries_total', 'Azure OpenAI requests retried', ['reason'])
+llm_tokens = registry.counter('llm_tokens_total', 'tokens reported by Azure OpenAI', ['type'])
+cache_requests = registry.counter('cache_requests_total', 'lookups in the result and audio caches', ['cache', 'function', 'result'])
+startup_duration = registry.histogram('startup_duration_seconds', 'time spent starting the bot, by phase', ['phase'], STARTUP_BUCKETS)
+audio_preprocess_bytes = registry.counter('audio_preprocess_bytes_total', 'voice note bytes before and after preprocessing', ['stage'])
+speculative_completions = registry.counter('speculative_completions_total', 'speculative completions used (hit) or discarded (miss)', ['result', 'input_type'])
+speculative_wasted_tokens = registry.counter('speculative_wasted_tokens_total', 'tokens of the discarded speculative completions, estimated if the request was cancelled')
+tool_calls_queued = registry.gauge('tool_calls_queued', 'tool calls waiting for a thread of the executor', ['tool_type'])
+tool_calls_running = registry.gauge('tool_calls_running', 'tool calls running on the executor threads', ['tool_type'])
+tool_calls = registry.counter('tool_calls_total', 'tool calls run on the executor, by result', ['tool_type', 'result'])
+tool_call_queue_wait = registry.histogram('tool_call_queue_wait_seconds', 'time tool calls waited for a thread of the executor', ['tool_type'])
+tool_call_run_duration = registry.histogram('tool_call_run_seconds', 'time tool calls ran on the executor threads', ['tool_type'])
+chat_updates_active = registry.gauge('chat_updates_active', 'updates being processed by the chat dispatcher')
+chat_updates_queued = registry.gauge('chat_updates_queued', 'updates waiting behind an update of the same chat, or for a slot')
+chat_update_queue_wait = registry.histogram('chat_update_queue_wait_seconds', 'time updates waited in the chat dispatcher')
+chat_queue_depth = registry.histogram('chat_queue_depth', 'updates of the same chat already queued when an update arrives', [], QUEUE_DEPTH_BUCKETS)
+
+@contextlib.contextmanager
+def span(name, function='', provider=''):
+    """times a step of a turn. works around awaits: with metrics.span('call_openai'): await ..."""
+    otel_span_context = None
+    if tracer != None:
+        attributes = {'function': function, 'provider': provider}
+        otel_span_context = tracer.start_as_current_span(name, attributes=attributes)
+        otel_span_context.__enter__()
+    start_time = time.monotonic()
+    exc_info = (None, None, None)
+    try:
+        yield
+    except BaseException as e:
+        exc_info = (type(e), e, e.__traceback__)
+        if isinstance(e, Exception):
+            span_errors.inc(span=name, function=function, provider=provider)
+        raise
+    finally:
+        span_duration.observe(time.monotonic() - start_time, span=name, function=function, provider=provider)
+        if otel_span_context != None:
+            otel_span_context.__exit__(*exc_info)
+
+def timed(name, coroutine_fn):
+    """wraps a coroutine function, such as a send_message callback, in a span"""
+    if coroutine_fn == None:
+        return None
+    async def timed_coroutine_fn(*args, **kwargs):
+        with span(name):
+            return await coroutine_fn(*args, **kwargs)
+    return timed_coroutine_fn
+
+def configure_opentelemetry(service_name='clt-chatbot'):
+    """export the spans with OTLP, if the opentelemetry sdk and exporter are installed.
+    the endpoint is configured with the usual OTEL_EXPORTER_OTLP_* environment variables"""
+    try:
+        import opentelemetry.sdk.resources
+        import opentelemetry.sdk.trace
+        import opentelemetry.sdk.trace.export
+        import opentelemetry.exporter.otlp.proto.http.trace_exporter
+    except ImportError:
+        logger.warning('opentelemetry sdk or otlp exporter not installed, spans are not exported')
+        return False
+    resource = opentelemetry.sdk.resources.Resource.create({'service.name': service_name})
+    tracer_provider = opentelemetry.sdk.trace.TracerProvider(resource=resource)
+    tracer_provider.add_span_processor(opentelemetry.sdk.trace.export.BatchSpanProcessor(
+        opentelemetry.exporter.otlp.proto.http.trace_exporter.OTLPSpanExporter()))
+    opentelemetry.trace.set_tracer_provider(tracer_provider)
+    logger.info('exporting spans with opentelemetry')
+    return True
+
+async def start_http_server(port, host='0.0.0.0'):
+    """serves /metrics, returns the runner, to be cleaned up when stopping"""
+    import aiohttp.web
+    async def handle_metrics(request):
+        return aiohttp.web.Response(body=registry.render().encode('utf-8'),
+                                    headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+    web_application = aiohttp.web.Application()
+    web_application.router.add_get('/metrics', handle_metrics)
+    runner = aiohttp.web.AppRunner(web_application, access_log=None)
+    await runner.setup()
+    site = aiohttp.web.TCPSite(runner, host, port)
+    await site.start()
+    logger.info(f'serving metrics on port {port}')
+    return runner
@@ -0,0 +1,235 @@
+import asyncio
+import collections
+import datetime
+import logging
+import time
+import telegram.error
+
+from . import ratelimit
+
+logger = logging.getLogger(__name__)
+
+# https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this
+DEFAULT_MESSAGES_PER_SECOND = 30
+DEFAULT_CHAT_MESSAGES_PER_SECOND = 1.0
+# a few messages can go out at once in a chat which was quiet
+DEFAULT_CHAT_BURST = 3
+# texts sent within this window are merged into one message
+DEFAULT_COALESCE_WINDOW = 0.25
+MAX_MESSAGE_LENGTH = 4096
+MERGED_TEXT_SEPARATOR = '\n\n'
+DEFAULT_MAX_RETRIES = 5
+# a streamed answer is edited at most once per interval
+DEFAULT_EDIT_INTERVAL = 1.0
+# outboxes of chats which haven't sent anything for this long are removed
+OUTBOX_IDLE_TIMEOUT = 60.0
+
+def get_retry_after_seconds(retry_after) -> float:
+    # python-telegram-bot gives an int or a timedelta, depending on the version and settings
+    if isinstance(retry_after, datetime.timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+"""
+a message to send to a chat. send_fn is a coroutine function: send_fn(text) for a text, which is merged with
+the adjacent texts of the same kind, send_fn() otherwise. a queued message is dropped when a newer message
+with the same replace_key is queued, for example successive edits of a message.
+"""
+class OutboundMessage():
+    def __init__(self, send_fn, text=None, kind=None, replace_key=None):
+        self.send_fn = send_fn
+        self.text = text
+        self.kind = kind
+        self.replace_key = replace_key
+        # resolved with the result of send_fn, or None if the message couldn't be sent
+        self.future = None
+
+    def can_merge(self, other: 'OutboundMessage') -> bool:
+        return self.text != None and other.text != None and self.kind != None and self.kind == other.kind
+
+class ChatOutbox():
+    def __init__(self, bucket):
+        self.queue = collections.deque()
+        self.bucket = bucket
+        self.task = None
+        self.last_activity_time = time.monotonic()
+
+"""
+sends the messages of the chats in the background, so that the chat models don't wait for telegram.
+the messages of a chat are sent in order, adjacent texts are merged, and the sends are rate limited per chat
+and globally to stay within the telegram flood limits. sends rejected with RetryAfter or failing with a
+network error are retried.
+"""
+class OutboundDispatcher():
+    def __init__(self, messages_per_second=DEFAULT_MESSAGES_PER_SECOND, chat_messages_per_second=DEFAULT_CHAT_MESSAGES_PER_SECOND,
+                 chat_burst=DEFAULT_CHAT_BURST, coalesce_window=DEFAULT_COALESCE_WINDOW, retry_policy=None):
+        self.global_bucket = ratelimit.TokenBucket(messages_per_second, period=1.0)
+        self.chat_messages_per_second = chat_messages_per_second
+        self.chat_burst = chat_burst
+        self.coalesce_window = coalesce_window
+        if retry_policy == None:
+            retry_policy = ratelimit.RetryPolicy(max_retries=DEFAULT_MAX_RETRIES)
+        self.retry_policy = retry_policy
+        self.outboxes = {}
+        self.last_prune_time = time.monotonic()
+        self.queued_count = 0
+        self.sent_count = 0
+        self.merged_count = 0
+        self.replaced_count = 0
+        self.retry_count = 0
+        self.flood_count = 0
+        self.failed_count = 0
+
+    def enqueue(self, chat_id, message: OutboundMessage) -> asyncio.Future:
+        """returns right away. the future can be awaited for the result of the send"""
+        self.prune_idle_outboxes()
+        outbox = self.outboxes.get(chat_id, None)
+        if outbox == None:
+            outbox = ChatOutbox(ratelimit.TokenBucket(self.chat_messages_per_second, period=1.0, capacity=self.chat_burst))
+            self.outboxes[chat_id] = outbox
+        if message.replace_key != None:
+            for queued_message in [queued_message for queued_message in outbox.queue if queued_message.replace_key == message.replace_key]:
+                outbox.queue.remove(queued_message)
+                queued_message.future.set_result(None)
+                self.replaced_count += 1
+        message.future = asyncio.get_running_loop().create_future()
+        outbox.queue.append(message)
+        outbox.last_activity_time = time.monotonic()
+        self.queued_count += 1
+        if outbox.task == None:
+            outbox.task = asyncio.ensure_future(self.run_outbox(chat_id, outbox))
+        return message.future
+
+    def prune_idle_outboxes(self):
+        now = time.monotonic()
+        if now - self.last_prune_time < OUTBOX_IDLE_TIMEOUT:
+            return
+        self.last_prune_time = now
+        for chat_id in [chat_id for chat_id, outbox in self.outboxes.items()
+                        if outbox.task == None and now - outbox.last_activity_time > OUTBOX_IDLE_TIMEOUT]:
+            del self.outboxes[chat_id]
+
+    async def run_outbox(self, chat_id, outbox):
+        try:
+            while len(outbox.queue) > 0:
+                message = outbox.queue.popleft()
+                messages = [message]
+                send_fn = message.send_fn
+                if message.text != None:
+                    if len(outbox.queue) == 0 and message.kind != None and self.coalesce_window > 0:
+                        # give the next output of the turn a chance to join this message
+                        await asyncio.sleep(self.coalesce_window)
+                    text = message.text
+                    while len(outbox.queue) > 0 and message.can_merge(outbox.queue[0]) \
+                            and len(text) + len(MERGED_TEXT_SEPARATOR) + len(outbox.queue[0].text) <= MAX_MESSAGE_LENGTH:
+                        merged_message = outbox.queue.popleft()
+                        text += MERGED_TEXT_SEPARATOR + merged_message.text
+                        messages.append(merged_message)
+                    self.merged_count += len(messages) - 1
+                    send_fn = lambda text=text, message=message: message.send_fn(text)
+                result = await self.send(chat_id, outbox, send_fn)
+                for merged_message in messages:
+                    if not merged_message.future.done():
+                        merged_message.future.set_result(result)
+                outbox.last_activity_time = time.monotonic()
+        finally:
+            outbox.task = None
+            # cancelled while stopping, don't leave anyone waiting
+            for message in outbox.queue:
+                if not message.future.done():
+                    message.future.set_result(None)
+
+    async def send(self, chat_id, outbox, send_fn):
+        attempt = 0
+        while True:
+            retry_after = None
+            await outbox.bucket.acquire()
+            await self.global_bucket.acquire()
+            try:
+                result = await send_fn()
+                self.sent_count += 1
+                return result
+            except telegram.error.RetryAfter as e:
+                self.flood_count += 1
+                retry_after = get_retry_after_seconds(e.retry_after)
+                delay = self.retry_policy.get_delay(attempt, retry_after)
+                logger.warning(f'chat {chat_id}: flood control, retrying in {delay:.1f}s')
+            except telegram.error.BadRequest as e:
+                # the message itself is rejected, sending it again won't help
+                logger.error(f'chat {chat_id}: could not send message: {e}')
+                self.failed_count += 1
+                return None
+            except (telegram.error.TimedOut, telegram.error.NetworkError) as e:
+                delay = self.retry_policy.get_delay(attempt)
+                logger.warning(f'chat {chat_id}: network error ({e}), retrying in {delay:.1f}s')
+            except Exception as e:
+                logger.exception(f'chat {chat_id}: could not send message')
+                self.failed_count += 1
+                return None
+            if not self.retry_policy.should_retry(attempt, retry_after):
+                logger.error(f'chat {chat_id}: giving up sending message after {attempt + 1} attempts')
+                self.failed_count += 1
+                return None
+            attempt += 1
+            self.retry_count += 1
+            await asyncio.sleep(delay)
+
+    async def flush(self):
+        """wait until all the queued messages have been sent"""
+        tasks = [outbox.task for outbox in self.outboxes.values() if outbox.task != None]
+        while len(tasks) > 0:
+            await asyncio.gather(*tasks, return_exceptions=True)
+            tasks = [outbox.task for outbox in self.outboxes.values() if outbox.task != None]
+
+    def get_stats(self):
+        return {
+            'chats': len(self.outboxes),
+            'pending': sum([len(outbox.queue) for outbox in self.outboxes.values()]),
+            'queued': self.queued_count,
+            'sent': self.sent_count,
+            'merged': self.merged_count,
+            'replaced': self.replaced_count,
+            'retries': self.retry_count,
+            'flood_control': self.flood_count,
+            'failed': self.failed_count,
+            'global_bucket': self.global_bucket.get_stats()
+        }
+
+"""
+shows a streamed answer in one message: the first update sends the message, the following ones edit it, at most
+once per interval, to stay under the telegram rate limits. an edit still queued is replaced by the next one, the
+final text is always shown. send_fn(text) returns the message, edit_fn(message, text) edits it.
+"""
+class MessageUpdater():
+    def __init__(self, dispatcher: OutboundDispatcher, chat_id, send_fn, edit_fn, edit_interval=DEFAULT_EDIT_INTERVAL):
+        self.dispatcher = dispatcher
+        self.chat_id = chat_id
+        self.send_fn = send_fn
+        self.edit_fn = edit_fn
+        self.edit_interval = edit_interval
+        self.message_future = None
+        self.text = None
+        self.last_edit_time = 0
+
+    async def update(self, text, final):
+        if len(text.strip()) == 0:
+            return
+        now = time.monotonic()
+        if self.message_future == None:
+            self.message_future = self.dispatcher.enqueue(self.chat_id, OutboundMessage(lambda text=text: self.send_fn(text)))
+            self.text = text
+            self.last_edit_time = now
+        elif text != self.text and (final or now - self.last_edit_time >= self.edit_interval):
+            message_future = self.message_future
+            async def edit_message(text=text):
+                # sent after the message in the chat's queue, the message has been sent already
+                message = await message_future
+                if message != None:
+                    return await self.edit_fn(message, text)
+            self.dispatcher.enqueue(self.chat_id, OutboundMessage(edit_message, replace_key=('edit', id(message_future))))
+            self.text = text
+            self.last_edit_time = now
+        if final:
+            # the next streamed answer goes into a new message
+            self.message_future = None
+            self.text = None
@@ -0,0 +1,163 @@
+import collections
+import logging
+import threading
+import pydantic
+from typing import List, Optional
+from strenum import StrEnum
+import cloudlanguagetools.languages
+import cloudlanguagetools.constants
+from cloudlanguagetools_chatbot import categorize
+
+logger = logging.getLogger(__name__)
+
+COMPILE_FUNCTION_NAME = 'compile_instructions'
+DETECT_LANGUAGE_FUNCTION_NAME = 'detect_input_language'
+
+DESCRIPTION_FN_COMPILE = """Convert the instructions into the list of functions to call on each new input sentence, in order.
+The input text of every function is the new input sentence."""
+
+DESCRIPTION_FLD_APPLICABLE = """false if the instructions can't be carried out only by calling these functions on the input sentence,
+for example if they ask for explanations, grammar notes, or a translation of only part of the sentence.
+also false if the instructions ask for an option which the fields of the steps can't represent, such as a voice,
+a speed or a transliteration style."""
+
+DESCRIPTION_FN_DETECT_LANGUAGE = "Detect the language of the input sentence"
+
+DEFAULT_MAX_PLANS = 1000
+
+class PlanFunction(StrEnum):
+    translate_or_lookup = 'translate_or_lookup'
+    transliterate = 'transliterate'
+    breakdown = 'breakdown'
+    pronounce = 'pronounce'
+
+class PlanStep(pydantic.BaseModel):
+    function_name: PlanFunction = pydantic.Field(description='function to call on the input sentence')
+    target_language: Optional[cloudlanguagetools.languages.CommonLanguage] = pydantic.Field(default=None,
+        description='for translate_or_lookup and breakdown, the language to translate to')
+    service: Optional[cloudlanguagetools.constants.Service] = pydantic.Field(default=None, description='service to use, only if the instructions specify one')
+    gender: Optional[cloudlanguagetools.constants.Gender] = pydantic.Field(default=None,
+        description='for pronounce, gender of the voice, only if the instructions specify one')
+    transliteration_service: Optional[cloudlanguagetools.constants.Service] = pydantic.Field(default=None,
+        description='for breakdown, service to use for the transliteration, only if the instructions specify one')
+
+class ToolPlan(pydantic.BaseModel):
+    applicable: bool = pydantic.Field(description=DESCRIPTION_FLD_APPLICABLE)
+    input_language: Optional[cloudlanguagetools.languages.CommonLanguage] = pydantic.Field(default=None,
+        description='language of the input sentences, only if the instructions specify it')
+    steps: List[PlanStep] = pydantic.Field(default=[], description='the functions to call, in order')
+
+    def get_tool_calls(self, input_text, language):
+        """the function name and arguments of each step, for an input sentence in the given CommonLanguage"""
+        tool_calls = []
+        for step in self.steps:
+            service = step.service.value if step.service != None else None
+            target_language = (step.target_language or cloudlanguagetools.languages.CommonLanguage.en).value
+            if step.function_name == PlanFunction.translate_or_lookup:
+                arguments = {'input_text': input_text, 'source_language': language.value, 'target_language': target_language, 'service': service}
+            elif step.function_name == PlanFunction.breakdown:
+                transliteration_service = step.transliteration_service.value if step.transliteration_service != None else None
+                arguments = {'input_text': input_text, 'language': language.value, 'translation_language': target_language,
+                    'translation_service': service, 'transliteration_service': transliteration_service}
+            elif step.function_name == PlanFunction.pronounce:
+                gender = step.gender.value if step.gender != None else None
+                arguments = {'input_text': input_text, 'language': language.value, 'service': service, 'gender': gender}
+            else:
+                arguments = {'input_text': input_text, 'language': language.value, 'service': service}
+            tool_calls.append((step.function_name.value, {key: value for key, value in arguments.items() if value != None}))
+        return tool_calls
+
+class InputLanguage(pydantic.BaseModel):
+    language: cloudlanguagetools.languages.CommonLanguage = pydantic.Field(description='language of the input sentence')
+
+# scripts which identify the language of a sentence on their own
+SCRIPT_LANGUAGES = {
+    'HIRAGANA': 'ja',
+    'KATAKANA': 'ja',
+    'HANGUL': 'ko',
+    'THAI': 'th',
+    'GREEK': 'el',
+    'HEBREW': 'he',
+    'ARABIC': 'ar',
+}
+
+# the scripts a language is written in, latin for the languages which are not listed
+LANGUAGE_SCRIPTS = {
+    'zh_cn': ['CJK'],
+    'yue': ['CJK'],
+    'ja': ['CJK', 'HIRAGANA', 'KATAKANA'],
+    'ko': ['HANGUL', 'CJK'],
+    'ru': ['CYRILLIC'],
+    'uk': ['CYRILLIC'],
+    'bg': ['CYRILLIC'],
+    'el': ['GREEK'],
+    'he': ['HEBREW'],
+    'iw': ['HEBREW'],
+    'ar': ['ARABIC'],
+    'hi': ['DEVANAGARI'],
+    'ne': ['DEVANAGARI'],
+    'th': ['THAI'],
+}
+
+def get_scripts(text):
+    return set([script for script in [categorize.get_script(character) for character in text] if script != None])
+
+def detect_language_from_script(text) -> Optional[cloudlanguagetools.languages.CommonLanguage]:
+    """the language, when the script of the text leaves no doubt. None otherwise, for example for latin
+    or chinese characters"""
+    for script in get_scripts(text):
+        if script in SCRIPT_LANGUAGES:
+            return cloudlanguagetools.languages.CommonLanguage[SCRIPT_LANGUAGES[script]]
+    return None
+
+def is_language_script(text, language) -> bool:
+    """whether the text is written in a script of the language. a sentence in another script is probably
+    not one the instructions apply to"""
+    dominant_script = categorize.get_dominant_script(text)
+    if dominant_script == None:
+        return False
+    return dominant_script in LANGUAGE_SCRIPTS.get(language.name, [categorize.SCRIPT_LATIN])
+
+def is_latin_language(language) -> bool:
+    """whether the language is written in latin script. the script of a sentence doesn't tell it apart from
+    english, questions about the previous sentence for example"""
+    return categorize.SCRIPT_LATIN in LANGUAGE_SCRIPTS.get(language.name, [categorize.SCRIPT_LATIN])
+
+"""
+the tool plans compiled from instructions, shared by all chat models, since most users keep the default
+instruction or set the same ones
+"""
+class ToolPlanCache():
+    def __init__(self, max_entries=DEFAULT_MAX_PLANS):
+        self.max_entries = max_entries
+        self.plans = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, instruction) -> Optional[ToolPlan]:
+        with self.lock:
+            plan = self.plans.get(instruction, None)
+            if plan == None:
+                self.misses += 1
+                return None
+            self.plans.move_to_end(instruction)
+            self.hits += 1
+            return plan
+
+    def put(self, instruction, plan: ToolPlan):
+        with self.lock:
+            self.plans[instruction] = plan
+            self.plans.move_to_end(instruction)
+            while len(self.plans) > self.max_entries:
+                self.plans.popitem(last=False)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.plans),
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+shared_tool_plan_cache = ToolPlanCache()
@@ -0,0 +1,208 @@
+import asyncio
+import logging
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_BASE_DELAY = 0.5
+DEFAULT_MAX_DELAY = 20.0
+DEFAULT_INITIAL_CONCURRENCY = 16
+DEFAULT_MIN_CONCURRENCY = 1
+DEFAULT_MAX_CONCURRENCY = 128
+# after a decrease, wait this long before decreasing again, so that a burst of throttled requests,
+# which were all sent with the old limit, only counts once
+DEFAULT_DECREASE_INTERVAL = 1.0
+
+"""
+token bucket: holds up to capacity tokens, refilled continuously at rate tokens per period.
+used for the requests per minute and tokens per minute quotas of the Azure OpenAI deployment.
+waiters are served in FIFO order.
+"""
+class TokenBucket():
+    def __init__(self, rate, period=60.0, capacity=None):
+        self.rate = rate
+        self.period = period
+        # by default, a full period worth of tokens can be used at once
+        self.capacity = capacity if capacity != None else rate
+        self.tokens = self.capacity
+        self.last_refill_time = time.monotonic()
+        self.lock = None
+        self.total_wait_time = 0.0
+        self.delayed_count = 0
+
+    def get_lock(self) -> asyncio.Lock:
+        # created on first use, inside the event loop
+        if self.lock == None:
+            self.lock = asyncio.Lock()
+        return self.lock
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill_time) * self.rate / self.period)
+        self.last_refill_time = now
+
+    def get_wait_time(self, amount=1) -> float:
+        """how long until amount tokens are available"""
+        self.refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) * self.period / self.rate
+
+    def try_acquire(self, amount=1) -> bool:
+        if self.get_lock().locked():
+            # others are waiting
+            return False
+        if self.get_wait_time(amount) > 0:
+            return False
+        self.tokens -= min(amount, self.capacity)
+        return True
+
+    async def acquire(self, amount=1) -> float:
+        """wait until amount tokens are available and take them, returns the time waited"""
+        start_time = time.monotonic()
+        async with self.get_lock():
+            wait_time = self.get_wait_time(amount)
+            while wait_time > 0:
+                await asyncio.sleep(wait_time)
+                wait_time = self.get_wait_time(amount)
+            self.tokens -= min(amount, self.capacity)
+        waited = time.monotonic() - start_time
+        if waited > 0.001:
+            self.delayed_count += 1
+            self.total_wait_time += waited
+        return waited
+
+    def adjust(self, amount):
+        """take (or give back, if negative) tokens once the actual cost is known. may go below zero"""
+        self.refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+    def get_stats(self):
+        self.refill()
+        return {
+            'available': self.tokens,
+            'capacity': self.capacity,
+            'delayed': self.delayed_count,
+            'total_wait_time': self.total_wait_time
+        }
+
+"""
+limits the number of requests in flight, and adapts the limit: additive increase after each
+successful request, multiplicative decrease when the server throttles us (AIMD).
+"""
+class AdaptiveConcurrencyLimiter():
+    def __init__(self, initial_limit=DEFAULT_INITIAL_CONCURRENCY, min_limit=DEFAULT_MIN_CONCURRENCY,
+                 max_limit=DEFAULT_MAX_CONCURRENCY, decrease_factor=0.5, decrease_interval=DEFAULT_DECREASE_INTERVAL):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.decrease_interval = decrease_interval
+        self.last_decrease_time = None
+        self.in_flight = 0
+        # futures of the requests waiting for a slot, in FIFO order
+        self.waiters = []
+        self.decrease_count = 0
+
+    def get_limit(self) -> int:
+        return max(self.min_limit, int(self.limit))
+
+    def wake_waiters(self):
+        available = self.get_limit() - self.in_flight
+        for waiter in self.waiters:
+            if available <= 0:
+                break
+            if not waiter.done():
+                waiter.set_result(None)
+                available -= 1
+
+    async def acquire(self):
+        while self.in_flight >= self.get_limit() or any([not waiter.done() for waiter in self.waiters]):
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # woken up, but not taking the slot: pass it on
+                    self.waiters.remove(waiter)
+                    self.wake_waiters()
+                raise
+            finally:
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+            if self.in_flight < self.get_limit():
+                break
+        self.in_flight += 1
+
+    def release(self, throttled=False):
+        """not a coroutine, so that it can be called when the request is cancelled"""
+        self.in_flight -= 1
+        if throttled:
+            self.on_throttled()
+        else:
+            # grows by about one per limit requests
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+        self.wake_waiters()
+
+    def on_throttled(self):
+        now = time.monotonic()
+        if self.last_decrease_time != None and now - self.last_decrease_time < self.decrease_interval:
+            return
+        previous_limit = self.get_limit()
+        self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+        self.last_decrease_time = now
+        self.decrease_count += 1
+        logger.warning(f'throttled, concurrency limit decreased from {previous_limit} to {self.get_limit()}')
+
+    def get_stats(self):
+        return {
+            'limit': self.get_limit(),
+            'in_flight': self.in_flight,
+            'decreased': self.decrease_count
+        }
+
+"""
+exponential backoff with full jitter. when the server says how long to wait (retry-after), wait at least that long:
+retrying earlier would be throttled again. max_retry_after: give up rather than wait longer than this, None to always wait.
+"""
+class RetryPolicy():
+    def __init__(self, max_retries=DEFAULT_MAX_RETRIES, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY, max_retry_after=None):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+
+    def should_retry(self, attempt, retry_after=None) -> bool:
+        """attempt: 0 for the first retry"""
+        if attempt >= self.max_retries:
+            return False
+        if retry_after != None and self.max_retry_after != None and retry_after > self.max_retry_after:
+            return False
+        return True
+
+    def get_delay(self, attempt, retry_after=None) -> float:
+        """attempt: 0 for the first retry"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if retry_after != None:
+            # not capped by max_delay. a little jitter on top, so that throttled requests don't all come back at the same time
+            delay = max(retry_after, delay) + delay * 0.1
+        return delay
+
+def get_retry_after(headers):
+    """seconds to wait according to the retry-after-ms or retry-after response header, or None"""
+    if headers == None:
+        return None
+    lowercase_headers = {str(key).lower(): value for key, value in headers.items()}
+    try:
+        if 'retry-after-ms' in lowercase_headers:
+            return float(lowercase_headers['retry-after-ms']) / 1000.0
+        if 'retry-after' in lowercase_headers:
+            return float(lowercase_headers['retry-after'])
+    except ValueError:
+        # retry-after can also be an http date, fall back to the backoff
+        pass
+    return None
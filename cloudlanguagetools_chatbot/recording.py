@@ -0,0 +1,256 @@
+import asyncio
+import collections
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import cloudlanguagetools.chatapi
+
+from .cache import FunctionCallCache
+from .audio_cache import AudioCache
+
+logger = logging.getLogger(__name__)
+
+# the traffic of the chat models is recorded to a JSONL file, one entry per line:
+# {"type": "input", "time": ..., "chat_id": ..., "text": ...} or "audio_key" for a voice note
+# {"type": "llm", "time": ..., "key": ..., "latency": ..., "response": {...}}
+#   or "chunks": [[delay, chunk], ...] for a streamed response, or "error": ...
+# {"type": "chatapi", "time": ..., "function": ..., "key": ..., "latency": ..., "result": ...}
+#   or "audio_size" and "audio_suffix" for text to speech, or "error" and "error_type"
+# requests are only stored as a hash: the model runs at temperature 0, replaying the same inputs
+# produces the same requests. the user inputs are recorded, only enable this where that's acceptable.
+
+def get_llm_request_key(kwargs) -> str:
+    request = {key: value for key, value in kwargs.items() if key != 'notify_queued_fn'}
+    return hashlib.sha256(json.dumps(request, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def get_audio_key(audio) -> str:
+    """voice notes are identified by the hash of their content. when replaying, the audio only carries the key"""
+    if audio.key != None:
+        return audio.key
+    return hashlib.sha256(audio.get_bytes()).hexdigest()
+
+class ReplayMissingError(Exception):
+    pass
+
+"""
+appends the traffic entries to a JSONL file. used from the event loop and from the tool executor threads
+"""
+class TrafficRecorder():
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, 'a', encoding='utf-8')
+        self.entry_count = 0
+        logger.info(f'recording traffic to {path}')
+
+    def write(self, entry):
+        entry['time'] = time.time()
+        line = json.dumps(entry, ensure_ascii=False)
+        with self.lock:
+            self.file.write(line + '\n')
+            self.file.flush()
+            self.entry_count += 1
+
+    def record_input(self, chat_id, text=None, audio_key=None):
+        entry = {'type': 'input', 'chat_id': chat_id}
+        if text != None:
+            entry['text'] = text
+        if audio_key != None:
+            entry['audio_key'] = audio_key
+        self.write(entry)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+"""
+wraps an LLMClient, recording the responses and their latencies
+"""
+class RecordingLLMClient():
+    def __init__(self, llm_client, recorder: TrafficRecorder):
+        self.llm_client = llm_client
+        self.recorder = recorder
+        self.functions = llm_client.functions
+        self.tools = llm_client.tools
+
+    async def chat_completion(self, **kwargs):
+        key = get_llm_request_key(kwargs)
+        start_time = time.monotonic()
+        try:
+            response = await self.llm_client.chat_completion(**kwargs)
+        except Exception as e:
+            self.recorder.write({'type': 'llm', 'key': key, 'latency': time.monotonic() - start_time, 'error': str(e)})
+            raise
+        latency = time.monotonic() - start_time
+        if kwargs.get('stream', False):
+            return self.record_stream(key, latency, response)
+        self.recorder.write({'type': 'llm', 'key': key, 'latency': latency, 'response': response})
+        return response
+
+    async def record_stream(self, key, latency, response_stream):
+        # the entry is written once the stream has been read entirely. the delays don't include the time
+        # the caller spends processing each chunk
+        chunks = []
+        last_chunk_time = time.monotonic()
+        async for chunk in response_stream:
+            chunks.append([time.monotonic() - last_chunk_time, chunk])
+            yield chunk
+            last_chunk_time = time.monotonic()
+        self.recorder.write({'type': 'llm', 'key': key, 'latency': latency, 'chunks': chunks})
+
+"""
+wraps a cloudlanguagetools ChatAPI, recording the results and their latencies
+"""
+class RecordingChatAPI():
+    def __init__(self, chatapi, recorder: TrafficRecorder):
+        self.chatapi = chatapi
+        self.recorder = recorder
+
+    def record_call(self, function_name, key, function, *args):
+        start_time = time.monotonic()
+        entry = {'type': 'chatapi', 'function': function_name, 'key': key}
+        try:
+            result = function(*args)
+        except Exception as e:
+            entry.update({'latency': time.monotonic() - start_time, 'error': str(e), 'error_type': type(e).__name__})
+            self.recorder.write(entry)
+            raise
+        entry['latency'] = time.monotonic() - start_time
+        if function_name == 'audio':
+            entry['audio_size'] = os.path.getsize(result.name)
+            entry['audio_suffix'] = os.path.splitext(result.name)[1]
+        else:
+            entry['result'] = result
+        self.recorder.write(entry)
+        return result
+
+    def translate_or_lookup(self, query):
+        return self.record_call('translate_or_lookup', FunctionCallCache.get_key('translate_or_lookup', query), self.chatapi.translate_or_lookup, query)
+
+    def transliterate(self, query):
+        return self.record_call('transliterate', FunctionCallCache.get_key('transliterate', query), self.chatapi.transliterate, query)
+
+    def breakdown(self, query):
+        return self.record_call('breakdown', FunctionCallCache.get_key('breakdown', query), self.chatapi.breakdown, query)
+
+    def audio(self, query, format):
+        return self.record_call('audio', AudioCache.get_key(query, format), self.chatapi.audio, query, format)
+
+    def recognize_audio(self, audio, audio_format):
+        return self.record_call('recognize_audio', get_audio_key(audio), self.chatapi.recognize_audio, audio, audio_format)
+
+"""
+the entries of one or more recordings (the webhook workers record to one file each), indexed for replay.
+identical requests are answered with the recorded responses in order, the last one is repeated
+"""
+class TrafficRecording():
+    def __init__(self, entries):
+        self.lock = threading.Lock()
+        self.inputs = []
+        self.responses = {}
+        self.hits = 0
+        self.misses = 0
+        for entry in sorted(entries, key=lambda entry: entry['time']):
+            if entry['type'] == 'input':
+                self.inputs.append(entry)
+            else:
+                self.responses.setdefault((entry['type'], entry['key']), collections.deque()).append(entry)
+        self.start_time = self.inputs[0]['time'] if len(self.inputs) > 0 else 0
+
+    @classmethod
+    def load(cls, paths) -> 'TrafficRecording':
+        entries = []
+        for path in paths:
+            with open(path, 'r', encoding='utf-8') as f:
+                entries.extend([json.loads(line) for line in f if len(line.strip()) > 0])
+        return cls(entries)
+
+    def get_entry(self, entry_type, key):
+        with self.lock:
+            entry_list = self.responses.get((entry_type, key), None)
+            if entry_list == None:
+                self.misses += 1
+                raise ReplayMissingError(f'no recorded {entry_type} response for {key}')
+            self.hits += 1
+            if len(entry_list) > 1:
+                return entry_list.popleft()
+            return entry_list[0]
+
+    def get_sessions(self):
+        """the inputs of each chat, in order. the time of each input is relative to the start of the recording"""
+        sessions = {}
+        for entry in self.inputs:
+            sessions.setdefault(entry['chat_id'], []).append(dict(entry, time=entry['time'] - self.start_time))
+        return sessions
+
+    def get_stats(self):
+        return {
+            'inputs': len(self.inputs),
+            'chats': len(set([entry['chat_id'] for entry in self.inputs])),
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+"""
+answers the chat completion requests with the recorded responses, with the recorded latencies multiplied by latency_scale
+"""
+class ReplayLLMClient():
+    def __init__(self, recording: TrafficRecording, functions, latency_scale=1.0):
+        self.recording = recording
+        self.latency_scale = latency_scale
+        self.functions = functions
+        self.tools = [{'type': 'function', 'function': function} for function in functions]
+
+    async def chat_completion(self, notify_queued_fn=None, **kwargs):
+        entry = self.recording.get_entry('llm', get_llm_request_key(kwargs))
+        await asyncio.sleep(entry['latency'] * self.latency_scale)
+        if 'error' in entry:
+            raise Exception(entry['error'])
+        if 'chunks' in entry:
+            return self.replay_stream(entry['chunks'])
+        return entry['response']
+
+    async def replay_stream(self, chunks):
+        for delay, chunk in chunks:
+            await asyncio.sleep(delay * self.latency_scale)
+            yield chunk
+
+"""
+stands in for cloudlanguagetools.chatapi.ChatAPI, with the recorded results. blocks like the real one
+"""
+class ReplayChatAPI():
+    def __init__(self, recording: TrafficRecording, latency_scale=1.0):
+        self.recording = recording
+        self.latency_scale = latency_scale
+
+    def replay_call(self, key):
+        entry = self.recording.get_entry('chatapi', key)
+        time.sleep(entry['latency'] * self.latency_scale)
+        if 'error' in entry:
+            if entry['error_type'] == 'NoDataFoundException':
+                raise cloudlanguagetools.chatapi.NoDataFoundException(entry['error'])
+            raise Exception(entry['error'])
+        return entry
+
+    def translate_or_lookup(self, query):
+        return self.replay_call(FunctionCallCache.get_key('translate_or_lookup', query))['result']
+
+    def transliterate(self, query):
+        return self.replay_call(FunctionCallCache.get_key('transliterate', query))['result']
+
+    def breakdown(self, query):
+        return self.replay_call(FunctionCallCache.get_key('breakdown', query))['result']
+
+    def audio(self, query, format):
+        entry = self.replay_call(AudioCache.get_key(query, format))
+        audio_tempfile = tempfile.NamedTemporaryFile(prefix='clt_chatbot_replay_', suffix=entry['audio_suffix'])
+        audio_tempfile.write(bytes(entry['audio_size']))
+        audio_tempfile.flush()
+        return audio_tempfile
+
+    def recognize_audio(self, audio, audio_format):
+        return self.replay_call(get_audio_key(audio))['result']
@@ -0,0 +1,122 @@
+import asyncio
+import contextlib
+import json
+import logging
+import sqlite3
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_IDLE_TIMEOUT = 30 * 60
+DEFAULT_EVICTION_INTERVAL = 60
+
+class Session():
+    def __init__(self, chat_model):
+        self.chat_model = chat_model
+        self.last_used = time.monotonic()
+        self.in_use = 0
+
+"""
+keeps the ChatModel of active chats in memory. chats which have been idle for longer than the timeout
+are evicted: their state (instruction, last input sentence, trimmed history) is stored in sqlite as
+compressed json, and the ChatModel is recreated from it on the next message. the row is deleted then, the
+chat is in memory again: a stale copy can't be restored later, by this process or another one sharing the database.
+"""
+class SessionStore():
+    def __init__(self, create_chat_model_fn, sqlite_path=':memory:', idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        # create_chat_model_fn(chat_id) returns a new ChatModel, with its callbacks set
+        self.create_chat_model_fn = create_chat_model_fn
+        self.idle_timeout = idle_timeout
+        self.sessions = {}
+        self.db = sqlite3.connect(sqlite_path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS chat_sessions (chat_id TEXT PRIMARY KEY, updated REAL, state BLOB)')
+        self.db.commit()
+        self.evicted_count = 0
+        self.restored_count = 0
+        self.eviction_task = None
+
+    def get_chat_model(self, chat_id):
+        """returns the ChatModel for this chat, and whether the chat is new (it wasn't in memory or in the database)"""
+        chat_id = str(chat_id)
+        session = self.sessions.get(chat_id, None)
+        if session != None:
+            session.last_used = time.monotonic()
+            return session.chat_model, False
+        chat_model = self.create_chat_model_fn(chat_id)
+        state = self.pop_state(chat_id)
+        is_new = state == None
+        if not is_new:
+            chat_model.load_state(state)
+            self.restored_count += 1
+            logger.info(f'restored session for chat {chat_id}')
+        self.sessions[chat_id] = Session(chat_model)
+        return chat_model, is_new
+
+    @contextlib.contextmanager
+    def use_session(self, chat_id):
+        """the session can't be evicted while it's in use"""
+        chat_model, is_new = self.get_chat_model(chat_id)
+        session = self.sessions[str(chat_id)]
+        session.in_use += 1
+        try:
+            yield chat_model, is_new
+        finally:
+            session.in_use -= 1
+            session.last_used = time.monotonic()
+
+    def pop_state(self, chat_id):
+        """the stored state of the chat, removed from the database"""
+        with self.db:
+            row = self.db.execute('SELECT state FROM chat_sessions WHERE chat_id=?', (chat_id,)).fetchone()
+            if row == None:
+                return None
+            self.db.execute('DELETE FROM chat_sessions WHERE chat_id=?', (chat_id,))
+        return json.loads(zlib.decompress(row[0]).decode('utf-8'))
+
+    def save_state(self, chat_id, chat_model):
+        state_data = zlib.compress(json.dumps(chat_model.get_state(), ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+        self.db.execute('INSERT OR REPLACE INTO chat_sessions (chat_id, updated, state) VALUES (?, ?, ?)',
+                        (chat_id, time.time(), state_data))
+        self.db.commit()
+
+    def evict_idle_sessions(self):
+        now = time.monotonic()
+        idle_chat_ids = [chat_id for chat_id, session in self.sessions.items()
+                         if session.in_use == 0 and now - session.last_used > self.idle_timeout]
+        for chat_id in idle_chat_ids:
+            self.save_state(chat_id, self.sessions[chat_id].chat_model)
+            del self.sessions[chat_id]
+            self.evicted_count += 1
+        if len(idle_chat_ids) > 0:
+            logger.info(f'evicted {len(idle_chat_ids)} idle sessions, {len(self.sessions)} active sessions')
+
+    def save_all(self):
+        """store all sessions, for example before shutting down"""
+        for chat_id, session in self.sessions.items():
+            self.save_state(chat_id, session.chat_model)
+
+    def start_eviction_loop(self, interval=DEFAULT_EVICTION_INTERVAL):
+        """runs until close() is called"""
+        self.eviction_task = asyncio.ensure_future(self.run_eviction_loop(interval))
+
+    async def run_eviction_loop(self, interval=DEFAULT_EVICTION_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.evict_idle_sessions()
+            except Exception:
+                logger.exception('error while evicting idle sessions')
+
+    def get_stats(self):
+        return {
+            'active_sessions': len(self.sessions),
+            'evicted': self.evicted_count,
+            'restored': self.restored_count
+        }
+
+    def close(self):
+        if self.eviction_task != None:
+            self.eviction_task.cancel()
+            self.eviction_task = None
+        self.db.close()
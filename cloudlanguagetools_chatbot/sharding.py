@@ -0,0 +1,27 @@
+import zlib
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# update fields which contain a message, see https://core.telegram.org/bots/api#update
+MESSAGE_FIELDS = ['message', 'edited_message', 'channel_post', 'edited_channel_post', 'business_message', 'edited_business_message']
+
+def get_update_chat_id(update_data) -> Optional[int]:
+    """chat id of a raw (json) telegram update, or None if the update isn't related to a chat"""
+    for field in MESSAGE_FIELDS:
+        if field in update_data:
+            return update_data[field]['chat']['id']
+    if 'callback_query' in update_data and 'message' in update_data['callback_query']:
+        return update_data['callback_query']['message']['chat']['id']
+    for field in ['my_chat_member', 'chat_member', 'chat_join_request']:
+        if field in update_data:
+            return update_data[field]['chat']['id']
+    return None
+
+def get_shard_index(chat_id, worker_count) -> int:
+    """the worker which handles this chat. a stable hash, so that a chat always goes to the same worker,
+    across restarts, as long as the worker count doesn't change"""
+    if chat_id == None:
+        return 0
+    return zlib.crc32(str(chat_id).encode('utf-8')) % worker_count
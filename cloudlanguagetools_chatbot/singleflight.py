@@ -0,0 +1,73 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Flight():
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 1
+
+"""
+single-flight: concurrent calls with the same key share one execution. when many chats request
+the same translation or audio at the same moment, only the first call goes to the cloud service,
+the other ones wait for its result (or its exception).
+"""
+class SingleFlight():
+    def __init__(self):
+        # key -> Flight, only while the call is running
+        self.flights = {}
+        self.calls = 0
+        self.executed = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.max_waiters = 0
+
+    async def do(self, key, coroutine_fn):
+        """run coroutine_fn(), unless a call with the same key is already running, then share its result"""
+        self.calls += 1
+        flight = self.flights.get(key, None)
+        if flight != None:
+            flight.waiters += 1
+            self.coalesced += 1
+            self.max_waiters = max(self.max_waiters, flight.waiters)
+            logger.debug(f'coalesced call for key {key}, {flight.waiters} waiters')
+        else:
+            flight = Flight(asyncio.ensure_future(self.run(key, coroutine_fn)))
+            self.flights[key] = flight
+            self.executed += 1
+        try:
+            # one waiter being cancelled must not cancel the call for the others
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # nobody is interested in the result anymore
+                flight.task.cancel()
+                if self.flights.get(key, None) is flight:
+                    del self.flights[key]
+
+    async def run(self, key, coroutine_fn):
+        try:
+            return await coroutine_fn()
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            # calls made from now on start a new execution
+            if self.flights.get(key, None) != None and self.flights[key].task is asyncio.current_task():
+                del self.flights[key]
+
+    def get_stats(self):
+        return {
+            'calls': self.calls,
+            'executed': self.executed,
+            'coalesced': self.coalesced,
+            'errors': self.errors,
+            'in_flight': len(self.flights),
+            'max_waiters': self.max_waiters,
+            'coalesced_rate': self.coalesced / self.calls if self.calls > 0 else 0.0
+        }
+
+# shared by all the chat models of the process
+shared_single_flight = SingleFlight()
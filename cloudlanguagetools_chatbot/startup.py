@@ -0,0 +1,141 @@
+import contextlib
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# option lists the ChatAPI functions look up on their first call. ServiceManager caches them,
+# they're built by asking every service, some of them over the network
+WARM_UP_METHODS = [
+    'get_translation_language_list',
+    'get_transliteration_language_list',
+    'get_tokenization_options',
+    'get_dictionary_lookup_options',
+    'get_tts_voice_list',
+]
+DEFAULT_IMPORT_PROFILE_TOP = 25
+
+"""
+stands in for cloudlanguagetools.servicemanager.ServiceManager: the services are created and configured on
+first use, from whichever thread needs them first, rather than when the bot starts. warm_up() does it ahead
+of time, on a background thread, along with the option lists.
+"""
+class LazyServiceManager():
+    def __init__(self, configure_fn=None):
+        # configure_fn(manager), configure_default() by default
+        self.configure_fn = configure_fn
+        self.manager = None
+        self.lock = threading.Lock()
+        self.init_duration = None
+        self.warm_up_duration = None
+        self.warm_up_thread = None
+
+    def get_manager(self):
+        if self.manager != None:
+            return self.manager
+        with self.lock:
+            if self.manager == None:
+                start_time = time.monotonic()
+                import cloudlanguagetools.servicemanager
+                manager = cloudlanguagetools.servicemanager.ServiceManager()
+                if self.configure_fn != None:
+                    self.configure_fn(manager)
+                else:
+                    manager.configure_default()
+                self.init_duration = time.monotonic() - start_time
+                metrics.startup_duration.observe(self.init_duration, phase='services_init')
+                logger.info(f'language services initialized in {self.init_duration:.2f}s')
+                self.manager = manager
+        return self.manager
+
+    @property
+    def initialized(self) -> bool:
+        return self.manager != None
+
+    def __getattr__(self, name):
+        # only called for the attributes of the ServiceManager: services, get_translation, ...
+        if name in ['configure_fn', 'manager', 'lock']:
+            raise AttributeError(name)
+        return getattr(self.get_manager(), name)
+
+    def warm_up(self):
+        start_time = time.monotonic()
+        try:
+            manager = self.get_manager()
+            for method_name in WARM_UP_METHODS:
+                method = getattr(manager, method_name, None)
+                if method != None:
+                    method()
+        except Exception:
+            # the functions will try again when they're called
+            logger.exception('error while warming up the language services')
+        self.warm_up_duration = time.monotonic() - start_time
+        metrics.startup_duration.observe(self.warm_up_duration, phase='warm_up')
+        logger.info(f'language services warmed up in {self.warm_up_duration:.2f}s')
+
+    def start_warm_up(self):
+        """returns right away, the chats which need the services in the meantime wait for the initialization"""
+        self.warm_up_thread = threading.Thread(target=self.warm_up, name='clt_warm_up', daemon=True)
+        self.warm_up_thread.start()
+
+"""
+times the phases of the startup, reported with --profile-startup and exported as metrics
+"""
+class StartupProfiler():
+    def __init__(self, start_time=None):
+        self.start_time = start_time if start_time != None else time.monotonic()
+        self.phases = []
+
+    def record(self, phase, duration):
+        self.phases.append({'phase': phase, 'duration': duration})
+        metrics.startup_duration.observe(duration, phase=phase)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start_time = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(name, time.monotonic() - start_time)
+
+    def get_elapsed(self) -> float:
+        return time.monotonic() - self.start_time
+
+    def get_report(self):
+        return {
+            'total': self.get_elapsed(),
+            'phases': self.phases
+        }
+
+def parse_import_times(importtime_output, top=DEFAULT_IMPORT_PROFILE_TOP):
+    """parses the output of python -X importtime: the modules with the longest cumulative import time,
+    and the total time of each top level package"""
+    modules = []
+    packages = {}
+    for line in importtime_output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        module_name = name.strip()
+        modules.append({'module': module_name, 'self': int(self_us) / 1e6, 'cumulative': int(cumulative_us) / 1e6})
+        package = module_name.split('.')[0]
+        packages[package] = packages.get(package, 0) + int(self_us) / 1e6
+    modules.sort(key=lambda module: module['cumulative'], reverse=True)
+    return {
+        'modules': modules[:top],
+        'packages': dict(sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top])
+    }
+
+def profile_imports(module_name, top=DEFAULT_IMPORT_PROFILE_TOP, cwd=None):
+    """imports the module in a new interpreter, with -X importtime, so that nothing is imported already"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module_name}'],
+                            cwd=cwd, env=dict(os.environ), capture_output=True, text=True)
+    if result.returncode != 0:
+        logger.error(f'could not import {module_name}: {result.stderr[-2000:]}')
+    return parse_import_times(result.stderr, top=top)
@@ -0,0 +1,145 @@
+import collections
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Optional
+from cloudlanguagetools_chatbot import prompts
+from cloudlanguagetools_chatbot import plan
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 5000
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+DEFAULT_TTL_SECONDS = 24 * 3600
+
+def get_prompts_hash() -> str:
+    """hash of the prompts and function descriptions, cached turns are invalidated when they change"""
+    texts = []
+    for module in [prompts, plan]:
+        for name, value in sorted(vars(module).items()):
+            if name.isupper() and isinstance(value, str):
+                texts.append(f'{module.__name__}.{name}={value}')
+    return hashlib.sha256('\n'.join(texts).encode('utf-8')).hexdigest()
+
+"""
+caches whole turns: the outputs sent to the user for a new sentence, in order, and the resulting message history.
+at temperature 0, with the same instruction, the same sentence produces the same turn. audio is stored as the
+text to speech query, it comes from the audio cache when the turn is replayed.
+entries are kept in memory in LRU order, within a number of entries and a size budget, with a time to live.
+optionally, entries are also stored in an sqlite database, so that they survive restarts.
+"""
+class TurnCache():
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES, ttl_seconds=DEFAULT_TTL_SECONDS,
+                 sqlite_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.prompts_hash = get_prompts_hash()
+        # key -> (expiration time, turn json)
+        self.entries = collections.OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.db = None
+        if sqlite_path != None:
+            self.db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self.db.execute('CREATE TABLE IF NOT EXISTS turn_cache (key TEXT PRIMARY KEY, prompts_hash TEXT, expiration REAL, turn TEXT)')
+            # turns recorded with other prompts are obsolete
+            deleted_count = self.db.execute('DELETE FROM turn_cache WHERE prompts_hash != ?', (self.prompts_hash,)).rowcount
+            if deleted_count > 0:
+                logger.info(f'prompts have changed, deleted {deleted_count} cached turns')
+            self.db.commit()
+
+    def get_key(self, instruction, input_sentence, deployment_name, audio_format) -> str:
+        key_data = {
+            'prompts': self.prompts_hash,
+            'instruction': instruction,
+            'input': input_sentence,
+            'deployment': deployment_name,
+            'audio_format': audio_format.name
+        }
+        return hashlib.sha256(json.dumps(key_data, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def get(self, key) -> Optional[dict]:
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry != None:
+                expiration, turn_json = entry
+                if expiration > now:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return json.loads(turn_json)
+                self._remove_memory(key)
+            if self.db != None:
+                row = self.db.execute('SELECT expiration, turn FROM turn_cache WHERE key=?', (key,)).fetchone()
+                if row != None:
+                    expiration, turn_json = row
+                    if expiration > now:
+                        self._store_memory(key, expiration, turn_json)
+                        self.hits += 1
+                        return json.loads(turn_json)
+                    self.db.execute('DELETE FROM turn_cache WHERE key=?', (key,))
+                    self.db.commit()
+            self.misses += 1
+            return None
+
+    def put(self, key, turn: dict):
+        """turn: {'outputs': [...], 'message_history': [...]}"""
+        expiration = time.time() + self.ttl_seconds
+        turn_json = json.dumps(turn, ensure_ascii=False)
+        with self.lock:
+            self._store_memory(key, expiration, turn_json)
+            if self.db != None:
+                self.db.execute('INSERT OR REPLACE INTO turn_cache (key, prompts_hash, expiration, turn) VALUES (?, ?, ?, ?)',
+                                (key, self.prompts_hash, expiration, turn_json))
+                self.db.commit()
+
+    def invalidate(self, key):
+        """a cached turn which couldn't be replayed"""
+        with self.lock:
+            self._remove_memory(key)
+            if self.db != None:
+                self.db.execute('DELETE FROM turn_cache WHERE key=?', (key,))
+                self.db.commit()
+
+    def _store_memory(self, key, expiration, turn_json):
+        self._remove_memory(key)
+        self.entries[key] = (expiration, turn_json)
+        self.total_bytes += len(turn_json)
+        while len(self.entries) > 1 and (len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes):
+            evicted_key, (evicted_expiration, evicted_turn_json) = self.entries.popitem(last=False)
+            self.total_bytes -= len(evicted_turn_json)
+            self.evictions += 1
+
+    def _remove_memory(self, key):
+        entry = self.entries.pop(key, None)
+        if entry != None:
+            self.total_bytes -= len(entry[1])
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+            if self.db != None:
+                self.db.execute('DELETE FROM turn_cache')
+                self.db.commit()
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.total_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+    def close(self):
+        if self.db != None:
+            self.db.close()
@@ -0,0 +1,180 @@
+import argparse
+import asyncio
+import collections
+import logging
+import random
+import time
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+
+logger = logging.getLogger(__name__)
+
+import aiohttp
+import aiohttp.web
+
+# local testing of the telegram bot without telegram:
+# - server: a fake bot API, which accepts the calls made by the bot and counts them. start the bot with
+#   TELEGRAM_BASE_URL=http://localhost:8081/bot
+# - generate: sends fake updates from many chats to the webhook, see telegram_webhook.py
+#
+# python fake_telegram.py server --port 8081
+# python fake_telegram.py generate --webhook-url http://localhost:8080/telegram --chats 50 --messages 5
+
+DEFAULT_SERVER_PORT = 8081
+DEFAULT_INPUT_SENTENCES = [
+    '我想吃中餐',
+    'Je ne suis pas intéressé.',
+    'Please translate this sentence into French.',
+    '¿Dónde está la biblioteca?',
+    'ありがとうございます'
+]
+# with --flood-control, messages over these limits are rejected with 429 and a retry_after,
+# roughly like telegram does: https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this
+FLOOD_CONTROL_MESSAGES_PER_SECOND = 30
+FLOOD_CONTROL_CHAT_MESSAGES_PER_SECOND = 3
+FLOOD_CONTROL_RETRY_AFTER = 1
+FLOOD_CONTROL_METHODS = ['sendMessage', 'editMessageText', 'sendVoice']
+# getUpdates returns no updates after this long, rather than the timeout requested by the bot
+GET_UPDATES_TIMEOUT = 0.5
+
+class FakeBotAPI():
+    def __init__(self, flood_control=False):
+        self.flood_control = flood_control
+        # send times over the last second, for the bot and for each chat
+        self.send_times = collections.deque()
+        self.chat_send_times = collections.defaultdict(collections.deque)
+        self.flood_count = 0
+        self.message_id = 0
+        self.upload_count = 0
+        self.call_counts = {}
+        self.start_time = time.monotonic()
+
+    def build_message(self, chat_id, text=None):
+        self.message_id += 1
+        message = {
+            'message_id': self.message_id,
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id), 'type': 'private'},
+            'from': self.get_me()
+        }
+        if text != None:
+            message['text'] = text
+        return message
+
+    def is_flooding(self, chat_id) -> bool:
+        now = time.monotonic()
+        chat_send_times = self.chat_send_times[chat_id]
+        for send_times in [self.send_times, chat_send_times]:
+            while len(send_times) > 0 and now - send_times[0] > 1.0:
+                send_times.popleft()
+        if len(self.send_times) >= FLOOD_CONTROL_MESSAGES_PER_SECOND or len(chat_send_times) >= FLOOD_CONTROL_CHAT_MESSAGES_PER_SECOND:
+            self.flood_count += 1
+            return True
+        self.send_times.append(now)
+        chat_send_times.append(now)
+        return False
+
+    def get_me(self):
+        return {'id': 1, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot'}
+
+    async def handle_method(self, request):
+        method = request.match_info['method']
+        self.call_counts[method] = self.call_counts.get(method, 0) + 1
+        # parameters are sent as form fields, or as multipart when uploading a file
+        parameters = await request.post()
+        if self.flood_control and method in FLOOD_CONTROL_METHODS and self.is_flooding(parameters['chat_id']):
+            return aiohttp.web.json_response({'ok': False, 'error_code': 429,
+                'description': f'Too Many Requests: retry after {FLOOD_CONTROL_RETRY_AFTER}',
+                'parameters': {'retry_after': FLOOD_CONTROL_RETRY_AFTER}}, status=429)
+        if method == 'getMe':
+            result = self.get_me()
+        elif method == 'getUpdates':
+            # polling mode, the updates go to the webhook. long polling, shortened
+            await asyncio.sleep(min(float(parameters.get('timeout', 0)), GET_UPDATES_TIMEOUT))
+            result = []
+        elif method in ['sendMessage', 'editMessageText']:
+            result = self.build_message(parameters['chat_id'], text=parameters['text'])
+        elif method == 'sendVoice':
+            result = self.build_message(parameters['chat_id'])
+            voice = parameters['voice']
+            if isinstance(voice, str):
+                # sent again with a file_id
+                file_id = voice
+            else:
+                self.upload_count += 1
+                file_id = f'fake_voice_{self.upload_count}'
+            result['voice'] = {'file_id': file_id, 'file_unique_id': file_id, 'duration': 1}
+        else:
+            # sendChatAction, setWebhook, deleteWebhook ...
+            result = True
+        return aiohttp.web.json_response({'ok': True, 'result': result})
+
+    async def handle_stats(self, request):
+        return aiohttp.web.json_response({
+            'uptime': time.monotonic() - self.start_time,
+            'calls': self.call_counts,
+            'voice_uploads': self.upload_count,
+            'flood_control_rejections': self.flood_count
+        })
+
+    def build_web_application(self):
+        web_application = aiohttp.web.Application()
+        web_application.router.add_post('/bot{token}/{method}', self.handle_method)
+        web_application.router.add_get('/stats', self.handle_stats)
+        return web_application
+
+def build_update(update_id, chat_id, text):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private', 'first_name': f'user {chat_id}'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': f'user {chat_id}'},
+            'text': text
+        }
+    }
+
+async def generate_updates(webhook_url, chat_count, message_count, interval, secret_token=None):
+    """every chat sends its messages one after the other, all chats at the same time"""
+    headers = {}
+    if secret_token != None:
+        headers['X-Telegram-Bot-Api-Secret-Token'] = secret_token
+    update_ids = iter(range(1, chat_count * message_count + 1))
+    async with aiohttp.ClientSession(headers=headers) as session:
+        async def run_chat(chat_id):
+            for i in range(message_count):
+                text = random.choice(DEFAULT_INPUT_SENTENCES)
+                async with session.post(webhook_url, json=build_update(next(update_ids), chat_id, text)) as response:
+                    if response.status != 200:
+                        logger.error(f'chat {chat_id}: webhook returned {response.status}')
+                await asyncio.sleep(interval)
+        start_time = time.monotonic()
+        await asyncio.gather(*[run_chat(100000 + i) for i in range(chat_count)])
+        logger.info(f'sent {chat_count * message_count} updates from {chat_count} chats in {time.monotonic() - start_time:.2f}s')
+
+def main():
+    parser = argparse.ArgumentParser(description='fake telegram bot API and update generator')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    server_parser = subparsers.add_parser('server')
+    server_parser.add_argument('--port', type=int, default=DEFAULT_SERVER_PORT)
+    server_parser.add_argument('--flood-control', action='store_true', help='reject the messages over the telegram rate limits')
+    generate_parser = subparsers.add_parser('generate')
+    generate_parser.add_argument('--webhook-url', required=True)
+    generate_parser.add_argument('--chats', type=int, default=10)
+    generate_parser.add_argument('--messages', type=int, default=3)
+    # seconds between two messages of a chat
+    generate_parser.add_argument('--interval', type=float, default=1.0)
+    generate_parser.add_argument('--secret-token', default=None)
+    args = parser.parse_args()
+
+    if args.command == 'server':
+        aiohttp.web.run_app(FakeBotAPI(flood_control=args.flood_control).build_web_application(), port=args.port)
+    else:
+        asyncio.run(generate_updates(args.webhook_url, args.chats, args.messages, args.interval, secret_token=args.secret_token))
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,8 @@
 import sys
 import os
 import logging
-import tempfile
 import pydub
 import pasimple
-import wave
 import readline
 import pprint
 import asyncio
@@ -12,6 +10,7 @@ logger = logging.getLogger(__name__)
 
 import cloudlanguagetools.servicemanager
 import cloudlanguagetools_chatbot.chatmodel
+import cloudlanguagetools_chatbot.audiodata
 
 
 class InteractiveChatbot():
@@ -27,18 +26,15 @@ class InteractiveChatbot():
     async def received_error(self, error: str):
         logger.error(error)
 
-    async def received_audio(self, audio_tempfile: tempfile.NamedTemporaryFile):
+    async def received_audio(self, audio: cloudlanguagetools_chatbot.audiodata.AudioData):
         logger.info(f'playing audio')
-        sound = pydub.AudioSegment.from_mp3(audio_tempfile.name)
-        wav_tempfile = tempfile.NamedTemporaryFile(prefix='clt_interactivechatbot', suffix='.wav')
-        sound.export(wav_tempfile.name, format="wav")
-        
-        # Read a .wav file with its attributes
-        with wave.open(wav_tempfile.name, 'rb') as wave_file:
-            format = pasimple.width2format(wave_file.getsampwidth())
-            channels = wave_file.getnchannels()
-            sample_rate = wave_file.getframerate()
-            audio_data = wave_file.readframes(wave_file.getnframes())
+        # decode the mp3 in memory, the raw samples are played directly
+        with audio.open() as audio_file:
+            sound = pydub.AudioSegment.from_file(audio_file, format='mp3')
+        format = pasimple.width2format(sound.sample_width)
+        channels = sound.channels
+        sample_rate = sound.frame_rate
+        audio_data = sound.raw_data
 
         # Play the file via PulseAudio
         with pasimple.PaSimple(pasimple.PA_STREAM_PLAYBACK, format, channels, sample_rate) as pa:
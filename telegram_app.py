@@ -1,3 +1,5 @@
+import argparse
+import json
 import logging
 import os
 import pprint
@@ -10,12 +12,52 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
-import cloudlanguagetools.servicemanager
+# cold start: the time spent importing, initializing and connecting is exported as metrics,
+# python telegram_app.py --profile-startup reports it in detail
+import cloudlanguagetools_chatbot.startup
+startup_profiler = cloudlanguagetools_chatbot.startup.StartupProfiler()
+
 import cloudlanguagetools_chatbot.chatmodel
+import cloudlanguagetools_chatbot.cache
+import cloudlanguagetools_chatbot.audio_cache
+import cloudlanguagetools_chatbot.session
+import cloudlanguagetools_chatbot.dispatcher
+import cloudlanguagetools_chatbot.audiodata
+import cloudlanguagetools_chatbot.file_ids
+import cloudlanguagetools_chatbot.metrics
+import cloudlanguagetools_chatbot.recording
+import cloudlanguagetools_chatbot.turn_cache
+import cloudlanguagetools_chatbot.outbound
+import cloudlanguagetools_chatbot.audio_preprocess
 import cloudlanguagetools.options
 
-clt_manager = cloudlanguagetools.servicemanager.ServiceManager()
-clt_manager.configure_default()
+startup_profiler.record('imports', startup_profiler.get_elapsed())
+
+# the language services are configured on first use, or by the warm up which starts with the bot
+clt_manager = cloudlanguagetools_chatbot.startup.LazyServiceManager()
+WARM_UP = os.environ.get('CLT_CHATBOT_WARM_UP', '1') == '1'
+
+# translation/transliteration/breakdown results are shared between all users, and optionally persisted
+result_cache = cloudlanguagetools_chatbot.cache.FunctionCallCache(sqlite_path=os.environ.get('CLT_CHATBOT_CACHE_DB', None))
+# text to speech audio is shared between all users. the webhook workers share the directory and its size budget
+audio_cache = cloudlanguagetools_chatbot.audio_cache.AudioCache(
+    os.environ.get('CLT_CHATBOT_AUDIO_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'clt_chatbot_audio_cache')))
+# outputs of whole turns for new sentences, shared between all users with the same instruction
+turn_cache = None
+if os.environ.get('CLT_CHATBOT_TURN_CACHE', '1') == '1':
+    turn_cache = cloudlanguagetools_chatbot.turn_cache.TurnCache(sqlite_path=os.environ.get('CLT_CHATBOT_TURN_CACHE_DB', None))
+
+# voice notes are trimmed, downmixed and resampled before speech recognition, if ffmpeg is installed
+audio_preprocessor = None
+if os.environ.get('CLT_CHATBOT_AUDIO_PREPROCESS', '1') == '1':
+    if cloudlanguagetools_chatbot.audio_preprocess.is_available():
+        audio_preprocessor = cloudlanguagetools_chatbot.audio_preprocess.AudioPreprocessor(
+            max_duration_seconds=int(os.environ.get('CLT_CHATBOT_MAX_VOICE_DURATION', cloudlanguagetools_chatbot.audio_preprocess.DEFAULT_MAX_DURATION_SECONDS)))
+    else:
+        logger.warning('ffmpeg not found, voice notes are not preprocessed')
+
+# file_id of the voice notes already uploaded to telegram, they're sent again without uploading
+voice_file_ids = cloudlanguagetools_chatbot.file_ids.FileIdStore(os.environ.get('CLT_CHATBOT_FILE_ID_DB', 'telegram_file_ids.db'))
 
 # docs
 # https://github.com/python-telegram-bot/python-telegram-bot
@@ -29,83 +71,269 @@ import telegram
 from telegram import Update
 from telegram.ext import filters, MessageHandler, ApplicationBuilder, CommandHandler, ContextTypes
 import telegram.constants
+import telegram.error
 import telegram.helpers
 
 
 TOKEN = os.environ['TELEGRAM_BOT_TOKEN']
+# for example http://localhost:8081/bot when testing with fake_telegram.py
+TELEGRAM_BASE_URL = os.environ.get('TELEGRAM_BASE_URL', None)
+# request the main completion while the LLM categorizes the input
+SPECULATIVE_EXECUTION = os.environ.get('CLT_CHATBOT_SPECULATIVE_EXECUTION', '0') == '1'
+# show the answer progressively, while it's being generated
+STREAMING = os.environ.get('CLT_CHATBOT_STREAMING', '1') == '1'
+# run the function calls compiled from the instruction on new sentences, instead of the LLM loop. off by default:
+# a compiled plan can miss nuances of the instruction which the LLM would follow
+TOOL_PLANS = os.environ.get('CLT_CHATBOT_TOOL_PLANS', '0') == '1'
+MESSAGE_EDIT_INTERVAL = cloudlanguagetools_chatbot.outbound.DEFAULT_EDIT_INTERVAL
+# chats idle for longer than this are stored in the session database and removed from memory
+SESSION_DB = os.environ.get('CLT_CHATBOT_SESSION_DB', 'chat_sessions.db')
+SESSION_IDLE_TIMEOUT = int(os.environ.get('CLT_CHATBOT_SESSION_IDLE_TIMEOUT', 30 * 60))
+session_store = None
+# updates from different chats are processed concurrently, the updates of one chat are processed in order
+MAX_CONCURRENT_CHATS = int(os.environ.get('CLT_CHATBOT_MAX_CONCURRENT_CHATS', 32))
+chat_dispatcher = cloudlanguagetools_chatbot.dispatcher.ChatDispatcher(max_concurrent_chats=MAX_CONCURRENT_CHATS)
+# messages are sent in the background, in order for each chat, within the telegram flood limits:
+# about 30 messages per second for the bot, 1 per second in a chat. texts of a turn sent within the
+# coalesce window are merged into one message
+TELEGRAM_MESSAGES_PER_SECOND = float(os.environ.get('CLT_CHATBOT_TELEGRAM_MESSAGES_PER_SECOND', cloudlanguagetools_chatbot.outbound.DEFAULT_MESSAGES_PER_SECOND))
+MESSAGE_COALESCE_WINDOW = float(os.environ.get('CLT_CHATBOT_MESSAGE_COALESCE_WINDOW', cloudlanguagetools_chatbot.outbound.DEFAULT_COALESCE_WINDOW))
+outbound_dispatcher = cloudlanguagetools_chatbot.outbound.OutboundDispatcher(
+    messages_per_second=TELEGRAM_MESSAGES_PER_SECOND, coalesce_window=MESSAGE_COALESCE_WINDOW)
+# voice notes and generated audio are handled in memory, larger ones go through a temporary file
+MAX_IN_MEMORY_AUDIO_BYTES = int(os.environ.get('CLT_CHATBOT_MAX_IN_MEMORY_AUDIO_BYTES', cloudlanguagetools_chatbot.audiodata.DEFAULT_MAX_IN_MEMORY_BYTES))
+# prometheus metrics are served on http://localhost:{METRICS_PORT}/metrics, 0 to disable
+METRICS_PORT = int(os.environ.get('CLT_CHATBOT_METRICS_PORT', 9090))
+metrics_runner = None
+# export the spans with opentelemetry (OTLP), configured with the OTEL_EXPORTER_OTLP_* environment variables
+if os.environ.get('CLT_CHATBOT_OTEL', '0') == '1':
+    cloudlanguagetools_chatbot.metrics.configure_opentelemetry()
+# record the inputs, and the responses of the model and the language services, to a JSONL file which
+# can be replayed offline with benchmarks/benchmark_chatmodel.py --replay
+TRAFFIC_RECORDING_PATH = os.environ.get('CLT_CHATBOT_RECORD_TRAFFIC', None)
+traffic_recorder = None
+if TRAFFIC_RECORDING_PATH != None:
+    traffic_recorder = cloudlanguagetools_chatbot.recording.TrafficRecorder(TRAFFIC_RECORDING_PATH)
+
+def serialized_per_chat(handler):
+    async def handle_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        await chat_dispatcher.run(update.effective_chat.id, lambda: handler(update, context))
+    return handle_update
 
 def received_message_lambda(bot, chat_id):
+    async def send_text(text):
+        return await bot.send_message(chat_id=chat_id, text=text)
     async def send_message(message): 
-        await bot.send_message(chat_id=chat_id, text=message)
+        outbound_dispatcher.enqueue(chat_id, cloudlanguagetools_chatbot.outbound.OutboundMessage(send_text, text=message, kind='message'))
     return send_message
 
+def received_message_update_lambda(bot, chat_id):
+    async def send_text(text):
+        return await bot.send_message(chat_id=chat_id, text=text)
+    async def edit_text(message, text):
+        return await bot.edit_message_text(chat_id=chat_id, message_id=message.message_id, text=text)
+    message_updater = cloudlanguagetools_chatbot.outbound.MessageUpdater(outbound_dispatcher, chat_id, send_text, edit_text,
+        edit_interval=MESSAGE_EDIT_INTERVAL)
+    return message_updater.update
+
 def received_audio_lambda(bot, chat_id):
-    async def send_audio(audio_tempfile: tempfile.NamedTemporaryFile):
+    async def upload_voice(audio: cloudlanguagetools_chatbot.audiodata.AudioData):
         # https://docs.python-telegram-bot.org/en/stable/telegram.bot.html#telegram.Bot.send_voice
+        if audio.key != None:
+            file_id = voice_file_ids.get(audio.key)
+            if file_id != None:
+                try:
+                    return await bot.send_voice(chat_id=chat_id, voice=file_id)
+                except telegram.error.BadRequest as e:
+                    # the file_id isn't valid anymore, upload the audio again
+                    logger.warning(f'could not send voice with file_id {file_id}: {e}')
+                    voice_file_ids.remove_stale(audio.key)
+        # audio held in memory is uploaded from memory, otherwise telegram.ext reads the file
+        voice = audio.data if audio.in_memory else audio.name
+        message = await bot.send_voice(chat_id=chat_id, voice=voice)
+        if audio.key != None and message.voice != None:
+            voice_file_ids.put(audio.key, message.voice.file_id)
+        return message
+    async def send_audio(audio: cloudlanguagetools_chatbot.audiodata.AudioData):
         # tell using we are sending a voice note
         await bot.send_chat_action(chat_id=chat_id, action=telegram.constants.ChatAction.UPLOAD_VOICE)
-        await bot.send_voice(chat_id=chat_id, voice=audio_tempfile.name)
+        outbound_dispatcher.enqueue(chat_id, cloudlanguagetools_chatbot.outbound.OutboundMessage(lambda: upload_voice(audio)))
     return send_audio
 
 def received_status_lambda(bot, chat_id):
+    async def send_status_text(text):
+        escaped_text = telegram.helpers.escape_markdown(text, version=2)
+        return await bot.send_message(chat_id=chat_id, text=f'_{escaped_text}_', parse_mode=telegram.constants.ParseMode.MARKDOWN_V2)
     async def send_status(message):
-        escaped_text = telegram.helpers.escape_markdown(message, version=2)
-        await bot.send_message(chat_id=chat_id, text=f'_{escaped_text}_', parse_mode=telegram.constants.ParseMode.MARKDOWN_V2)
+        # status texts are formatted, they're not merged with the plain texts
+        outbound_dispatcher.enqueue(chat_id, cloudlanguagetools_chatbot.outbound.OutboundMessage(send_status_text, text=message, kind='status'))
     return send_status
 
-async def ensure_chat_model_initialized(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if 'chat_model' not in context.user_data:
-        context.user_data['chat_model'] = cloudlanguagetools_chatbot.chatmodel.ChatModel(clt_manager, 
-            audio_format=cloudlanguagetools.options.AudioFormat.ogg_opus)
-        # the chatmodel needs to know which functions to call when it has a message to send
-        context.user_data['chat_model'].set_send_message_callback(
-            received_message_lambda(context.bot, update.effective_chat.id),
-            received_audio_lambda(context.bot, update.effective_chat.id),
-            received_status_lambda(context.bot, update.effective_chat.id))
-        welcome_message = f"Welcome to VocabAi chatbot, my instructions are: {context.user_data['chat_model'].get_instruction()}"
-        escaped_text = telegram.helpers.escape_markdown(welcome_message, version=2)
-        await context.bot.send_message(chat_id=update.effective_chat.id, text=f'_{escaped_text}_', parse_mode=telegram.constants.ParseMode.MARKDOWN_V2)
+def create_chat_model(bot, chat_id):
+    chat_model = cloudlanguagetools_chatbot.chatmodel.ChatModel(clt_manager, 
+        audio_format=cloudlanguagetools.options.AudioFormat.ogg_opus,
+        result_cache=result_cache,
+        audio_cache=audio_cache,
+        speculative_execution=SPECULATIVE_EXECUTION,
+        streaming=STREAMING,
+        tool_plans=TOOL_PLANS,
+        turn_cache=turn_cache,
+        audio_preprocessor=audio_preprocessor,
+        max_in_memory_audio_bytes=MAX_IN_MEMORY_AUDIO_BYTES)
+    if traffic_recorder != None:
+        chat_model.llm_client = cloudlanguagetools_chatbot.recording.RecordingLLMClient(chat_model.llm_client, traffic_recorder)
+        chat_model.chatapi = cloudlanguagetools_chatbot.recording.RecordingChatAPI(chat_model.chatapi, traffic_recorder)
+    # the chatmodel needs to know which functions to call when it has a message to send
+    chat_model.set_send_message_callback(
+        received_message_lambda(bot, chat_id),
+        received_audio_lambda(bot, chat_id),
+        received_status_lambda(bot, chat_id),
+        received_message_update_lambda(bot, chat_id))
+    return chat_model
+
+async def send_welcome_message(chat_model, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    welcome_message = f"Welcome to VocabAi chatbot, my instructions are: {chat_model.get_instruction()}"
+    escaped_text = telegram.helpers.escape_markdown(welcome_message, version=2)
+    # queued behind the answers of the previous messages
+    outbound_dispatcher.enqueue(update.effective_chat.id, cloudlanguagetools_chatbot.outbound.OutboundMessage(
+        lambda: context.bot.send_message(chat_id=update.effective_chat.id, text=f'_{escaped_text}_', parse_mode=telegram.constants.ParseMode.MARKDOWN_V2)))
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await ensure_chat_model_initialized(update, context)
+    with session_store.use_session(update.effective_chat.id) as (chat_model, is_new):
+        if is_new:
+            await send_welcome_message(chat_model, update, context)
 
 async def handle_user_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await ensure_chat_model_initialized(update, context)
+    with session_store.use_session(update.effective_chat.id) as (chat_model, is_new):
+        if is_new:
+            await send_welcome_message(chat_model, update, context)
 
-    # tell user we are typing
-    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action=telegram.constants.ChatAction.TYPING)
+        # tell user we are typing
+        await context.bot.send_chat_action(chat_id=update.effective_chat.id, action=telegram.constants.ChatAction.TYPING)
 
-    input_text = update.message.text
-    await context.user_data['chat_model'].process_message(input_text)
+        input_text = update.message.text
+        if traffic_recorder != None:
+            traffic_recorder.record_input(update.effective_chat.id, text=input_text)
+        await chat_model.process_message(input_text)
 
 async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await ensure_chat_model_initialized(update, context)
+    with session_store.use_session(update.effective_chat.id) as (chat_model, is_new):
+        if is_new:
+            await send_welcome_message(chat_model, update, context)
 
-    # tell user we are typing
-    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action=telegram.constants.ChatAction.TYPING)
+        # tell user we are typing
+        await context.bot.send_chat_action(chat_id=update.effective_chat.id, action=telegram.constants.ChatAction.TYPING)
 
-    # download file
-    file_id = update.message.voice.file_id
-    voice_note_file = await context.bot.getFile(file_id)
-    voice_tempfile = tempfile.NamedTemporaryFile(prefix='telegram_voice_', suffix='.ogg')
-    await voice_note_file.download_to_drive(voice_tempfile.name)
+        # a voice note forwarded from another chat has the same file_unique_id, it's not downloaded again
+        voice = update.message.voice
+        audio_key = f'telegram_voice:{voice.file_unique_id}'
+        transcript = await chat_model.get_cached_transcript(audio_key)
+        if transcript != None:
+            if traffic_recorder != None:
+                traffic_recorder.record_input(update.effective_chat.id, text=transcript)
+            await chat_model.process_transcript(transcript)
+            return
 
-    # recognize text
-    text = await context.user_data['chat_model'].process_audio(voice_tempfile)
+        # download file, into memory unless it's large
+        with cloudlanguagetools_chatbot.metrics.span('telegram_download'):
+            voice_note_file = await context.bot.getFile(voice.file_id)
+            if voice.file_size != None and voice.file_size <= MAX_IN_MEMORY_AUDIO_BYTES:
+                audio = cloudlanguagetools_chatbot.audiodata.AudioData.from_bytes(await voice_note_file.download_as_bytearray(),
+                    suffix='.ogg', max_in_memory_bytes=MAX_IN_MEMORY_AUDIO_BYTES)
+            else:
+                voice_tempfile = tempfile.NamedTemporaryFile(prefix='telegram_voice_', suffix='.ogg')
+                await voice_note_file.download_to_drive(voice_tempfile.name)
+                audio = cloudlanguagetools_chatbot.audiodata.AudioData(path=voice_tempfile.name, suffix='.ogg', owned_file=voice_tempfile)
+            audio.key = audio_key
 
+        # recognize text
+        try:
+            if traffic_recorder != None:
+                traffic_recorder.record_input(update.effective_chat.id, audio_key=cloudlanguagetools_chatbot.recording.get_audio_key(audio))
+            await chat_model.process_audio(audio)
+        finally:
+            audio.close()
 
-if __name__ == '__main__':
-    # set default basic logging with info level
+async def post_init(application):
+    global session_store
+    global metrics_runner
+    # chat sessions are created with the application's bot, idle ones are evicted periodically
+    session_store = cloudlanguagetools_chatbot.session.SessionStore(
+        lambda chat_id: create_chat_model(application.bot, chat_id),
+        sqlite_path=SESSION_DB, idle_timeout=SESSION_IDLE_TIMEOUT)
+    # not started with application.create_task, the application would wait for it when stopping
+    session_store.start_eviction_loop()
+    if METRICS_PORT != 0:
+        metrics_runner = await cloudlanguagetools_chatbot.metrics.start_http_server(METRICS_PORT)
+    # on a background thread, the bot starts receiving updates in the meantime
+    if WARM_UP:
+        clt_manager.start_warm_up()
+    startup_profiler.record('ready', startup_profiler.get_elapsed())
+    logger.info(f'started in {startup_profiler.get_elapsed():.2f}s')
+
+async def post_stop(application):
+    # deliver the answers of the last updates. the updates have been processed, and the bot isn't shut down yet
+    await outbound_dispatcher.flush()
+    logger.info(f'outbound messages: {outbound_dispatcher.get_stats()}')
 
-    logging.info('starting up telegram bot')
+async def post_shutdown(application):
+    session_store.save_all()
+    session_store.close()
+    voice_file_ids.close()
+    result_cache.close()
+    if turn_cache != None:
+        turn_cache.close()
+    if metrics_runner != None:
+        await metrics_runner.cleanup()
+    if traffic_recorder != None:
+        traffic_recorder.close()
+    # close the pooled HTTP connections to Azure OpenAI
+    await cloudlanguagetools_chatbot.chatmodel.get_shared_llm_client().close()
 
-    application = ApplicationBuilder().token(TOKEN).build()
-    
-    start_handler = CommandHandler("start", start)
-    message_handler = MessageHandler(filters.TEXT & (~filters.COMMAND), handle_user_message)
-    voice_handler = MessageHandler(filters.VOICE & (~filters.COMMAND), handle_voice)
+def build_application(updater=True):
+    """the telegram application, with the handlers. the webhook workers build it without an updater,
+    they receive their updates from the webhook front end"""
+    # let telegram.ext start more updates than the dispatcher runs, so that updates queued behind
+    # a busy chat don't hold up the other chats
+    builder = ApplicationBuilder().token(TOKEN).concurrent_updates(MAX_CONCURRENT_CHATS * 4).post_init(post_init)\
+        .post_stop(post_stop).post_shutdown(post_shutdown)
+    if TELEGRAM_BASE_URL != None:
+        # for local testing, against a fake bot API
+        builder = builder.base_url(TELEGRAM_BASE_URL).base_file_url(TELEGRAM_BASE_URL.replace('/bot', '/file/bot'))
+    if not updater:
+        builder = builder.updater(None)
+    application = builder.build()
+
+    start_handler = CommandHandler("start", serialized_per_chat(start))
+    message_handler = MessageHandler(filters.TEXT & (~filters.COMMAND), serialized_per_chat(handle_user_message))
+    voice_handler = MessageHandler(filters.VOICE & (~filters.COMMAND), serialized_per_chat(handle_voice))
 
     application.add_handler(start_handler)
     application.add_handler(message_handler)
     application.add_handler(voice_handler)
-    application.run_polling()
\ No newline at end of file
+    return application
+
+def profile_startup():
+    """the import and initialization times, without connecting to telegram"""
+    clt_manager.warm_up()
+    with startup_profiler.phase('build_application'):
+        build_application()
+    report = startup_profiler.get_report()
+    report['services_init'] = clt_manager.init_duration
+    report['warm_up'] = clt_manager.warm_up_duration
+    # in a new interpreter, to time every module
+    report['imports'] = cloudlanguagetools_chatbot.startup.profile_imports('telegram_app', cwd=os.path.dirname(os.path.abspath(__file__)))
+    return report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='telegram bot, polling for updates')
+    parser.add_argument('--profile-startup', action='store_true', help='report the time spent importing and initializing each part, then exit')
+    args = parser.parse_args()
+
+    if args.profile_startup:
+        print(json.dumps(profile_startup(), indent=4))
+    else:
+        logging.info('starting up telegram bot')
+
+        application = build_application()
+        application.run_polling()
@@ -0,0 +1,164 @@
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(process)d - %(message)s',
+    level=logging.INFO
+)
+
+logger = logging.getLogger(__name__)
+
+import aiohttp.web
+import telegram
+
+import cloudlanguagetools_chatbot.sharding
+
+# webhook mode: a front end process receives the updates from telegram and routes each one to a worker
+# process, chosen with a hash of the chat id, so that a chat always lands on the same worker and its
+# ChatModel stays in that worker's memory.
+# the workers share the session database: when the worker count changes, the workers store their
+# sessions when shutting down, and the new workers restore them on the next message of each chat.
+# https://core.telegram.org/bots/api#setwebhook
+
+WEBHOOK_PATH = '/telegram'
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+DEFAULT_PORT = 8080
+WORKER_SHUTDOWN_TIMEOUT = 60
+
+def run_worker(worker_index, worker_count, update_queue):
+    """entry point of a worker process"""
+    # ctrl-c reaches the whole process group, the front end stops the workers once it's done receiving updates
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # each worker serves its own metrics, on consecutive ports
+    metrics_port = int(os.environ.get('CLT_CHATBOT_METRICS_PORT', 9090))
+    if metrics_port != 0:
+        os.environ['CLT_CHATBOT_METRICS_PORT'] = str(metrics_port + worker_index)
+    # the telegram flood limit applies to the bot, it's shared between the workers
+    messages_per_second = float(os.environ.get('CLT_CHATBOT_TELEGRAM_MESSAGES_PER_SECOND', 30))
+    os.environ['CLT_CHATBOT_TELEGRAM_MESSAGES_PER_SECOND'] = str(messages_per_second / worker_count)
+    # and records its traffic to its own file
+    if os.environ.get('CLT_CHATBOT_RECORD_TRAFFIC', None) != None:
+        os.environ['CLT_CHATBOT_RECORD_TRAFFIC'] = f"{os.environ['CLT_CHATBOT_RECORD_TRAFFIC']}.{worker_index}"
+    # imported here, the front end doesn't need the language tools services
+    import telegram_app
+    logger.info(f'worker {worker_index} starting')
+    asyncio.run(process_updates(telegram_app.build_application(updater=False), update_queue))
+    logger.info(f'worker {worker_index} stopped')
+
+async def process_updates(application, update_queue):
+    # without an updater, the application doesn't call post_init / post_stop / post_shutdown itself
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            update_data = await loop.run_in_executor(None, update_queue.get)
+            if update_data == None:
+                break
+            await application.update_queue.put(telegram.Update.de_json(update_data, application.bot))
+    finally:
+        # in the order of Application.run_polling: stop() waits for the updates being processed, their answers
+        # are sent while the bot is still up, then the sessions are stored
+        await application.stop()
+        await application.post_stop(application)
+        await application.shutdown()
+        await application.post_shutdown(application)
+
+class WebhookFrontEnd():
+    def __init__(self, worker_count, secret_token=None):
+        self.worker_count = worker_count
+        self.secret_token = secret_token
+        # spawn: the workers don't inherit the front end's event loop
+        self.context = multiprocessing.get_context('spawn')
+        self.update_queues = []
+        self.workers = []
+        self.routed_counts = [0] * worker_count
+
+    def start_workers(self):
+        for worker_index in range(self.worker_count):
+            update_queue = self.context.Queue()
+            worker = self.context.Process(target=run_worker, args=(worker_index, self.worker_count, update_queue), name=f'telegram_worker_{worker_index}')
+            worker.start()
+            self.update_queues.append(update_queue)
+            self.workers.append(worker)
+        logger.info(f'started {self.worker_count} workers')
+
+    def stop_workers(self):
+        for update_queue in self.update_queues:
+            update_queue.put(None)
+        for worker in self.workers:
+            worker.join(WORKER_SHUTDOWN_TIMEOUT)
+            if worker.is_alive():
+                logger.warning(f'{worker.name} did not stop, terminating it')
+                worker.terminate()
+        self.update_queues = []
+        self.workers = []
+
+    def route_update(self, update_data):
+        chat_id = cloudlanguagetools_chatbot.sharding.get_update_chat_id(update_data)
+        worker_index = cloudlanguagetools_chatbot.sharding.get_shard_index(chat_id, self.worker_count)
+        self.update_queues[worker_index].put(update_data)
+        self.routed_counts[worker_index] += 1
+        return worker_index
+
+    async def handle_webhook(self, request):
+        if self.secret_token != None and request.headers.get(SECRET_TOKEN_HEADER, None) != self.secret_token:
+            return aiohttp.web.Response(status=403)
+        try:
+            update_data = await request.json()
+        except ValueError:
+            return aiohttp.web.Response(status=400)
+        self.route_update(update_data)
+        # answer right away, telegram doesn't wait for the update to be processed
+        return aiohttp.web.Response(status=200)
+
+    async def handle_stats(self, request):
+        return aiohttp.web.json_response({
+            'workers': self.worker_count,
+            'alive': [worker.is_alive() for worker in self.workers],
+            'routed': self.routed_counts
+        })
+
+    def build_web_application(self):
+        web_application = aiohttp.web.Application()
+        web_application.router.add_post(WEBHOOK_PATH, self.handle_webhook)
+        web_application.router.add_get('/stats', self.handle_stats)
+        return web_application
+
+async def set_webhook(token, webhook_url, secret_token, base_url=None):
+    bot_kwargs = {}
+    if base_url != None:
+        bot_kwargs['base_url'] = base_url
+    async with telegram.Bot(token, **bot_kwargs) as bot:
+        await bot.set_webhook(webhook_url, secret_token=secret_token)
+    logger.info(f'webhook set to {webhook_url}')
+
+def main():
+    parser = argparse.ArgumentParser(description='telegram bot in webhook mode, with one worker process per core')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('CLT_CHATBOT_WORKERS', os.cpu_count())))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('CLT_CHATBOT_WEBHOOK_PORT', DEFAULT_PORT)))
+    # public url of this server, registered with telegram if set, for example https://bot.example.com/telegram
+    parser.add_argument('--webhook-url', default=os.environ.get('TELEGRAM_WEBHOOK_URL', None))
+    args = parser.parse_args()
+
+    secret_token = os.environ.get('TELEGRAM_WEBHOOK_SECRET', None)
+    if args.webhook_url != None:
+        asyncio.run(set_webhook(os.environ['TELEGRAM_BOT_TOKEN'], args.webhook_url, secret_token,
+                                os.environ.get('TELEGRAM_BASE_URL', None)))
+
+    front_end = WebhookFrontEnd(args.workers, secret_token=secret_token)
+    front_end.start_workers()
+    try:
+        # returns on SIGINT / SIGTERM
+        aiohttp.web.run_app(front_end.build_web_application(), port=args.port)
+    finally:
+        logger.info('stopping workers')
+        front_end.stop_workers()
+
+if __name__ == '__main__':
+    main()
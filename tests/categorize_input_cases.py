@@ -0,0 +1,61 @@
+from cloudlanguagetools_chatbot.categorize import InputType
+
+# (last input sentence, input sentence, expected input type)
+CATEGORIZE_INPUT_CASES = [
+    ('呢條路係行返屋企嘅路', 'Is there another chinese character which means road?', InputType.question_or_command),
+    ('呢條路係行返屋企嘅路', '黑社會', InputType.new_sentence),
+    ('黑社會', 'When do we use this ?', InputType.question_or_command),
+    ('黑社會', 'pronounce using amazon', InputType.question_or_command),
+    ('黑社會', 'instructions: when I give you a sentence in cantonese, pronounce it using Azure service and female voice, then translate it into english, and break down the cantonese sentence into words', InputType.instructions),
+    ('黑社會', 'instruction: translate from french to english', InputType.instructions),
+    (None, '成绩', InputType.new_sentence),
+    # from the conversations in test_chatmodel
+    (None, 'Je ne suis pas intéressé.', InputType.new_sentence),
+    ('呢條路係行返屋企嘅路', '我最頂唔順嗰樣嘢', InputType.new_sentence),
+    ('黑社會', 'pronounce using amazon service', InputType.question_or_command),
+    ('成绩', 'pinyin', InputType.question_or_command),
+    ('山路', 'jyutping', InputType.question_or_command),
+    # questions and commands asked in the foreign language, left to the LLM
+    ('我想吃中餐', '中餐是什么意思', InputType.question_or_command),
+    ('我想吃中餐', '这个句子对吗', InputType.question_or_command),
+    ('我想吃中餐', '怎么说我想吃日本菜', InputType.question_or_command),
+    ('成本很低', '解释一下这个句子', InputType.question_or_command),
+    ('成本很低', '翻译成英文', InputType.question_or_command),
+    ('Я хочу есть', 'что значит есть', InputType.question_or_command),
+    ('Я хочу есть', 'как это сказать по-английски', InputType.question_or_command),
+    ('ラーメンを食べたい', 'ラーメンは何', InputType.question_or_command),
+    ('ラーメンを食べたい', 'どういう意味', InputType.question_or_command),
+    # the same questions in english
+    ('我想吃中餐', 'what does 中餐 mean?', InputType.question_or_command),
+    ('我想吃中餐', 'is this sentence correct?', InputType.question_or_command),
+    ('Я хочу есть', 'what does есть mean here?', InputType.question_or_command),
+    ('ラーメンを食べたい', 'explain the grammar', InputType.question_or_command),
+    # new sentences after a previous one
+    ('我想吃中餐', '成本很低', InputType.new_sentence),
+    ('成本很低', '我明天去北京', InputType.new_sentence),
+    ('我明天去北京', '今天天气很好', InputType.new_sentence),
+    ('Я хочу есть', 'Я люблю читать книги', InputType.new_sentence),
+    ('Я люблю читать книги', 'Сегодня хорошая погода', InputType.new_sentence),
+    ('ラーメンを食べたい', '駅はここから遠いです', InputType.new_sentence),
+    ('駅はここから遠いです', '明日は雨が降ります', InputType.new_sentence),
+    ('明日は雨が降ります', '日本語を勉強しています', InputType.new_sentence),
+    ('저는 학생입니다', '오늘은 날씨가 좋아요', InputType.new_sentence),
+    ('오늘은 날씨가 좋아요', '저는 커피를 좋아해요', InputType.new_sentence),
+    ('黑社會', '我哋聽日去飲茶', InputType.new_sentence),
+    ('我哋聽日去飲茶', '佢住喺香港', InputType.new_sentence),
+    ('สวัสดีครับ', 'ผมอยากกินข้าว', InputType.new_sentence),
+    ('Γεια σου', 'Θέλω ένα καφέ', InputType.new_sentence),
+    ('Θέλω ένα καφέ', 'Ο καιρός είναι ωραίος', InputType.new_sentence),
+    ('我想吃中餐', '我也想吃', InputType.new_sentence),
+    ('我也想吃', '谢谢你的帮助', InputType.new_sentence),
+    ('谢谢你的帮助', '我们走吧', InputType.new_sentence),
+    ('我们走吧', '他是我的朋友', InputType.new_sentence),
+    ('他是我的朋友', '这家饭店很好吃', InputType.new_sentence),
+    ('这家饭店很好吃', '我每天早上跑步', InputType.new_sentence),
+    ('我每天早上跑步', '她会说三种语言', InputType.new_sentence),
+    ('她会说三种语言', '请给我一杯水', InputType.new_sentence),
+    ('请给我一杯水', '地铁站在前面', InputType.new_sentence),
+    ('地铁站在前面', '我的手机没电了', InputType.new_sentence),
+    ('Я люблю читать книги', 'Мы идём в кино', InputType.new_sentence),
+    ('Мы идём в кино', 'Он работает в больнице', InputType.new_sentence),
+]
@@ -0,0 +1,149 @@
+import os
+import sys
+import asyncio
+import tempfile
+import time
+import unittest
+import pydantic
+import enum
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import cloudlanguagetools_chatbot.audio_cache
+import cloudlanguagetools_chatbot.audiodata
+
+class AudioFormat(enum.Enum):
+    mp3 = enum.auto()
+    ogg_opus = enum.auto()
+
+class AudioQuery(pydantic.BaseModel):
+    input_text: str
+    language: str
+
+def make_audio_file(content: bytes, suffix='.mp3'):
+    audio_tempfile = tempfile.NamedTemporaryFile(suffix=suffix)
+    audio_tempfile.write(content)
+    audio_tempfile.flush()
+    return audio_tempfile
+
+class TestAudioCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.temp_dir.name, 'audio')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_key(self):
+        get_key = cloudlanguagetools_chatbot.audio_cache.AudioCache.get_key
+        query = AudioQuery(input_text='成本很低', language='zh_cn')
+        self.assertEqual(get_key(query, AudioFormat.mp3), get_key(AudioQuery(input_text='成本很低', language='zh_cn'), AudioFormat.mp3))
+        self.assertNotEqual(get_key(query, AudioFormat.mp3), get_key(query, AudioFormat.ogg_opus))
+        self.assertNotEqual(get_key(query, AudioFormat.mp3), get_key(AudioQuery(input_text='成本', language='zh_cn'), AudioFormat.mp3))
+
+    def test_concurrent_synthesis(self):
+        cache = cloudlanguagetools_chatbot.audio_cache.AudioCache(self.cache_dir)
+        synthesize_count = 0
+
+        async def synthesize():
+            nonlocal synthesize_count
+            synthesize_count += 1
+            await asyncio.sleep(0.05)
+            return cloudlanguagetools_chatbot.audiodata.AudioData.from_bytes(b'audio data', suffix='.mp3')
+
+        async def run():
+            return await asyncio.gather(*[cache.get_or_synthesize('key1', synthesize) for i in range(5)])
+
+        path_list = asyncio.run(run())
+        self.assertEqual(synthesize_count, 1)
+        self.assertEqual(len(set(path_list)), 1)
+        with open(path_list[0], 'rb') as f:
+            self.assertEqual(f.read(), b'audio data')
+        self.assertTrue(path_list[0].endswith('.mp3'))
+
+    def test_lock_kept_for_waiters(self):
+        cache = cloudlanguagetools_chatbot.audio_cache.AudioCache(self.cache_dir)
+        synthesizing = 0
+        max_synthesizing = 0
+
+        async def synthesize():
+            nonlocal synthesizing, max_synthesizing
+            synthesizing += 1
+            max_synthesizing = max(max_synthesizing, synthesizing)
+            try:
+                await asyncio.sleep(0.05)
+                if len(attempts) == 0:
+                    attempts.append('failed')
+                    raise RuntimeError('text to speech service unavailable')
+                attempts.append('synthesized')
+                return cloudlanguagetools_chatbot.audiodata.AudioData.from_bytes(b'audio data', suffix='.mp3')
+            finally:
+                synthesizing -= 1
+
+        attempts = []
+        async def run():
+            first_task = asyncio.ensure_future(cache.get_or_synthesize('key1', synthesize))
+            waiting_task = asyncio.ensure_future(cache.get_or_synthesize('key1', synthesize))
+            with self.assertRaises(RuntimeError):
+                await first_task
+            # the waiting call synthesizes in turn, a new call waits for it rather than synthesizing too
+            await asyncio.sleep(0.01)
+            path_list = await asyncio.gather(waiting_task, cache.get_or_synthesize('key1', synthesize))
+            self.assertEqual(len(set(path_list)), 1)
+            self.assertEqual(cache.key_locks, {})
+
+        asyncio.run(run())
+        self.assertEqual(attempts, ['failed', 'synthesized'])
+        self.assertEqual(max_synthesizing, 1)
+
+    def test_lru_eviction(self):
+        cache = cloudlanguagetools_chatbot.audio_cache.AudioCache(self.cache_dir, max_bytes=25, eviction_grace_period=0)
+        audio_file = make_audio_file(b'0123456789')
+        path_a = cache.put_file('a', audio_file.name)
+        path_b = cache.put_file('b', audio_file.name)
+        # a becomes most recently used
+        self.assertEqual(cache.get_path('a'), path_a)
+        cache.put_file('c', audio_file.name)
+        self.assertEqual(cache.get_path('b'), None)
+        self.assertFalse(os.path.exists(path_b))
+        self.assertEqual(cache.get_path('a'), path_a)
+        self.assertEqual(cache.get_stats()['total_bytes'], 20)
+
+    def test_eviction_grace_period(self):
+        cache = cloudlanguagetools_chatbot.audio_cache.AudioCache(self.cache_dir, max_bytes=25, eviction_grace_period=60)
+        audio_file = make_audio_file(b'0123456789')
+        path_list = [cache.put_file(key, audio_file.name) for key in ['a', 'b', 'c']]
+        # the files may still be queued for upload, they're kept over the budget
+        self.assertTrue(all([os.path.exists(path) for path in path_list]))
+        self.assertEqual(cache.get_stats()['total_bytes'], 30)
+        # a and b were used long ago, b was used again by another process
+        for path in path_list[:2]:
+            os.utime(path, (time.time() - 120, time.time() - 120))
+        os.utime(path_list[1])
+        cache.put_file('d', audio_file.name)
+        self.assertFalse(os.path.exists(path_list[0]))
+        self.assertEqual(cache.get_path('b'), path_list[1])
+        self.assertEqual(cache.get_stats()['evictions'], 1)
+        self.assertEqual(cache.get_stats()['total_bytes'], 30)
+
+    def test_shared_budget(self):
+        # two processes sharing the directory, like the webhook workers
+        caches = [cloudlanguagetools_chatbot.audio_cache.AudioCache(self.cache_dir, max_bytes=25, eviction_grace_period=60, scan_interval=0)
+                  for i in range(2)]
+        audio_file = make_audio_file(b'0123456789')
+        for i, key in enumerate(['a', 'b', 'c', 'd']):
+            path = caches[i % 2].put_file(key, audio_file.name)
+            os.utime(path, (time.time() - 600 + i, time.time() - 600 + i))
+        caches[0].put_file('e', audio_file.name)
+        file_sizes = [os.path.getsize(os.path.join(self.cache_dir, filename)) for filename in os.listdir(self.cache_dir)]
+        self.assertLessEqual(sum(file_sizes), 25)
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), ['d.mp3', 'e.mp3'])
+        self.assertEqual(caches[0].get_stats()['total_bytes'], 20)
+
+    def test_reload(self):
+        cache = cloudlanguagetools_chatbot.audio_cache.AudioCache(self.cache_dir)
+        audio_file = make_audio_file(b'audio data', suffix='.ogg')
+        path = cache.put_file('a', audio_file.name)
+        restarted_cache = cloudlanguagetools_chatbot.audio_cache.AudioCache(self.cache_dir)
+        self.assertEqual(restarted_cache.get_path('a'), path)
@@ -0,0 +1,51 @@
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pydub
+import pydub.generators
+import cloudlanguagetools.options
+import cloudlanguagetools_chatbot.audio_preprocess
+import cloudlanguagetools_chatbot.audiodata
+
+def build_voice_note(segment: pydub.AudioSegment) -> cloudlanguagetools_chatbot.audiodata.AudioData:
+    # wav, pydub reads and writes it without ffmpeg
+    output_file = io.BytesIO()
+    segment.export(output_file, format='wav')
+    return cloudlanguagetools_chatbot.audiodata.AudioData(data=output_file.getvalue(), suffix='.wav', key='telegram_voice:1')
+
+class TestAudioPreprocessor(unittest.TestCase):
+
+    def setUp(self):
+        self.preprocessor = cloudlanguagetools_chatbot.audio_preprocess.AudioPreprocessor(output_format='wav', max_duration_seconds=2)
+        self.silence = pydub.AudioSegment.silent(duration=1000, frame_rate=44100).set_channels(2)
+        self.speech = pydub.generators.Sine(440, sample_rate=44100).to_audio_segment(duration=1000, volume=-10).set_channels(2)
+
+    @unittest.skipUnless(hasattr(cloudlanguagetools.options.AudioFormat, 'wav'), 'AudioFormat.wav needs a newer cloudlanguagetools')
+    def test_trim_and_resample(self):
+        preprocessed = self.preprocessor.preprocess(build_voice_note(self.silence + self.speech + self.silence))
+        self.assertAlmostEqual(preprocessed.input_duration, 3.0, places=2)
+        # the speech, with some padding
+        self.assertAlmostEqual(preprocessed.output_duration, 1.4, places=1)
+        self.assertLess(preprocessed.output_size, preprocessed.input_size / 10)
+        self.assertEqual(preprocessed.audio_format, cloudlanguagetools.options.AudioFormat.wav)
+        self.assertEqual(preprocessed.audio.key, 'telegram_voice:1')
+        segment = pydub.AudioSegment.from_file(preprocessed.audio.open(), format='wav')
+        self.assertEqual(segment.channels, 1)
+        self.assertEqual(segment.frame_rate, cloudlanguagetools_chatbot.audio_preprocess.DEFAULT_SAMPLE_RATE)
+
+    @unittest.skipUnless(hasattr(cloudlanguagetools.options.AudioFormat, 'wav'), 'AudioFormat.wav needs a newer cloudlanguagetools')
+    def test_max_duration(self):
+        preprocessed = self.preprocessor.preprocess(build_voice_note(self.speech * 4))
+        self.assertAlmostEqual(preprocessed.output_duration, 2.0, places=2)
+
+    def test_silent(self):
+        preprocessed = self.preprocessor.preprocess(build_voice_note(self.silence))
+        self.assertEqual(preprocessed.audio, None)
+        self.assertEqual(self.preprocessor.get_stats()['silent'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
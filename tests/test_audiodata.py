@@ -0,0 +1,60 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import cloudlanguagetools_chatbot.audiodata
+
+AudioData = cloudlanguagetools_chatbot.audiodata.AudioData
+
+class TestAudioData(unittest.TestCase):
+
+    def test_in_memory(self):
+        audio = AudioData.from_bytes(bytearray(b'ogg data'), suffix='.ogg')
+        self.assertTrue(audio.in_memory)
+        self.assertEqual(audio.path, None)
+        self.assertEqual(audio.get_bytes(), b'ogg data')
+        self.assertEqual(audio.open().read(), b'ogg data')
+        # a file is only written when a path is needed
+        path = audio.name
+        self.assertTrue(path.endswith('.ogg'))
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'ogg data')
+        self.assertEqual(audio.name, path)
+        audio.close()
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(audio.get_bytes(), b'ogg data')
+
+    def test_size_threshold(self):
+        audio = AudioData.from_bytes(b'0123456789', suffix='.ogg', max_in_memory_bytes=5)
+        self.assertFalse(audio.in_memory)
+        self.assertTrue(os.path.exists(audio.name))
+        self.assertEqual(audio.get_bytes(), b'0123456789')
+        self.assertEqual(audio.get_size(), 10)
+        audio.close()
+        self.assertFalse(os.path.exists(audio.path))
+
+    def test_from_tempfile(self):
+        audio_tempfile = tempfile.NamedTemporaryFile(suffix='.mp3')
+        audio_tempfile.write(b'mp3 data')
+        audio_tempfile.flush()
+        # small: read into memory, the temporary file is deleted right away
+        audio = AudioData.from_tempfile(audio_tempfile)
+        self.assertTrue(audio.in_memory)
+        self.assertEqual(audio.suffix, '.mp3')
+        self.assertFalse(os.path.exists(audio_tempfile.name))
+        self.assertEqual(audio.read(), b'mp3 data')
+
+        audio_tempfile = tempfile.NamedTemporaryFile(suffix='.mp3')
+        audio_tempfile.write(b'mp3 data')
+        audio_tempfile.flush()
+        # large: stays on disk
+        audio = AudioData.from_tempfile(audio_tempfile, max_in_memory_bytes=4)
+        self.assertFalse(audio.in_memory)
+        self.assertEqual(audio.name, audio_tempfile.name)
+        self.assertEqual(audio.read(), b'mp3 data')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import sys
+import json
+import asyncio
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import cloudlanguagetools_chatbot.batch
+import cloudlanguagetools_chatbot.audiodata
+
+class FunctionCallResult():
+    def __init__(self, result, audio=None):
+        self.result = result
+        self.audio = audio
+
+class FakeChatModel():
+    def __init__(self, failing_texts):
+        self.failing_texts = failing_texts
+
+    def set_send_message_callback(self, send_message_fn, send_audio_fn, send_status_fn):
+        self.send_message = send_message_fn
+
+    async def run_function_call(self, function_name, arguments):
+        if arguments['input_text'] in self.failing_texts:
+            raise Exception('service unavailable')
+        if function_name == 'pronounce':
+            return FunctionCallResult(arguments['input_text'], audio=cloudlanguagetools_chatbot.audiodata.AudioData(data=b'audio'))
+        return FunctionCallResult(f"{function_name} of {arguments['input_text']}")
+
+class TestBatch(unittest.TestCase):
+
+    def test_read_items(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_path = os.path.join(temp_dir, 'deck.csv')
+            with open(input_path, 'w', encoding='utf-8') as f:
+                f.write('id,text,source_language\nw1,我想吃中餐,\nw2,,\nw3,Bonjour,fr\n')
+            items = cloudlanguagetools_chatbot.batch.read_items(input_path, source_language='zh_cn', target_language='en')
+            self.assertEqual([item['id'] for item in items], ['w1', 'w3'])
+            self.assertEqual(items[1]['source_language'], 'fr')
+            grouped_items = cloudlanguagetools_chatbot.batch.group_by_language_pair(items)
+            self.assertEqual([item['id'] for item in grouped_items], ['w3', 'w1'])
+
+    def test_process_and_resume(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output_path = os.path.join(temp_dir, 'results.jsonl')
+            audio_dir = os.path.join(temp_dir, 'audio')
+            items = [{'index': i, 'id': f'row/{i}', 'text': f'sentence {i}', 'source_language': 'fr', 'target_language': 'en'} for i in range(5)]
+            functions = ['translate_or_lookup', 'pronounce']
+
+            failing_texts = set(['sentence 3'])
+            processor = cloudlanguagetools_chatbot.batch.BatchProcessor(lambda: FakeChatModel(failing_texts), output_path,
+                audio_dir=audio_dir, functions=functions, concurrency=2)
+            stats = asyncio.run(processor.run(items))
+            self.assertEqual(stats['completed'], 4)
+            self.assertEqual(stats['errors'], 1)
+            with open(output_path, 'r', encoding='utf-8') as f:
+                entries = [json.loads(line) for line in f]
+            entry = [entry for entry in entries if entry['index'] == 0][0]
+            self.assertEqual(entry['results'], {'translate_or_lookup': 'translate_or_lookup of sentence 0'})
+            self.assertEqual(entry['audio'], ['row_0_0.mp3'])
+            with open(os.path.join(audio_dir, 'row_0_0.mp3'), 'rb') as f:
+                self.assertEqual(f.read(), b'audio')
+
+            # only the failed row is processed again
+            failing_texts.clear()
+            processor = cloudlanguagetools_chatbot.batch.BatchProcessor(lambda: FakeChatModel(failing_texts), output_path,
+                audio_dir=audio_dir, functions=functions, concurrency=2)
+            stats = asyncio.run(processor.run(items))
+            self.assertEqual(stats['completed'], 1)
+            self.assertEqual(stats['skipped'], 4)
+            self.assertEqual(cloudlanguagetools_chatbot.batch.read_completed_indices(output_path), set(range(5)))
+
+if __name__ == '__main__':
+    unittest.main()
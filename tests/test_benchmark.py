@@ -0,0 +1,25 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'benchmarks')))
+
+import benchmark_chatmodel
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_benchmark_chatmodel(self):
+        # pytest tests/test_benchmark.py
+        args = benchmark_chatmodel.parse_args(['--sessions', '4', '--concurrency', '2', '--time-scale', '0.01', '--audio-cache'])
+        results = benchmark_chatmodel.Benchmark(args).run()['results']
+        self.assertEqual(results['errors'], 0)
+        self.assertEqual(results['turns'], 4 * len(benchmark_chatmodel.fakes.DEFAULT_SCENARIO))
+        self.assertEqual(results['latency']['count'], results['turns'])
+        # one round trip for each step of the scenario at least
+        self.assertGreaterEqual(results['llm_round_trips_per_turn'], 1.5)
+        # the same sentence is only pronounced once
+        self.assertEqual(results['tool_calls']['audio'], 1)
+        self.assertGreater(results['memory_per_session_bytes'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import asyncio
+import os
+import sys
+import time
+import tempfile
+import unittest
+import pydantic
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import cloudlanguagetools_chatbot.cache
+
+class TranslateQuery(pydantic.BaseModel):
+    input_text: str
+    target_language: str = 'en'
+
+class TestFunctionCallCache(unittest.TestCase):
+
+    def test_hit_miss(self):
+        cache = cloudlanguagetools_chatbot.cache.FunctionCallCache()
+        key = cache.get_key('translate_or_lookup', TranslateQuery(input_text='成本很低'))
+        self.assertEqual(cache.get(key), None)
+        cache.put(key, 'The cost is low.')
+        # the same query, built with explicit default values, maps to the same key
+        same_key = cache.get_key('translate_or_lookup', TranslateQuery(input_text='成本很低', target_language='en'))
+        self.assertEqual(cache.get(same_key), 'The cost is low.')
+        # different function name
+        self.assertEqual(cache.get(cache.get_key('transliterate', TranslateQuery(input_text='成本很低'))), None)
+        self.assertEqual(cache.get_stats(), {'entries': 1, 'hits': 1, 'misses': 2, 'evictions': 0})
+
+    def test_lru_eviction(self):
+        cache = cloudlanguagetools_chatbot.cache.FunctionCallCache(max_entries=2)
+        cache.put('a', 'result a')
+        cache.put('b', 'result b')
+        # touch a, so that b is the least recently used
+        self.assertEqual(cache.get('a'), 'result a')
+        cache.put('c', 'result c')
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 'result a')
+        self.assertEqual(cache.get('c'), 'result c')
+        self.assertEqual(cache.get_stats()['evictions'], 1)
+
+    def test_ttl_expiration(self):
+        cache = cloudlanguagetools_chatbot.cache.FunctionCallCache(ttl_seconds=0.05)
+        cache.put('a', 'result a')
+        self.assertEqual(cache.get('a'), 'result a')
+        time.sleep(0.1)
+        self.assertEqual(cache.get('a'), None)
+
+    def test_sqlite_persistence(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            sqlite_path = os.path.join(temp_dir, 'cache.db')
+            cache = cloudlanguagetools_chatbot.cache.FunctionCallCache(sqlite_path=sqlite_path)
+            cache.put('a', 'result a')
+            cache.close()
+            # simulate a restart
+            restarted_cache = cloudlanguagetools_chatbot.cache.FunctionCallCache(sqlite_path=sqlite_path)
+            self.assertEqual(restarted_cache.get('a'), 'result a')
+            self.assertEqual(restarted_cache.get_stats()['hits'], 1)
+            restarted_cache.close()
+
+    def test_sqlite_get_async(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            sqlite_path = os.path.join(temp_dir, 'cache.db')
+            cache = cloudlanguagetools_chatbot.cache.FunctionCallCache(sqlite_path=sqlite_path)
+            cache.put('a', 'result a')
+            cache.close()
+            restarted_cache = cloudlanguagetools_chatbot.cache.FunctionCallCache(sqlite_path=sqlite_path)
+            async def run():
+                # read from the database on the cache thread, then from memory
+                return [await restarted_cache.get_async(key) for key in ['a', 'a', 'b']]
+            self.assertEqual(asyncio.run(run()), ['result a', 'result a', None])
+            self.assertEqual(restarted_cache.get_stats(), {'entries': 1, 'hits': 2, 'misses': 1, 'evictions': 0})
+            restarted_cache.close()
+
+    def test_sqlite_purge(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            sqlite_path = os.path.join(temp_dir, 'cache.db')
+            original_purge_interval = cloudlanguagetools_chatbot.cache.PURGE_INTERVAL
+            cloudlanguagetools_chatbot.cache.PURGE_INTERVAL = 5
+            try:
+                cache = cloudlanguagetools_chatbot.cache.FunctionCallCache(max_entries=2, sqlite_path=sqlite_path, max_disk_entries=3)
+                for i in range(5):
+                    cache.put(f'key {i}', f'result {i}')
+                cache.flush()
+            finally:
+                cloudlanguagetools_chatbot.cache.PURGE_INTERVAL = original_purge_interval
+            # the table is capped after the fifth insert, the entries which expire first are deleted
+            keys = [row[0] for row in cache.db.execute('SELECT key FROM function_call_cache ORDER BY key')]
+            self.assertEqual(keys, ['key 2', 'key 3', 'key 4'])
+            cache.close()
+
+    def test_sqlite_purge_expired(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            sqlite_path = os.path.join(temp_dir, 'cache.db')
+            cache = cloudlanguagetools_chatbot.cache.FunctionCallCache(ttl_seconds=0.05, sqlite_path=sqlite_path)
+            cache.put('a', 'result a')
+            time.sleep(0.1)
+            cache.purge_expired()
+            self.assertEqual(cache.db.execute('SELECT COUNT(*) FROM function_call_cache').fetchone()[0], 0)
+            self.assertEqual(cache.get_stats()['entries'], 0)
+            cache.close()
@@ -0,0 +1,58 @@
+import os
+import sys
+import logging
+import unittest
+import pprint
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import cloudlanguagetools_chatbot.categorize
+from cloudlanguagetools_chatbot.categorize import InputType
+from categorize_input_cases import CATEGORIZE_INPUT_CASES
+
+logger = logging.getLogger(__name__)
+
+class TestLocalInputClassifier(unittest.TestCase):
+
+    def setUp(self):
+        self.classifier = cloudlanguagetools_chatbot.categorize.LocalInputClassifier()
+
+    def test_evaluate(self):
+        # pytest --log-cli-level=INFO tests/test_categorize.py -k test_evaluate
+        result = cloudlanguagetools_chatbot.categorize.evaluate_classifier(self.classifier, CATEGORIZE_INPUT_CASES)
+        logger.info(f'local classifier evaluation: {pprint.pformat(result)}')
+        # whatever is classified locally must be correct, the rest goes to the LLM
+        self.assertEqual(result['errors'], [])
+        self.assertEqual(result['accuracy'], 1.0)
+        self.assertGreaterEqual(result['coverage'], 0.8)
+
+    def test_instructions(self):
+        result = self.classifier.classify('黑社會', 'Your instructions: When I give you a sentence in Chinese, translate it to English')
+        self.assertEqual(result.input_type, InputType.instructions)
+        self.assertEqual(result.instructions, 'When I give you a sentence in Chinese, translate it to English')
+
+    def test_ambiguous_input(self):
+        # latin script in both sentences, the LLM has to decide
+        self.assertEqual(self.classifier.classify('Je ne suis pas intéressé.', 'Il fait beau aujourd\'hui'), None)
+        # a question asked in chinese could be about the previous sentence
+        self.assertEqual(self.classifier.classify('成本很低', '这是什么意思？'), None)
+        self.assertEqual(self.classifier.get_stats(), {'classified': 0, 'fallback': 2})
+
+    def test_first_message(self):
+        self.assertEqual(self.classifier.classify(None, '我想吃中餐').input_type, InputType.new_sentence)
+        # could be a sentence, a question or instructions
+        self.assertEqual(self.classifier.classify(None, 'Je ne suis pas intéressé.'), None)
+        self.assertEqual(self.classifier.classify(None, 'what can you do?'), None)
+        self.assertEqual(self.classifier.classify(None, '这是什么意思？'), None)
+
+    def test_latin_question_after_foreign_script(self):
+        self.assertEqual(self.classifier.classify('我想吃中餐', 'what does 中餐 mean?').input_type, InputType.question_or_command)
+        # questions in a foreign language written in latin script
+        self.assertEqual(self.classifier.classify('我想吃中餐', 'Où est la gare ?'), None)
+        self.assertEqual(self.classifier.classify('成本很低', '¿Dónde está la biblioteca?'), None)
+
+    def test_dominant_script(self):
+        self.assertEqual(cloudlanguagetools_chatbot.categorize.get_dominant_script('成本很低'), 'CJK')
+        self.assertEqual(cloudlanguagetools_chatbot.categorize.get_dominant_script('what does 成本 mean ?'), 'LATIN')
+        self.assertEqual(cloudlanguagetools_chatbot.categorize.get_dominant_script('Ｈｅｌｌｏ'), 'LATIN')
+        self.assertEqual(cloudlanguagetools_chatbot.categorize.get_dominant_script('123 ?'), None)
@@ -14,6 +14,7 @@ import cloudlanguagetools
 import cloudlanguagetools.servicemanager
 import cloudlanguagetools.chatapi
 import cloudlanguagetools_chatbot.chatmodel
+from categorize_input_cases import CATEGORIZE_INPUT_CASES
 
 logger = logging.getLogger(__name__)
 
@@ -208,35 +209,17 @@ class TestChatModel(unittest.TestCase):
     def test_categorize_input(self):
         # pytest --log-cli-level=INFO tests/test_chatmodel.py -k test_categorize_input
         # pytest --log-cli-level=DEBUG tests/test_chatmodel.py -k test_categorize_input
-        from cloudlanguagetools_chatbot.chatmodel import InputType
-
-        self.assertEquals(self.categorize_input_type_sync('呢條路係行返屋企嘅路', 
-                                                   'Is there another chinese character which means road?').input_type,
-                                                   InputType.question_or_command)
-
-        self.assertEquals(self.categorize_input_type_sync('呢條路係行返屋企嘅路', 
-                                                   '黑社會').input_type,
-                                                   InputType.new_sentence)
-
-        self.assertEquals(self.categorize_input_type_sync('黑社會', 
-                                                   'When do we use this ?').input_type,
-                                                   InputType.question_or_command)
-
-        self.assertEquals(self.categorize_input_type_sync('黑社會', 
-                                                   'pronounce using amazon').input_type,
-                                                   InputType.question_or_command)
-
-        self.assertEquals(self.categorize_input_type_sync('黑社會', 
-        'instructions: when I give you a sentence in cantonese, pronounce it using Azure service and female voice, then translate it into english, and break down the cantonese sentence into words').input_type,
-                                                   InputType.instructions)
-
-        self.assertEquals(self.categorize_input_type_sync('黑社會', 
-        'instruction: translate from french to english').input_type,
-                                                   InputType.instructions)
-
-        self.assertEquals(self.categorize_input_type_sync(None, 
-        '成绩').input_type,
-                                                   InputType.new_sentence) 
+        for last_input_sentence, input_sentence, expected_input_type in CATEGORIZE_INPUT_CASES:
+            self.assertEquals(self.categorize_input_type_sync(last_input_sentence, input_sentence).input_type,
+                                                   expected_input_type)
+
+    def test_categorize_input_llm(self):
+        # pytest --log-cli-level=INFO tests/test_chatmodel.py -k test_categorize_input_llm
+        # same cases, without the local classifier
+        self.chat_model.input_classifier = None
+        for last_input_sentence, input_sentence, expected_input_type in CATEGORIZE_INPUT_CASES:
+            self.assertEquals(self.categorize_input_type_sync(last_input_sentence, input_sentence).input_type,
+                                                   expected_input_type)
 
 
     def test_mandarin_pinyin_1(self):
@@ -0,0 +1,83 @@
+import os
+import sys
+import asyncio
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import cloudlanguagetools_chatbot.dispatcher
+import cloudlanguagetools_chatbot.metrics
+
+class TestChatDispatcher(unittest.TestCase):
+
+    def test_ordering_and_concurrency(self):
+        dispatcher = cloudlanguagetools_chatbot.dispatcher.ChatDispatcher(max_concurrent_chats=4)
+        events = []
+        max_active = 0
+
+        async def handle(chat_id, message_index, duration):
+            nonlocal max_active
+            max_active = max(max_active, dispatcher.active)
+            events.append(('start', chat_id, message_index))
+            await asyncio.sleep(duration)
+            events.append(('end', chat_id, message_index))
+
+        async def run():
+            tasks = []
+            for message_index in range(3):
+                for chat_id in ['a', 'b', 'c']:
+                    # earlier messages take longer, they must still finish first
+                    duration = 0.03 * (3 - message_index)
+                    tasks.append(asyncio.ensure_future(dispatcher.run(chat_id, lambda chat_id=chat_id, message_index=message_index, duration=duration: handle(chat_id, message_index, duration))))
+            await asyncio.gather(*tasks)
+
+        asyncio.run(run())
+        for chat_id in ['a', 'b', 'c']:
+            chat_events = [(event, message_index) for event, event_chat_id, message_index in events if event_chat_id == chat_id]
+            self.assertEqual(chat_events, [('start', 0), ('end', 0), ('start', 1), ('end', 1), ('start', 2), ('end', 2)])
+        # the three chats ran concurrently
+        self.assertEqual(max_active, 3)
+        stats = dispatcher.get_stats()
+        self.assertEqual(stats['processed'], 9)
+        self.assertEqual(stats['queued'], 0)
+        # idle chats are not kept
+        self.assertEqual(stats['chats'], {})
+
+    def test_concurrency_limit(self):
+        dispatcher = cloudlanguagetools_chatbot.dispatcher.ChatDispatcher(max_concurrent_chats=2)
+        max_active = 0
+
+        async def handle():
+            nonlocal max_active
+            max_active = max(max_active, dispatcher.active)
+            await asyncio.sleep(0.01)
+
+        async def run():
+            await asyncio.gather(*[dispatcher.run(chat_id, handle) for chat_id in range(6)])
+
+        asyncio.run(run())
+        self.assertEqual(max_active, 2)
+
+    def test_queue_depth(self):
+        dispatcher = cloudlanguagetools_chatbot.dispatcher.ChatDispatcher()
+        metrics = cloudlanguagetools_chatbot.metrics
+        queue_depth_count = metrics.chat_queue_depth.get_count()
+
+        async def run():
+            release = asyncio.Event()
+            first = asyncio.ensure_future(dispatcher.run('a', release.wait))
+            second = asyncio.ensure_future(dispatcher.run('a', release.wait))
+            await asyncio.sleep(0.01)
+            chat_stats = dispatcher.get_chat_stats('a')
+            self.assertEqual(metrics.chat_updates_queued.get(), 1)
+            self.assertEqual(metrics.chat_updates_active.get(), 1)
+            release.set()
+            await asyncio.gather(first, second)
+            return chat_stats
+
+        chat_stats = asyncio.run(run())
+        self.assertEqual(chat_stats['queue_depth'], 1)
+        self.assertEqual(metrics.chat_updates_queued.get(), 0)
+        self.assertEqual(metrics.chat_updates_active.get(), 0)
+        self.assertEqual(metrics.chat_queue_depth.get_count(), queue_depth_count + 2)
+        self.assertIn('clt_chatbot_chat_update_queue_wait_seconds_count', metrics.registry.render())
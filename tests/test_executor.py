@@ -0,0 +1,99 @@
+import os
+import sys
+import time
+import asyncio
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import cloudlanguagetools_chatbot.executor
+import cloudlanguagetools_chatbot.metrics
+
+def blocking_call(duration, result):
+    time.sleep(duration)
+    return result
+
+class TestToolExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = cloudlanguagetools_chatbot.executor.ToolExecutor(pool_sizes={'audio': 1, 'translate': 4})
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_parallel_calls(self):
+        async def run():
+            return await asyncio.gather(*[self.executor.run('translate', blocking_call, 0.2, i) for i in range(4)])
+        start_time = time.monotonic()
+        result = asyncio.run(run())
+        elapsed = time.monotonic() - start_time
+        self.assertEqual(result, [0, 1, 2, 3])
+        # the 4 calls ran in parallel
+        self.assertLess(elapsed, 0.6)
+        self.assertEqual(self.executor.get_stats()['translate']['completed'], 4)
+
+    def test_slow_tool_does_not_block_other_tools(self):
+        async def run():
+            slow_audio = asyncio.ensure_future(self.executor.run('audio', blocking_call, 0.5, 'audio'))
+            start_time = time.monotonic()
+            translation = await self.executor.run('translate', blocking_call, 0.0, 'translation')
+            elapsed = time.monotonic() - start_time
+            await slow_audio
+            return translation, elapsed
+        translation, elapsed = asyncio.run(run())
+        self.assertEqual(translation, 'translation')
+        self.assertLess(elapsed, 0.25)
+
+    def test_timeout(self):
+        async def run():
+            # the second call is still queued behind the first one when it times out
+            return await asyncio.gather(
+                self.executor.run('audio', blocking_call, 0.3, 'audio', timeout=0.1),
+                self.executor.run('audio', blocking_call, 0.3, 'audio', timeout=0.1),
+                return_exceptions=True)
+        result = asyncio.run(run())
+        for entry in result:
+            self.assertIsInstance(entry, cloudlanguagetools_chatbot.executor.ToolTimeoutException)
+        time.sleep(0.4)
+        stats = self.executor.get_stats()['audio']
+        self.assertEqual(stats['timeouts'], 2)
+        self.assertEqual(stats['queued'], 0)
+        self.assertEqual(stats['running'], 0)
+
+    def test_cancelled(self):
+        metrics = cloudlanguagetools_chatbot.metrics
+        cancelled = metrics.tool_calls.get(tool_type='audio', result='cancelled')
+        async def run():
+            running_task = asyncio.ensure_future(self.executor.run('audio', blocking_call, 0.3, 'audio'))
+            queued_task = asyncio.ensure_future(self.executor.run('audio', blocking_call, 0.3, 'audio'))
+            await asyncio.sleep(0.1)
+            self.assertEqual(self.executor.get_stats()['audio']['queued'], 1)
+            self.assertEqual(metrics.tool_calls_queued.get(tool_type='audio'), 1)
+            self.assertEqual(metrics.tool_calls_running.get(tool_type='audio'), 1)
+            # the caller of the queued call is cancelled, it never runs
+            queued_task.cancel()
+            await asyncio.wait({queued_task})
+            self.assertTrue(queued_task.cancelled())
+            self.assertEqual(self.executor.get_stats()['audio']['queued'], 0)
+            return await running_task
+        self.assertEqual(asyncio.run(run()), 'audio')
+        time.sleep(0.4)
+        stats = self.executor.get_stats()['audio']
+        self.assertEqual(stats['cancelled'], 1)
+        self.assertEqual(stats['queued'], 0)
+        self.assertEqual(stats['running'], 0)
+        self.assertEqual(stats['completed'], 1)
+        # also in the metrics of the process
+        self.assertEqual(metrics.tool_calls_queued.get(tool_type='audio'), 0)
+        self.assertEqual(metrics.tool_calls_running.get(tool_type='audio'), 0)
+        self.assertEqual(metrics.tool_calls.get(tool_type='audio', result='cancelled'), cancelled + 1)
+        self.assertIn('clt_chatbot_tool_calls_queued{tool_type="audio"} 0', metrics.registry.render())
+
+    def test_errors(self):
+        def failing_call():
+            raise ValueError('service unavailable')
+        async def run():
+            await self.executor.run('translate', failing_call)
+        with self.assertRaises(ValueError):
+            asyncio.run(run())
+        self.assertEqual(self.executor.get_stats()['translate']['errors'], 1)
@@ -0,0 +1,30 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import cloudlanguagetools_chatbot.file_ids
+
+class TestFileIdStore(unittest.TestCase):
+
+    def test_file_ids(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            sqlite_path = os.path.join(temp_dir, 'file_ids.db')
+            file_id_store = cloudlanguagetools_chatbot.file_ids.FileIdStore(sqlite_path)
+            self.assertEqual(file_id_store.get('key1'), None)
+            file_id_store.put('key1', 'file_id_1')
+            self.assertEqual(file_id_store.get('key1'), 'file_id_1')
+            file_id_store.close()
+
+            # persisted
+            file_id_store = cloudlanguagetools_chatbot.file_ids.FileIdStore(sqlite_path)
+            self.assertEqual(file_id_store.get('key1'), 'file_id_1')
+            file_id_store.remove_stale('key1')
+            self.assertEqual(file_id_store.get('key1'), None)
+            self.assertEqual(file_id_store.get_stats(), {'entries': 0, 'hits': 1, 'misses': 1, 'stale': 1})
+            file_id_store.close()
+
+if __name__ == '__main__':
+    unittest.main()
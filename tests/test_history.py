@@ -0,0 +1,51 @@
+import os
+import sys
+import json
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import cloudlanguagetools_chatbot.history
+
+def tool_turn(input_text, call_id, result):
+    return [
+        {'role': 'user', 'content': input_text},
+        {'role': 'assistant', 'content': None, 'tool_calls': [
+            {'id': call_id, 'type': 'function', 'function': {'name': 'breakdown', 'arguments': json.dumps({'input_text': input_text})}}]},
+        {'role': 'tool', 'tool_call_id': call_id, 'content': result},
+        {'role': 'assistant', 'content': 'done'},
+    ]
+
+class TestHistoryManager(unittest.TestCase):
+
+    def test_under_budget(self):
+        history_manager = cloudlanguagetools_chatbot.history.HistoryManager(max_history_tokens=1000)
+        message_history = tool_turn('成本很低', 'call_1', '成本: chéngběn, costs')
+        self.assertEqual(history_manager.trim(message_history), message_history)
+
+    def test_trim(self):
+        history_manager = cloudlanguagetools_chatbot.history.HistoryManager(max_history_tokens=400, keep_recent_turns=2, compacted_result_length=20)
+        message_history = tool_turn('成本很低', 'call_0', 'x' * 300)
+        for i in range(1, 10):
+            message_history += tool_turn(f'question {i}', f'call_{i}', 'y' * 300)
+
+        trimmed_history = history_manager.trim(message_history)
+        self.assertLessEqual(cloudlanguagetools_chatbot.history.count_messages_tokens(trimmed_history), 400)
+        # first turn, compacted
+        self.assertEqual(trimmed_history[0], {'role': 'user', 'content': '成本很低'})
+        self.assertEqual(trimmed_history[2]['content'], 'x' * 20 + '...')
+        self.assertEqual(trimmed_history[4]['content'], cloudlanguagetools_chatbot.history.OMITTED_TURNS_MESSAGE)
+        # the current turn is intact
+        self.assertEqual(trimmed_history[-4:], message_history[-4:])
+        # every tool result still follows the assistant message which requested it
+        tool_call_ids = set()
+        for message in trimmed_history:
+            for tool_call in message.get('tool_calls', None) or []:
+                tool_call_ids.add(tool_call['id'])
+            if message['role'] == 'tool':
+                self.assertIn(message['tool_call_id'], tool_call_ids)
+
+        # trimming again doesn't add another note
+        trimmed_again = history_manager.trim(trimmed_history + tool_turn('question 10', 'call_10', 'z' * 300))
+        omitted_messages = [message for message in trimmed_again if message['content'] == cloudlanguagetools_chatbot.history.OMITTED_TURNS_MESSAGE]
+        self.assertEqual(len(omitted_messages), 1)
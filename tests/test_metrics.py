@@ -0,0 +1,68 @@
+import os
+import sys
+import asyncio
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import cloudlanguagetools_chatbot.metrics
+
+class TestMetrics(unittest.TestCase):
+
+    def test_counter(self):
+        registry = cloudlanguagetools_chatbot.metrics.MetricsRegistry()
+        counter = registry.counter('test_requests_total', 'test requests', ['result'])
+        counter.inc(result='success')
+        counter.inc(2, result='success')
+        counter.inc(result='failed')
+        self.assertEqual(counter.get(result='success'), 3)
+        rendered = registry.render()
+        self.assertIn('# TYPE clt_chatbot_test_requests_total counter', rendered)
+        self.assertIn('clt_chatbot_test_requests_total{result="success"} 3', rendered)
+        self.assertIn('clt_chatbot_test_requests_total{result="failed"} 1', rendered)
+
+    def test_gauge(self):
+        registry = cloudlanguagetools_chatbot.metrics.MetricsRegistry()
+        gauge = registry.gauge('test_queued', 'test queue', ['pool'])
+        gauge.inc(pool='a')
+        gauge.inc(2, pool='a')
+        gauge.dec(pool='a')
+        gauge.set(5, pool='b')
+        self.assertEqual(gauge.get(pool='a'), 2)
+        rendered = registry.render()
+        self.assertIn('# TYPE clt_chatbot_test_queued gauge', rendered)
+        self.assertIn('clt_chatbot_test_queued{pool="a"} 2', rendered)
+        self.assertIn('clt_chatbot_test_queued{pool="b"} 5', rendered)
+
+    def test_histogram(self):
+        registry = cloudlanguagetools_chatbot.metrics.MetricsRegistry()
+        histogram = registry.histogram('test_seconds', 'test durations', ['span'], buckets=[0.1, 1.0])
+        histogram.observe(0.05, span='a')
+        histogram.observe(0.1, span='a')
+        histogram.observe(0.5, span='a')
+        histogram.observe(5.0, span='a')
+        self.assertEqual(histogram.get_count(span='a'), 4)
+        rendered = registry.render()
+        # buckets are cumulative, the upper bound is included
+        self.assertIn('clt_chatbot_test_seconds_bucket{span="a",le="0.1"} 2', rendered)
+        self.assertIn('clt_chatbot_test_seconds_bucket{span="a",le="1.0"} 3', rendered)
+        self.assertIn('clt_chatbot_test_seconds_bucket{span="a",le="+Inf"} 4', rendered)
+        self.assertIn('clt_chatbot_test_seconds_sum{span="a"} 5.65', rendered)
+        self.assertIn('clt_chatbot_test_seconds_count{span="a"} 4', rendered)
+
+    def test_span(self):
+        metrics = cloudlanguagetools_chatbot.metrics
+        async def failing_send():
+            raise Exception('send failed')
+        timed_send = metrics.timed('test_send', failing_send)
+        with self.assertRaises(Exception):
+            asyncio.run(timed_send())
+        with metrics.span('test_step', function='translate_or_lookup', provider='Azure'):
+            pass
+        self.assertEqual(metrics.span_duration.get_count(span='test_send'), 1)
+        self.assertEqual(metrics.span_errors.get(span='test_send'), 1)
+        self.assertEqual(metrics.span_duration.get_count(span='test_step', function='translate_or_lookup', provider='Azure'), 1)
+        self.assertEqual(metrics.span_errors.get(span='test_step', function='translate_or_lookup', provider='Azure'), 0)
+
+if __name__ == '__main__':
+    unittest.main()
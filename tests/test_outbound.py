@@ -0,0 +1,127 @@
+import asyncio
+import datetime
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import telegram.error
+import cloudlanguagetools_chatbot.outbound
+import cloudlanguagetools_chatbot.ratelimit
+from cloudlanguagetools_chatbot.outbound import OutboundMessage
+
+class TestOutboundDispatcher(unittest.TestCase):
+
+    def create_dispatcher(self, **kwargs):
+        return cloudlanguagetools_chatbot.outbound.OutboundDispatcher(
+            retry_policy=cloudlanguagetools_chatbot.ratelimit.RetryPolicy(max_retries=2, base_delay=0.01), **kwargs)
+
+    def test_merge_and_order(self):
+        async def run():
+            dispatcher = self.create_dispatcher(coalesce_window=0.05)
+            sent = []
+            async def send_text(text):
+                sent.append(text)
+                return text
+            async def send_voice():
+                sent.append('voice')
+            futures = [
+                dispatcher.enqueue(1, OutboundMessage(send_text, text='I want to eat Chinese food.', kind='message')),
+                dispatcher.enqueue(1, OutboundMessage(send_text, text='wǒ xiǎng chī zhōngcān', kind='message')),
+                dispatcher.enqueue(1, OutboundMessage(send_voice)),
+                dispatcher.enqueue(1, OutboundMessage(send_text, text='translating...', kind='status')),
+            ]
+            await dispatcher.flush()
+            self.assertEqual(sent, ['I want to eat Chinese food.\n\nwǒ xiǎng chī zhōngcān', 'voice', 'translating...'])
+            self.assertEqual(futures[1].result(), 'I want to eat Chinese food.\n\nwǒ xiǎng chī zhōngcān')
+            self.assertEqual(dispatcher.get_stats()['merged'], 1)
+        asyncio.run(run())
+
+    def test_replace(self):
+        async def run():
+            dispatcher = self.create_dispatcher()
+            edits = []
+            async def edit(text):
+                edits.append(text)
+            for text in ['I', 'I want', 'I want to eat']:
+                dispatcher.enqueue(1, OutboundMessage(lambda text=text: edit(text), replace_key='edit'))
+            await dispatcher.flush()
+            # queued edits are replaced by the latest one
+            self.assertEqual(edits, ['I want to eat'])
+            self.assertEqual(dispatcher.get_stats()['replaced'], 2)
+        asyncio.run(run())
+
+    def test_retry(self):
+        async def run():
+            dispatcher = self.create_dispatcher()
+            attempts = []
+            async def send_text(text):
+                attempts.append(text)
+                if len(attempts) == 1:
+                    raise telegram.error.RetryAfter(datetime.timedelta(seconds=0.01))
+                if len(attempts) == 2:
+                    raise telegram.error.TimedOut()
+            async def send_rejected():
+                raise telegram.error.BadRequest('message is too long')
+            future = dispatcher.enqueue(1, OutboundMessage(send_text, text='hello'))
+            rejected_future = dispatcher.enqueue(2, OutboundMessage(send_rejected))
+            await dispatcher.flush()
+            self.assertEqual(len(attempts), 3)
+            self.assertEqual(rejected_future.result(), None)
+            stats = dispatcher.get_stats()
+            self.assertEqual(stats['flood_control'], 1)
+            self.assertEqual(stats['retries'], 2)
+            self.assertEqual(stats['failed'], 1)
+        asyncio.run(run())
+
+    def test_retry_after_longer_than_max_delay(self):
+        async def run():
+            dispatcher = cloudlanguagetools_chatbot.outbound.OutboundDispatcher(
+                retry_policy=cloudlanguagetools_chatbot.ratelimit.RetryPolicy(max_retries=2, base_delay=0.01, max_delay=0.05))
+            attempt_times = []
+            async def send_text(text):
+                attempt_times.append(asyncio.get_running_loop().time())
+                if len(attempt_times) == 1:
+                    raise telegram.error.RetryAfter(datetime.timedelta(seconds=0.3))
+            dispatcher.enqueue(1, OutboundMessage(send_text, text='hello'))
+            await dispatcher.flush()
+            # telegram would reject a retry before retry_after
+            self.assertEqual(len(attempt_times), 2)
+            self.assertGreaterEqual(attempt_times[1] - attempt_times[0], 0.3)
+            self.assertEqual(dispatcher.get_stats()['failed'], 0)
+        asyncio.run(run())
+
+class TestMessageUpdater(unittest.TestCase):
+
+    def test_edit_throttling(self):
+        async def run():
+            dispatcher = cloudlanguagetools_chatbot.outbound.OutboundDispatcher(coalesce_window=0)
+            sent = []
+            edits = []
+            async def send_text(text):
+                sent.append(text)
+                return len(sent)
+            async def edit_text(message, text):
+                edits.append((message, text))
+            message_updater = cloudlanguagetools_chatbot.outbound.MessageUpdater(dispatcher, 1, send_text, edit_text, edit_interval=0.1)
+            await message_updater.update(' ', False)
+            await message_updater.update('I', False)
+            # within the interval, skipped
+            await message_updater.update('I want', False)
+            await asyncio.sleep(0.15)
+            await message_updater.update('I want to', False)
+            await asyncio.sleep(0.05)
+            await message_updater.update('I want to eat', False)
+            # the final text is always shown
+            await message_updater.update('I want to eat.', True)
+            # the next answer is a new message, unchanged text isn't edited
+            await message_updater.update('Chinese food.', False)
+            await message_updater.update('Chinese food.', True)
+            await dispatcher.flush()
+            self.assertEqual(sent, ['I', 'Chinese food.'])
+            self.assertEqual(edits, [(1, 'I want to'), (1, 'I want to eat.')])
+        asyncio.run(run())
+
+if __name__ == '__main__':
+    unittest.main()
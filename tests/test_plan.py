@@ -0,0 +1,95 @@
+import asyncio
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import cloudlanguagetools_chatbot.plan
+import cloudlanguagetools_chatbot.chatmodel
+from cloudlanguagetools.languages import CommonLanguage
+
+"""
+answers the language detection requests with the given language
+"""
+class FakeDetectLanguageLLMClient():
+    def __init__(self, language):
+        self.language = language
+        self.requests = []
+
+    async def chat_completion(self, **kwargs):
+        self.requests.append(kwargs)
+        arguments = json.dumps({'language': self.language.value})
+        return {'choices': [{'message': {'role': 'assistant', 'content': None,
+            'function_call': {'name': cloudlanguagetools_chatbot.plan.DETECT_LANGUAGE_FUNCTION_NAME, 'arguments': arguments}}}]}
+
+class TestToolPlan(unittest.TestCase):
+
+    def test_get_tool_calls(self):
+        tool_plan = cloudlanguagetools_chatbot.plan.ToolPlan(applicable=True, steps=[
+            {'function_name': 'translate_or_lookup', 'target_language': CommonLanguage.en.value},
+            {'function_name': 'breakdown'},
+            {'function_name': 'pronounce', 'service': 'Azure'},
+        ])
+        tool_calls = tool_plan.get_tool_calls('我想吃中餐', CommonLanguage.zh_cn)
+        self.assertEqual(tool_calls, [
+            ('translate_or_lookup', {'input_text': '我想吃中餐', 'source_language': CommonLanguage.zh_cn.value, 'target_language': CommonLanguage.en.value}),
+            ('breakdown', {'input_text': '我想吃中餐', 'language': CommonLanguage.zh_cn.value, 'translation_language': CommonLanguage.en.value}),
+            ('pronounce', {'input_text': '我想吃中餐', 'language': CommonLanguage.zh_cn.value, 'service': 'Azure'}),
+        ])
+
+    def test_get_tool_calls_options(self):
+        tool_plan = cloudlanguagetools_chatbot.plan.ToolPlan(applicable=True, steps=[
+            {'function_name': 'breakdown', 'service': 'Google', 'transliteration_service': 'Azure'},
+            {'function_name': 'pronounce', 'gender': 'Female'},
+        ])
+        tool_calls = tool_plan.get_tool_calls('我想吃中餐', CommonLanguage.zh_cn)
+        self.assertEqual(tool_calls, [
+            ('breakdown', {'input_text': '我想吃中餐', 'language': CommonLanguage.zh_cn.value, 'translation_language': CommonLanguage.en.value,
+                'translation_service': 'Google', 'transliteration_service': 'Azure'}),
+            ('pronounce', {'input_text': '我想吃中餐', 'language': CommonLanguage.zh_cn.value, 'gender': 'Female'}),
+        ])
+
+    def test_input_language(self):
+        plan = cloudlanguagetools_chatbot.plan
+        self.assertEqual(plan.detect_language_from_script('ラーメンを食べたい'), CommonLanguage.ja)
+        # chinese characters alone could be chinese, cantonese or japanese
+        self.assertEqual(plan.detect_language_from_script('我想吃中餐'), None)
+        self.assertEqual(plan.detect_language_from_script('Je ne suis pas intéressé.'), None)
+        self.assertTrue(plan.is_language_script('我想吃中餐', CommonLanguage.zh_cn))
+        self.assertFalse(plan.is_language_script('what does it mean?', CommonLanguage.zh_cn))
+        self.assertTrue(plan.is_language_script('Je ne suis pas intéressé.', CommonLanguage.fr))
+        self.assertTrue(plan.is_latin_language(CommonLanguage.fr))
+        self.assertFalse(plan.is_latin_language(CommonLanguage.zh_cn))
+
+    def get_input_language(self, input_language, input_message, detected_language):
+        llm_client = FakeDetectLanguageLLMClient(detected_language)
+        chat_model = cloudlanguagetools_chatbot.chatmodel.ChatModel(None, llm_client=llm_client)
+        tool_plan = cloudlanguagetools_chatbot.plan.ToolPlan(applicable=True, input_language=input_language,
+            steps=[{'function_name': 'translate_or_lookup'}])
+        return asyncio.run(chat_model.get_input_language(tool_plan, input_message)), llm_client.requests
+
+    def test_latin_input_language(self):
+        # the script is enough for chinese
+        language, requests = self.get_input_language(CommonLanguage.zh_cn.value, '我想吃中餐', CommonLanguage.zh_cn)
+        self.assertEqual(language, CommonLanguage.zh_cn)
+        self.assertEqual(requests, [])
+        # an english question about a french sentence is in latin script too
+        language, requests = self.get_input_language(CommonLanguage.fr.value, 'what does it mean?', CommonLanguage.en)
+        self.assertEqual(language, None)
+        self.assertEqual(len(requests), 1)
+        language, requests = self.get_input_language(CommonLanguage.fr.value, 'Je ne suis pas intéressé.', CommonLanguage.fr)
+        self.assertEqual(language, CommonLanguage.fr)
+        self.assertEqual(len(requests), 1)
+
+    def test_cache(self):
+        cache = cloudlanguagetools_chatbot.plan.ToolPlanCache(max_entries=2)
+        for instruction in ['instruction 1', 'instruction 2', 'instruction 3']:
+            cache.put(instruction, cloudlanguagetools_chatbot.plan.ToolPlan(applicable=False))
+        self.assertEqual(cache.get('instruction 1'), None)
+        self.assertEqual(cache.get('instruction 3').applicable, False)
+        self.assertEqual(cache.get_stats(), {'entries': 2, 'hits': 1, 'misses': 1})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,256 @@
+import os
+import sys
+import asyncio
+import time
+import unittest
+
+import aiohttp.web
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import cloudlanguagetools_chatbot.ratelimit
+import cloudlanguagetools_chatbot.client
+import cloudlanguagetools_chatbot.metrics
+
+class TestRateLimit(unittest.TestCase):
+
+    def test_token_bucket(self):
+        # 600 per minute: 10 per second
+        bucket = cloudlanguagetools_chatbot.ratelimit.TokenBucket(600, capacity=5)
+
+        async def run():
+            for i in range(5):
+                self.assertLess(await bucket.acquire(), 0.01)
+            self.assertFalse(bucket.try_acquire())
+            # the next ones wait for the refill
+            start_time = time.monotonic()
+            await asyncio.gather(*[bucket.acquire() for i in range(3)])
+            return time.monotonic() - start_time
+
+        elapsed = asyncio.run(run())
+        self.assertGreater(elapsed, 0.25)
+        self.assertLess(elapsed, 0.6)
+        self.assertEqual(bucket.get_stats()['delayed'], 3)
+
+    def test_concurrency_limiter(self):
+        limiter = cloudlanguagetools_chatbot.ratelimit.AdaptiveConcurrencyLimiter(initial_limit=4, max_limit=6, decrease_interval=0)
+        max_in_flight = 0
+
+        async def request(throttled):
+            nonlocal max_in_flight
+            await limiter.acquire()
+            max_in_flight = max(max_in_flight, limiter.in_flight)
+            await asyncio.sleep(0.01)
+            limiter.release(throttled=throttled)
+
+        async def run():
+            await asyncio.gather(*[request(False) for i in range(20)])
+
+        asyncio.run(run())
+        self.assertGreater(max_in_flight, 4)
+        self.assertLessEqual(max_in_flight, 6)
+        # additive increase, up to the maximum
+        self.assertEqual(limiter.get_limit(), 6)
+        # multiplicative decrease
+        asyncio.run(request(True))
+        self.assertEqual(limiter.get_limit(), 3)
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_concurrency_limiter_cancel(self):
+        limiter = cloudlanguagetools_chatbot.ratelimit.AdaptiveConcurrencyLimiter(initial_limit=1)
+
+        async def run():
+            await limiter.acquire()
+            waiting_task = asyncio.ensure_future(limiter.acquire())
+            await asyncio.sleep(0.01)
+            waiting_task.cancel()
+            limiter.release()
+            # the slot isn't lost
+            await asyncio.wait_for(limiter.acquire(), 1.0)
+            limiter.release()
+
+        asyncio.run(run())
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_retry_policy(self):
+        retry_policy = cloudlanguagetools_chatbot.ratelimit.RetryPolicy(base_delay=1.0, max_delay=10.0)
+        for attempt in range(6):
+            delay = retry_policy.get_delay(attempt)
+            self.assertTrue(0 <= delay <= min(10.0, 2 ** attempt))
+        delay = retry_policy.get_delay(0, retry_after=3.0)
+        self.assertTrue(3.0 <= delay <= 3.1)
+        # the server's retry-after is longer than max_delay, retrying earlier would be throttled again
+        for attempt in range(6):
+            self.assertGreaterEqual(retry_policy.get_delay(attempt, retry_after=30.0), 30.0)
+        self.assertTrue(retry_policy.should_retry(0, retry_after=30.0))
+        self.assertFalse(retry_policy.should_retry(6))
+        # with a ceiling, give up instead
+        retry_policy = cloudlanguagetools_chatbot.ratelimit.RetryPolicy(base_delay=1.0, max_delay=10.0, max_retry_after=20.0)
+        self.assertFalse(retry_policy.should_retry(0, retry_after=30.0))
+        self.assertTrue(retry_policy.should_retry(0, retry_after=10.0))
+
+        get_retry_after = cloudlanguagetools_chatbot.ratelimit.get_retry_after
+        self.assertEqual(get_retry_after({'Retry-After': '2'}), 2.0)
+        self.assertEqual(get_retry_after({'retry-after-ms': '250', 'retry-after': '1'}), 0.25)
+        self.assertEqual(get_retry_after({'retry-after': 'Wed, 21 Oct 2015 07:28:00 GMT'}), None)
+        self.assertEqual(get_retry_after(None), None)
+
+"""
+a local endpoint which looks like Azure OpenAI chat completions
+"""
+class FakeAzureOpenAI():
+    def __init__(self, responses):
+        # list of (status, headers), served in order, then 200
+        self.responses = responses
+        self.request_count = 0
+
+    async def handle_chat_completion(self, request):
+        self.request_count += 1
+        if len(self.responses) > 0:
+            status, headers = self.responses.pop(0)
+            return aiohttp.web.json_response({'error': {'code': str(status), 'message': 'fake error'}}, status=status, headers=headers)
+        return aiohttp.web.json_response({
+            'id': 'chatcmpl-1',
+            'object': 'chat.completion',
+            'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': 'hello'}}],
+            'usage': {'prompt_tokens': 10, 'completion_tokens': 2, 'total_tokens': 12}
+        })
+
+    async def start(self):
+        web_application = aiohttp.web.Application()
+        web_application.router.add_post('/openai/deployments/{deployment}/chat/completions', self.handle_chat_completion)
+        self.runner = aiohttp.web.AppRunner(web_application)
+        await self.runner.setup()
+        site = aiohttp.web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        return f'http://127.0.0.1:{port}'
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+class TestLLMClient(unittest.TestCase):
+
+    def run_client(self, responses, setup_fn=None, **client_kwargs):
+        fake_endpoint = FakeAzureOpenAI(responses)
+        notifications = []
+
+        async def notify_queued():
+            notifications.append('queued')
+
+        async def run():
+            api_base = await fake_endpoint.start()
+            llm_client = cloudlanguagetools_chatbot.client.LLMClient([], azure_openai_config={
+                'azure_endpoint': api_base,
+                'azure_api_key': 'fake_key',
+                'azure_deployment_name': 'fake_deployment'
+            }, retry_policy=cloudlanguagetools_chatbot.ratelimit.RetryPolicy(max_retries=2, base_delay=0.01), **client_kwargs)
+            if setup_fn != None:
+                setup_fn(llm_client)
+            try:
+                return await llm_client.chat_completion(messages=[{'role': 'user', 'content': 'hi'}], notify_queued_fn=notify_queued), llm_client
+            finally:
+                await llm_client.close()
+                await fake_endpoint.stop()
+
+        return asyncio.run(run()), fake_endpoint, notifications
+
+    def test_retry_after_throttled(self):
+        start_time = time.monotonic()
+        (response, llm_client), fake_endpoint, notifications = self.run_client([(429, {'retry-after-ms': '200'}), (503, {})])
+        self.assertEqual(response['choices'][0]['message']['content'], 'hello')
+        self.assertEqual(fake_endpoint.request_count, 3)
+        # honours retry-after
+        self.assertGreater(time.monotonic() - start_time, 0.2)
+        stats = llm_client.get_stats()
+        self.assertEqual(stats['retries'], 2)
+        self.assertEqual(stats['throttled'], 1)
+        self.assertEqual(stats['concurrency']['in_flight'], 0)
+        self.assertEqual(notifications, [])
+
+    def test_too_many_failures(self):
+        import openai.error
+        with self.assertRaises(openai.error.RateLimitError):
+            self.run_client([(429, {'retry-after': '0'})] * 3)
+
+    def test_retry_after_seconds(self):
+        retries = cloudlanguagetools_chatbot.metrics.llm_retries.get(reason='RateLimitError')
+        start_time = time.monotonic()
+        # much longer than the backoff of the retry policy
+        (response, llm_client), fake_endpoint, notifications = self.run_client([(429, {'retry-after': '1'})])
+        self.assertGreater(time.monotonic() - start_time, 1.0)
+        self.assertEqual(response['choices'][0]['message']['content'], 'hello')
+        self.assertEqual(fake_endpoint.request_count, 2)
+        self.assertEqual(llm_client.get_stats()['retries'], 1)
+        self.assertEqual(cloudlanguagetools_chatbot.metrics.llm_retries.get(reason='RateLimitError'), retries + 1)
+
+    def test_give_up(self):
+        import openai.error
+        failed = cloudlanguagetools_chatbot.metrics.llm_requests.get(result='failed')
+        llm_clients = []
+        with self.assertRaises(openai.error.ServiceUnavailableError):
+            self.run_client([(503, {})] * 3, setup_fn=llm_clients.append)
+        # the first attempt and max_retries retries
+        stats = llm_clients[0].get_stats()
+        self.assertEqual(stats['requests'], 3)
+        self.assertEqual(stats['retries'], 2)
+        self.assertEqual(stats['failed'], 1)
+        self.assertEqual(stats['concurrency']['in_flight'], 0)
+        self.assertEqual(cloudlanguagetools_chatbot.metrics.llm_requests.get(result='failed'), failed + 1)
+
+    def test_not_retryable(self):
+        import openai.error
+        with self.assertRaises(openai.error.InvalidRequestError):
+            self.run_client([(400, {})])
+
+    def test_queued(self):
+        # the request quota is used up, the request waits rather than failing
+        def empty_request_bucket(llm_client):
+            llm_client.request_bucket.tokens = 0
+        original_notify_delay = cloudlanguagetools_chatbot.client.QUEUED_NOTIFY_DELAY
+        cloudlanguagetools_chatbot.client.QUEUED_NOTIFY_DELAY = 0.1
+        try:
+            # one request per 0.25s
+            (response, llm_client), fake_endpoint, notifications = self.run_client([], setup_fn=empty_request_bucket, requests_per_minute=240)
+        finally:
+            cloudlanguagetools_chatbot.client.QUEUED_NOTIFY_DELAY = original_notify_delay
+        self.assertEqual(response['choices'][0]['message']['content'], 'hello')
+        self.assertEqual(notifications, ['queued'])
+        self.assertEqual(llm_client.get_stats()['request_bucket']['delayed'], 1)
+
+    def test_cancelled_while_notifying(self):
+        # the slot is acquired while the user is being notified, then the request is cancelled
+        notifying = []
+
+        async def slow_notify_queued():
+            notifying.append('queued')
+            await asyncio.sleep(1.0)
+
+        async def run():
+            llm_client = cloudlanguagetools_chatbot.client.LLMClient([], requests_per_minute=600, azure_openai_config={
+                'azure_endpoint': 'http://127.0.0.1:1',
+                'azure_api_key': 'fake_key',
+                'azure_deployment_name': 'fake_deployment'
+            })
+            # one request per 0.1s
+            llm_client.request_bucket.tokens = 0
+            request_task = asyncio.ensure_future(llm_client.chat_completion(messages=[{'role': 'user', 'content': 'hi'}], notify_queued_fn=slow_notify_queued))
+            await asyncio.sleep(0.3)
+            self.assertEqual(notifying, ['queued'])
+            request_task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await request_task
+            await llm_client.close()
+            return llm_client
+
+        original_notify_delay = cloudlanguagetools_chatbot.client.QUEUED_NOTIFY_DELAY
+        cloudlanguagetools_chatbot.client.QUEUED_NOTIFY_DELAY = 0.05
+        try:
+            llm_client = asyncio.run(run())
+        finally:
+            cloudlanguagetools_chatbot.client.QUEUED_NOTIFY_DELAY = original_notify_delay
+        self.assertEqual(llm_client.get_stats()['concurrency']['in_flight'], 0)
+        self.assertEqual(llm_client.get_stats()['requests'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import os
+import sys
+import asyncio
+import tempfile
+import unittest
+import pydantic
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import cloudlanguagetools_chatbot.recording
+
+class Query(pydantic.BaseModel):
+    input_text: str
+
+class FakeLLMClient():
+    def __init__(self):
+        self.functions = []
+        self.tools = []
+
+    async def chat_completion(self, **kwargs):
+        if kwargs.get('stream', False):
+            return self.stream()
+        return {'choices': [{'message': {'role': 'assistant', 'content': kwargs['messages'][-1]['content'] + ' response'}}]}
+
+    async def stream(self):
+        for word in ['streamed', ' response']:
+            yield {'choices': [{'delta': {'content': word}}]}
+
+class FakeChatAPI():
+    def translate_or_lookup(self, query):
+        return f'translation of {query.input_text}'
+
+class TestRecording(unittest.TestCase):
+
+    def test_record_replay(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'traffic.jsonl')
+            recorder = cloudlanguagetools_chatbot.recording.TrafficRecorder(path)
+            llm_client = cloudlanguagetools_chatbot.recording.RecordingLLMClient(FakeLLMClient(), recorder)
+            chatapi = cloudlanguagetools_chatbot.recording.RecordingChatAPI(FakeChatAPI(), recorder)
+            messages = [{'role': 'user', 'content': 'hello'}]
+            async def record():
+                recorder.record_input(1, text='hello')
+                response = await llm_client.chat_completion(messages=messages, temperature=0.0)
+                chunks = [chunk async for chunk in await llm_client.chat_completion(messages=messages, stream=True)]
+                return response, chunks
+            response, chunks = asyncio.run(record())
+            translation = chatapi.translate_or_lookup(Query(input_text='hello'))
+            recorder.close()
+
+            recording = cloudlanguagetools_chatbot.recording.TrafficRecording.load([path])
+            self.assertEqual(list(recording.get_sessions().keys()), [1])
+            replay_llm_client = cloudlanguagetools_chatbot.recording.ReplayLLMClient(recording, [], latency_scale=0.0)
+            replay_chatapi = cloudlanguagetools_chatbot.recording.ReplayChatAPI(recording, latency_scale=0.0)
+            async def replay():
+                replayed_response = await replay_llm_client.chat_completion(messages=messages, temperature=0.0, notify_queued_fn=None)
+                replayed_chunks = [chunk async for chunk in await replay_llm_client.chat_completion(messages=messages, stream=True)]
+                return replayed_response, replayed_chunks
+            replayed_response, replayed_chunks = asyncio.run(replay())
+            self.assertEqual(replayed_response, response)
+            self.assertEqual(replayed_chunks, chunks)
+            self.assertEqual(replay_chatapi.translate_or_lookup(Query(input_text='hello')), translation)
+
+            # a request which wasn't recorded
+            with self.assertRaises(cloudlanguagetools_chatbot.recording.ReplayMissingError):
+                replay_chatapi.translate_or_lookup(Query(input_text='other'))
+            self.assertEqual(recording.get_stats()['misses'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
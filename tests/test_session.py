@@ -0,0 +1,94 @@
+import os
+import sys
+import time
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import cloudlanguagetools_chatbot.session
+
+class FakeChatModel():
+    """only the state handling of ChatModel"""
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+        self.instruction = 'default instructions'
+        self.last_input_sentence = None
+        self.message_history = []
+
+    def get_state(self):
+        return {
+            'instruction': self.instruction,
+            'last_input_sentence': self.last_input_sentence,
+            'message_history': self.message_history
+        }
+
+    def load_state(self, state):
+        self.instruction = state['instruction']
+        self.last_input_sentence = state['last_input_sentence']
+        self.message_history = state['message_history']
+
+class TestSessionStore(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.sqlite_path = os.path.join(self.temp_dir.name, 'sessions.db')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_evict_and_restore(self):
+        session_store = cloudlanguagetools_chatbot.session.SessionStore(FakeChatModel, sqlite_path=self.sqlite_path, idle_timeout=0.05)
+        chat_model, is_new = session_store.get_chat_model(42)
+        self.assertTrue(is_new)
+        chat_model.instruction = 'When given a sentence in Chinese, translate it to English'
+        chat_model.last_input_sentence = '成本很低'
+        chat_model.message_history = [{'role': 'user', 'content': '成本很低'}]
+
+        # same object while active
+        self.assertIs(session_store.get_chat_model(42)[0], chat_model)
+
+        time.sleep(0.1)
+        session_store.evict_idle_sessions()
+        self.assertEqual(session_store.get_stats()['active_sessions'], 0)
+
+        restored_chat_model, is_new = session_store.get_chat_model(42)
+        self.assertFalse(is_new)
+        self.assertIsNot(restored_chat_model, chat_model)
+        self.assertEqual(restored_chat_model.get_state(), chat_model.get_state())
+        self.assertEqual(session_store.get_stats(), {'active_sessions': 1, 'evicted': 1, 'restored': 1})
+        # the stored state is consumed, the chat is in memory now
+        self.assertEqual(session_store.db.execute('SELECT COUNT(*) FROM chat_sessions').fetchone()[0], 0)
+
+    def test_session_in_use_not_evicted(self):
+        session_store = cloudlanguagetools_chatbot.session.SessionStore(FakeChatModel, sqlite_path=self.sqlite_path, idle_timeout=0.0)
+        with session_store.use_session(42) as (chat_model, is_new):
+            time.sleep(0.01)
+            session_store.evict_idle_sessions()
+            self.assertEqual(session_store.get_stats()['active_sessions'], 1)
+
+    def test_restart(self):
+        session_store = cloudlanguagetools_chatbot.session.SessionStore(FakeChatModel, sqlite_path=self.sqlite_path)
+        chat_model, is_new = session_store.get_chat_model(42)
+        chat_model.last_input_sentence = '黑社會'
+        session_store.save_all()
+        session_store.close()
+
+        restarted_session_store = cloudlanguagetools_chatbot.session.SessionStore(FakeChatModel, sqlite_path=self.sqlite_path)
+        chat_model, is_new = restarted_session_store.get_chat_model(42)
+        self.assertFalse(is_new)
+        self.assertEqual(chat_model.last_input_sentence, '黑社會')
+        restarted_session_store.close()
+
+    def test_restored_once(self):
+        # two processes sharing the database, like the webhook workers
+        session_stores = [cloudlanguagetools_chatbot.session.SessionStore(FakeChatModel, sqlite_path=self.sqlite_path) for i in range(2)]
+        chat_model, is_new = session_stores[0].get_chat_model(42)
+        chat_model.last_input_sentence = '黑社會'
+        session_stores[0].save_all()
+        session_stores[0].sessions.clear()
+        self.assertFalse(session_stores[0].get_chat_model(42)[1])
+        # the state restored by the first one isn't restored again, stale
+        self.assertTrue(session_stores[1].get_chat_model(42)[1])
+        for session_store in session_stores:
+            session_store.close()
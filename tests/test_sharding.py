@@ -0,0 +1,34 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import cloudlanguagetools_chatbot.sharding
+
+class TestSharding(unittest.TestCase):
+
+    def test_get_update_chat_id(self):
+        get_update_chat_id = cloudlanguagetools_chatbot.sharding.get_update_chat_id
+        self.assertEqual(get_update_chat_id({'update_id': 1, 'message': {'chat': {'id': 42}, 'text': 'hello'}}), 42)
+        self.assertEqual(get_update_chat_id({'update_id': 2, 'edited_message': {'chat': {'id': -100}}}), -100)
+        self.assertEqual(get_update_chat_id({'update_id': 3, 'callback_query': {'id': 'x', 'message': {'chat': {'id': 7}}}}), 7)
+        self.assertEqual(get_update_chat_id({'update_id': 4, 'my_chat_member': {'chat': {'id': 8}}}), 8)
+        self.assertEqual(get_update_chat_id({'update_id': 5, 'inline_query': {'id': 'y'}}), None)
+
+    def test_get_shard_index(self):
+        get_shard_index = cloudlanguagetools_chatbot.sharding.get_shard_index
+        # stable: a chat always goes to the same worker
+        self.assertEqual(get_shard_index(123456, 4), get_shard_index(123456, 4))
+        self.assertEqual(get_shard_index(None, 4), 0)
+        # chats are spread over all the workers
+        counts = [0] * 4
+        for chat_id in range(100000, 101000):
+            shard_index = get_shard_index(chat_id, 4)
+            self.assertTrue(0 <= shard_index < 4)
+            counts[shard_index] += 1
+        for count in counts:
+            self.assertGreater(count, 200)
+
+if __name__ == '__main__':
+    unittest.main()
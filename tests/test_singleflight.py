@@ -0,0 +1,86 @@
+import os
+import sys
+import asyncio
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import cloudlanguagetools_chatbot.singleflight
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_coalesce(self):
+        single_flight = cloudlanguagetools_chatbot.singleflight.SingleFlight()
+        upstream_calls = []
+
+        async def translate(text):
+            upstream_calls.append(text)
+            await asyncio.sleep(0.02)
+            return f'translated:{text}'
+
+        async def run():
+            results = await asyncio.gather(*[single_flight.do(f'translate:{text}', lambda text=text: translate(text))
+                                             for text in ['a', 'a', 'b', 'a', 'b']])
+            # the call is finished, the next one goes upstream again
+            results.append(await single_flight.do('translate:a', lambda: translate('a')))
+            return results
+
+        results = asyncio.run(run())
+        self.assertEqual(results, ['translated:a', 'translated:a', 'translated:b', 'translated:a', 'translated:b', 'translated:a'])
+        self.assertEqual(upstream_calls, ['a', 'b', 'a'])
+        stats = single_flight.get_stats()
+        self.assertEqual(stats['calls'], 6)
+        self.assertEqual(stats['executed'], 3)
+        self.assertEqual(stats['coalesced'], 3)
+        self.assertEqual(stats['max_waiters'], 3)
+        self.assertEqual(stats['in_flight'], 0)
+
+    def test_errors_propagated(self):
+        single_flight = cloudlanguagetools_chatbot.singleflight.SingleFlight()
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError('no data found')
+
+        async def run():
+            return await asyncio.gather(*[single_flight.do('key', fail) for i in range(3)], return_exceptions=True)
+
+        results = asyncio.run(run())
+        self.assertEqual(len(results), 3)
+        for result in results:
+            self.assertIsInstance(result, ValueError)
+        self.assertEqual(single_flight.get_stats()['errors'], 1)
+        self.assertEqual(single_flight.get_stats()['executed'], 1)
+
+    def test_cancel_waiter(self):
+        single_flight = cloudlanguagetools_chatbot.singleflight.SingleFlight()
+        upstream_cancelled = False
+
+        async def slow_call():
+            nonlocal upstream_cancelled
+            try:
+                await asyncio.sleep(0.05)
+                return 'result'
+            except asyncio.CancelledError:
+                upstream_cancelled = True
+                raise
+
+        async def run():
+            first = asyncio.ensure_future(single_flight.do('key', slow_call))
+            second = asyncio.ensure_future(single_flight.do('key', slow_call))
+            await asyncio.sleep(0.01)
+            # the other waiter still gets the result
+            first.cancel()
+            self.assertEqual(await second, 'result')
+            # when all waiters are gone, the call is cancelled
+            third = asyncio.ensure_future(single_flight.do('key', slow_call))
+            await asyncio.sleep(0.01)
+            third.cancel()
+            await asyncio.sleep(0.01)
+
+        asyncio.run(run())
+        self.assertTrue(upstream_cancelled)
+        self.assertEqual(single_flight.get_stats()['in_flight'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
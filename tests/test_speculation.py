@@ -0,0 +1,103 @@
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'benchmarks')))
+
+import cloudlanguagetools_chatbot.chatmodel
+import cloudlanguagetools_chatbot.cache
+import cloudlanguagetools_chatbot.client
+import cloudlanguagetools_chatbot.metrics
+import fakes
+
+"""
+records the requests of a chat, and whether they were cancelled. the completions which let the model
+choose the tools are delayed, so that the categorization always finishes first
+"""
+class TrackingLLMClient(fakes.CountingLLMClient):
+    def __init__(self, llm_client, completion_delay):
+        super().__init__(llm_client)
+        self.completion_delay = completion_delay
+        self.requests = []
+
+    async def chat_completion(self, **kwargs):
+        request = {'kwargs': kwargs, 'cancelled': False}
+        self.requests.append(request)
+        try:
+            if 'tools' in kwargs:
+                await asyncio.sleep(self.completion_delay)
+            return await super().chat_completion(**kwargs)
+        except asyncio.CancelledError:
+            request['cancelled'] = True
+            raise
+
+    def get_completion_requests(self):
+        return [request for request in self.requests if 'tools' in request['kwargs']]
+
+class TestSpeculation(unittest.TestCase):
+
+    async def run_turns(self, inputs):
+        server = fakes.FakeChatCompletionServer(latency=fakes.Latency('constant', [0.01]))
+        api_base = await server.start()
+        llm_client = cloudlanguagetools_chatbot.client.LLMClient(
+            cloudlanguagetools_chatbot.chatmodel.ChatModel.build_openai_functions(),
+            azure_openai_config={'azure_endpoint': api_base, 'azure_api_key': 'test', 'azure_deployment_name': 'test'})
+        tracking_llm_client = TrackingLLMClient(llm_client, completion_delay=0.1)
+        speculation_stats = cloudlanguagetools_chatbot.chatmodel.SpeculationStats()
+        chat_model = cloudlanguagetools_chatbot.chatmodel.ChatModel(None,
+            result_cache=cloudlanguagetools_chatbot.cache.FunctionCallCache(),
+            input_classifier=None,
+            speculative_execution=True,
+            speculation_stats=speculation_stats,
+            llm_client=tracking_llm_client)
+        chat_model.chatapi = fakes.FakeChatAPI()
+        callbacks = fakes.FakeCallbacks()
+        callbacks.set_callbacks(chat_model)
+        try:
+            for input_text in inputs:
+                tracking_llm_client.requests = []
+                await chat_model.process_message(input_text)
+        finally:
+            await llm_client.close()
+            await server.stop()
+        return tracking_llm_client, speculation_stats, callbacks
+
+    def test_hit(self):
+        hits = cloudlanguagetools_chatbot.metrics.speculative_completions.get(result='hit', input_type='NEW_SENTENCE')
+        input_text = fakes.DEFAULT_SCENARIO[0]['input']
+        tracking_llm_client, speculation_stats, callbacks = asyncio.run(self.run_turns([input_text]))
+        # the speculative completion returned the tool calls, only the final answer was requested afterwards
+        completion_requests = tracking_llm_client.get_completion_requests()
+        self.assertEqual(len(completion_requests), 2)
+        self.assertEqual(completion_requests[0]['kwargs']['messages'][-1], {'role': 'user', 'content': input_text})
+        self.assertEqual(completion_requests[0]['kwargs']['notify_queued_fn'], None)
+        self.assertFalse(completion_requests[0]['cancelled'])
+        self.assertEqual(callbacks.audio_count, 1)
+        self.assertEqual(speculation_stats.get_stats()['hits'], 1)
+        self.assertEqual(speculation_stats.get_stats()['wasted_tokens'], 0)
+        self.assertEqual(cloudlanguagetools_chatbot.metrics.speculative_completions.get(result='hit', input_type='NEW_SENTENCE'), hits + 1)
+
+    def test_miss(self):
+        misses = cloudlanguagetools_chatbot.metrics.speculative_completions.get(result='miss', input_type='QUESTION_OR_COMMAND')
+        wasted_tokens = cloudlanguagetools_chatbot.metrics.speculative_wasted_tokens.get()
+        inputs = [fakes.DEFAULT_SCENARIO[0]['input'], fakes.DEFAULT_SCENARIO[1]['input']]
+        tracking_llm_client, speculation_stats, callbacks = asyncio.run(self.run_turns(inputs))
+        # the speculative completion, without the history, was cancelled, the question was answered with the history
+        speculative_request, tool_calls_request, answer_request = tracking_llm_client.get_completion_requests()
+        self.assertTrue(speculative_request['cancelled'])
+        self.assertEqual(speculative_request['kwargs']['notify_queued_fn'], None)
+        self.assertEqual(len([message for message in speculative_request['kwargs']['messages'] if message['role'] == 'user']), 1)
+        self.assertFalse(tool_calls_request['cancelled'])
+        self.assertNotEqual(tool_calls_request['kwargs']['notify_queued_fn'], None)
+        self.assertGreater(len(tool_calls_request['kwargs']['messages']), len(speculative_request['kwargs']['messages']))
+        stats = speculation_stats.get_stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses_question_or_command'], 1)
+        self.assertGreater(stats['wasted_tokens'], 0)
+        self.assertEqual(cloudlanguagetools_chatbot.metrics.speculative_completions.get(result='miss', input_type='QUESTION_OR_COMMAND'), misses + 1)
+        self.assertEqual(cloudlanguagetools_chatbot.metrics.speculative_wasted_tokens.get(), wasted_tokens + stats['wasted_tokens'])
+
+if __name__ == '__main__':
+    unittest.main()
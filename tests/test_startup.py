@@ -0,0 +1,46 @@
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import cloudlanguagetools_chatbot.startup
+
+IMPORTTIME_OUTPUT = """import time: self [us] | cumulative | imported package
+import time:       120 |        120 |   cloudlanguagetools.constants
+import time:      2500 |       2620 | cloudlanguagetools
+import time:       300 |        300 |   telegram.error
+import time:      1000 |       1300 | telegram
+"""
+
+class TestStartup(unittest.TestCase):
+
+    def test_lazy_service_manager(self):
+        configured = []
+        def configure(manager):
+            configured.append(manager)
+        lazy_manager = cloudlanguagetools_chatbot.startup.LazyServiceManager(configure_fn=configure)
+        self.assertFalse(lazy_manager.initialized)
+        self.assertEqual(configured, [])
+        # the chats needing the services at the same time share the initialization
+        threads = [threading.Thread(target=lambda: lazy_manager.services) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(lazy_manager.initialized)
+        self.assertEqual(len(configured), 1)
+        self.assertIs(lazy_manager.services, configured[0].services)
+        lazy_manager.warm_up()
+        self.assertNotEqual(lazy_manager.warm_up_duration, None)
+
+    def test_parse_import_times(self):
+        import_times = cloudlanguagetools_chatbot.startup.parse_import_times(IMPORTTIME_OUTPUT, top=2)
+        self.assertEqual([module['module'] for module in import_times['modules']], ['cloudlanguagetools', 'telegram'])
+        self.assertAlmostEqual(import_times['modules'][0]['cumulative'], 0.00262)
+        self.assertAlmostEqual(import_times['packages']['cloudlanguagetools'], 0.00262)
+        self.assertAlmostEqual(import_times['packages']['telegram'], 0.0013)
+
+if __name__ == '__main__':
+    unittest.main()
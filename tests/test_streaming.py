@@ -0,0 +1,87 @@
+import asyncio
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import cloudlanguagetools_chatbot.chatmodel
+
+"""
+returns the chunks of a streamed completion, as openai does with stream=True
+"""
+class FakeStreamingLLMClient():
+    def __init__(self, deltas):
+        self.functions = cloudlanguagetools_chatbot.chatmodel.ChatModel.build_openai_functions()
+        self.tools = [{'type': 'function', 'function': function} for function in self.functions]
+        self.deltas = deltas
+        self.requests = []
+
+    async def chat_completion(self, **kwargs):
+        self.requests.append(kwargs)
+        async def stream():
+            # azure sends the content filter results first, without choices
+            yield {'choices': []}
+            for delta in self.deltas:
+                await asyncio.sleep(0)
+                yield {'choices': [{'index': 0, 'finish_reason': None, 'delta': delta}]}
+        return stream()
+
+def split_arguments(arguments, parts):
+    size = len(arguments) // parts + 1
+    return [arguments[i:i + size] for i in range(0, len(arguments), size)]
+
+class TestStreaming(unittest.TestCase):
+
+    def run_stream(self, deltas):
+        llm_client = FakeStreamingLLMClient(deltas)
+        chat_model = cloudlanguagetools_chatbot.chatmodel.ChatModel(None, llm_client=llm_client, streaming=True)
+        updates = []
+        async def send_message_update(text, final):
+            updates.append((text, final))
+        async def send_nothing(*args):
+            pass
+        chat_model.set_send_message_callback(send_nothing, send_nothing, send_nothing, send_message_update)
+        response = asyncio.run(chat_model.request_completion_stream([{'role': 'user', 'content': '我想吃中餐'}]))
+        self.assertTrue(llm_client.requests[0]['stream'])
+        return response['choices'][0]['message'], updates
+
+    def test_tool_call_arguments_split(self):
+        translate_arguments = json.dumps({'input_text': '我想吃中餐', 'source_language': 'Chinese', 'target_language': 'English'}, ensure_ascii=False)
+        transliterate_arguments = json.dumps({'input_text': '我想吃中餐', 'language': 'Chinese'}, ensure_ascii=False)
+        deltas = [
+            {'tool_calls': [{'index': 0, 'id': 'call_1', 'type': 'function', 'function': {'name': 'translate_or_lookup', 'arguments': ''}}]},
+        ]
+        deltas += [{'tool_calls': [{'index': 0, 'function': {'arguments': part}}]} for part in split_arguments(translate_arguments, 4)]
+        deltas += [
+            {'tool_calls': [{'index': 1, 'id': 'call_2', 'type': 'function', 'function': {'name': 'transliterate'}}]},
+        ]
+        deltas += [{'tool_calls': [{'index': 1, 'function': {'arguments': part}}]} for part in split_arguments(transliterate_arguments, 3)]
+        message, updates = self.run_stream(deltas)
+        self.assertEqual(message['content'], None)
+        self.assertEqual(message['tool_calls'], [
+            {'id': 'call_1', 'type': 'function', 'function': {'name': 'translate_or_lookup', 'arguments': translate_arguments}},
+            {'id': 'call_2', 'type': 'function', 'function': {'name': 'transliterate', 'arguments': transliterate_arguments}},
+        ])
+        self.assertEqual(updates, [])
+
+    def test_content_and_tool_calls(self):
+        deltas = [
+            {'role': 'assistant', 'content': 'Let me'},
+            {'content': ' translate'},
+            {'content': ' this.'},
+            {'tool_calls': [{'index': 0, 'id': 'call_1', 'type': 'function', 'function': {'name': 'translate_or_lookup', 'arguments': '{"input_text": "我想'}}]},
+            {'tool_calls': [{'index': 0, 'function': {'arguments': '吃中餐"}'}}]},
+        ]
+        message, updates = self.run_stream(deltas)
+        self.assertEqual(message['content'], 'Let me translate this.')
+        self.assertEqual(message['tool_calls'], [
+            {'id': 'call_1', 'type': 'function', 'function': {'name': 'translate_or_lookup', 'arguments': '{"input_text": "我想吃中餐"}'}},
+        ])
+        self.assertEqual(json.loads(message['tool_calls'][0]['function']['arguments']), {'input_text': '我想吃中餐'})
+        # the text is shown as it arrives, then once more as final
+        self.assertEqual(updates, [('Let me', False), ('Let me translate', False), ('Let me translate this.', False), ('Let me translate this.', True)])
+
+if __name__ == '__main__':
+    unittest.main()
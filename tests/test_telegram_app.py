@@ -0,0 +1,123 @@
+import asyncio
+import os
+import queue
+import socket
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import aiohttp.web
+
+import fake_telegram
+
+def get_free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+# telegram_app reads its settings when it's imported
+temp_dir = tempfile.TemporaryDirectory()
+fake_bot_api_port = get_free_port()
+os.environ.update({
+    'TELEGRAM_BOT_TOKEN': '123:fake',
+    'TELEGRAM_BASE_URL': f'http://127.0.0.1:{fake_bot_api_port}/bot',
+    'CLT_CHATBOT_METRICS_PORT': '0',
+    'CLT_CHATBOT_WARM_UP': '0',
+    'CLT_CHATBOT_TURN_CACHE': '0',
+    'CLT_CHATBOT_SESSION_DB': os.path.join(temp_dir.name, 'chat_sessions.db'),
+    'CLT_CHATBOT_FILE_ID_DB': os.path.join(temp_dir.name, 'telegram_file_ids.db'),
+    'CLT_CHATBOT_AUDIO_CACHE_DIR': os.path.join(temp_dir.name, 'audio_cache'),
+})
+
+import telegram_app
+import telegram_webhook
+import cloudlanguagetools_chatbot.outbound
+
+MESSAGE_COUNT = 5
+
+"""
+the fake bot API, on its own thread and event loop: run_polling runs the event loop of the bot
+"""
+class FakeBotAPIThread():
+    def __init__(self, port):
+        self.port = port
+        self.fake_bot_api = None
+        self.loop = None
+        self.runner = None
+        self.started = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.started.wait(5)
+
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        self.fake_bot_api = fake_telegram.FakeBotAPI()
+        self.runner = aiohttp.web.AppRunner(self.fake_bot_api.build_web_application(), access_log=None)
+        self.loop.run_until_complete(self.runner.setup())
+        self.loop.run_until_complete(aiohttp.web.TCPSite(self.runner, '127.0.0.1', self.port).start())
+        self.started.set()
+        self.loop.run_forever()
+        self.loop.run_until_complete(self.runner.cleanup())
+        self.loop.close()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(5)
+
+class TestTelegramApp(unittest.TestCase):
+
+    def setUp(self):
+        self.fake_bot_api_thread = FakeBotAPIThread(fake_bot_api_port)
+        self.fake_bot_api_thread.start()
+        # one message per 0.1s in the chat, most of them are still queued when the bot stops
+        telegram_app.outbound_dispatcher = cloudlanguagetools_chatbot.outbound.OutboundDispatcher(
+            chat_messages_per_second=10, chat_burst=1, coalesce_window=0)
+
+    def tearDown(self):
+        self.fake_bot_api_thread.stop()
+
+    def build_application(self, updater, stop_fn=None):
+        """the messages are queued when the bot starts, then it's stopped with stop_fn"""
+        application = telegram_app.build_application(updater=updater)
+        original_post_init = application.post_init
+        async def post_init(application):
+            await original_post_init(application)
+            send_message = telegram_app.received_message_lambda(application.bot, 1)
+            send_status = telegram_app.received_status_lambda(application.bot, 1)
+            for i in range(MESSAGE_COUNT):
+                # statuses and messages alternate, so that they're not merged
+                await send_message(f'message {i}')
+                await send_status(f'status {i}')
+            if stop_fn != None:
+                asyncio.get_running_loop().call_later(0.05, stop_fn)
+        application.post_init = post_init
+        return application
+
+    def assert_delivered(self):
+        self.assertEqual(self.fake_bot_api_thread.fake_bot_api.call_counts.get('sendMessage', 0), MESSAGE_COUNT * 2)
+        self.assertEqual(telegram_app.outbound_dispatcher.get_stats()['failed'], 0)
+
+    def test_polling_stop(self):
+        application = None
+        def stop():
+            application.stop_running()
+        application = self.build_application(True, stop_fn=stop)
+        application.run_polling(stop_signals=None, close_loop=False)
+        self.assert_delivered()
+
+    def test_webhook_worker_stop(self):
+        application = self.build_application(False)
+        # no updates, the worker stops right after starting
+        update_queue = queue.Queue()
+        update_queue.put(None)
+        asyncio.run(telegram_webhook.process_updates(application, update_queue))
+        self.assert_delivered()
+
+if __name__ == '__main__':
+    unittest.main()
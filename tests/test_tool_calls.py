@@ -0,0 +1,144 @@
+import asyncio
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'benchmarks')))
+
+import cloudlanguagetools_chatbot.chatmodel
+import cloudlanguagetools_chatbot.cache
+import cloudlanguagetools_chatbot.client
+import fakes
+
+ZH_CN_INPUT = fakes.DEFAULT_SCENARIO[0]['input']
+FR_INPUT = fakes.DEFAULT_SCENARIO[2]['input']
+
+"""
+the breakdown fails, like a cloud service returning an error
+"""
+class FailingChatAPI(fakes.FakeChatAPI):
+    def breakdown(self, query):
+        self.simulate_call('breakdown')
+        raise RuntimeError('breakdown service unavailable')
+
+"""
+records what the user receives, in order
+"""
+class RecordingCallbacks(fakes.FakeCallbacks):
+    def __init__(self):
+        super().__init__()
+        self.outputs = []
+
+    async def send_message(self, message):
+        self.outputs.append(message)
+        await super().send_message(message)
+
+    async def send_audio(self, audio):
+        self.outputs.append('audio')
+        await super().send_audio(audio)
+
+def build_tool_call(call_id, function_name, arguments):
+    return {'id': call_id, 'type': 'function', 'function': {'name': function_name, 'arguments': json.dumps(arguments, ensure_ascii=False)}}
+
+class TestToolCalls(unittest.TestCase):
+
+    def create_chat_model(self, chatapi, llm_client=None):
+        if llm_client == None:
+            # the tool calls don't need the model
+            llm_client = cloudlanguagetools_chatbot.client.LLMClient(
+                cloudlanguagetools_chatbot.chatmodel.ChatModel.build_openai_functions(),
+                azure_openai_config={'azure_endpoint': 'http://127.0.0.1:1', 'azure_api_key': 'test', 'azure_deployment_name': 'test'})
+        chat_model = cloudlanguagetools_chatbot.chatmodel.ChatModel(None,
+            result_cache=cloudlanguagetools_chatbot.cache.FunctionCallCache(),
+            input_classifier=None,
+            llm_client=llm_client)
+        chat_model.chatapi = chatapi
+        callbacks = RecordingCallbacks()
+        callbacks.set_callbacks(chat_model)
+        return chat_model, callbacks
+
+    def test_order(self):
+        # the first calls finish last
+        chatapi = fakes.FakeChatAPI({'translate_or_lookup': fakes.Latency('constant', [0.2]), 'transliterate': fakes.Latency('constant', [0.1])})
+        chat_model, callbacks = self.create_chat_model(chatapi)
+        tool_call_list = [
+            build_tool_call('call_1', 'translate_or_lookup', {'input_text': ZH_CN_INPUT, 'source_language': fakes.ZH_CN, 'target_language': fakes.EN}),
+            build_tool_call('call_2', 'transliterate', {'input_text': ZH_CN_INPUT, 'language': fakes.ZH_CN}),
+            build_tool_call('call_3', 'pronounce', {'input_text': ZH_CN_INPUT, 'language': fakes.ZH_CN}),
+        ]
+        tool_messages, sent_message_to_user = asyncio.run(chat_model.process_tool_calls(tool_call_list, {}))
+        self.assertTrue(sent_message_to_user)
+        self.assertEqual(callbacks.outputs, [f'translation of {ZH_CN_INPUT}', f'transliteration of {ZH_CN_INPUT}', 'audio'])
+        self.assertEqual([tool_message['tool_call_id'] for tool_message in tool_messages], ['call_1', 'call_2', 'call_3'])
+        self.assertEqual(tool_messages[0]['content'], f'translation of {ZH_CN_INPUT}')
+        self.assertEqual(tool_messages[2]['content'], ZH_CN_INPUT)
+
+    def test_duplicate_calls(self):
+        chatapi = fakes.FakeChatAPI({'translate_or_lookup': fakes.Latency('constant', [0.05])})
+        chat_model, callbacks = self.create_chat_model(chatapi)
+        arguments = {'input_text': ZH_CN_INPUT, 'source_language': fakes.ZH_CN, 'target_language': fakes.EN}
+        tool_call_list = [
+            build_tool_call('call_1', 'translate_or_lookup', arguments),
+            build_tool_call('call_2', 'translate_or_lookup', dict(reversed(list(arguments.items())))),
+        ]
+        function_call_cache = {}
+
+        async def run():
+            first_results = await chat_model.process_tool_calls(tool_call_list, function_call_cache)
+            # requested again in the next round trip of the turn
+            second_results = await chat_model.process_tool_calls([build_tool_call('call_3', 'translate_or_lookup', arguments)], function_call_cache)
+            return first_results, second_results
+
+        (tool_messages, sent_message_to_user), (second_tool_messages, second_sent_message_to_user) = asyncio.run(run())
+        self.assertEqual(chatapi.call_counts, {'translate_or_lookup': 1})
+        # each tool call gets its result, the user sees it once
+        self.assertEqual([tool_message['content'] for tool_message in tool_messages + second_tool_messages], [f'translation of {ZH_CN_INPUT}'] * 3)
+        self.assertEqual(callbacks.outputs, [f'translation of {ZH_CN_INPUT}'])
+        self.assertTrue(sent_message_to_user)
+        self.assertFalse(second_sent_message_to_user)
+
+    def test_failure_cancels_siblings(self):
+        chatapi = FailingChatAPI({'translate_or_lookup': fakes.Latency('constant', [0.5])})
+        chat_model, callbacks = self.create_chat_model(chatapi)
+        tool_call_list = [
+            build_tool_call('call_1', 'breakdown', {'input_text': FR_INPUT, 'language': fakes.FR}),
+            build_tool_call('call_2', 'translate_or_lookup', {'input_text': FR_INPUT, 'source_language': fakes.FR, 'target_language': fakes.EN}),
+        ]
+        function_call_cache = {}
+
+        async def run():
+            with self.assertRaises(RuntimeError):
+                await chat_model.process_tool_calls(tool_call_list, function_call_cache)
+            breakdown_task, translate_task = function_call_cache.values()
+            self.assertIsInstance(breakdown_task.exception(), RuntimeError)
+            # cancelled right away, not when the event loop is closed
+            await asyncio.sleep(0)
+            self.assertTrue(translate_task.cancelled())
+
+        asyncio.run(run())
+        self.assertEqual(callbacks.outputs, [])
+
+    def test_failure_reported_to_user(self):
+        chatapi = FailingChatAPI()
+
+        async def run():
+            server = fakes.FakeChatCompletionServer()
+            api_base = await server.start()
+            llm_client = cloudlanguagetools_chatbot.client.LLMClient(
+                cloudlanguagetools_chatbot.chatmodel.ChatModel.build_openai_functions(),
+                azure_openai_config={'azure_endpoint': api_base, 'azure_api_key': 'test', 'azure_deployment_name': 'test'})
+            chat_model, callbacks = self.create_chat_model(chatapi, llm_client=llm_client)
+            try:
+                await chat_model.process_message(FR_INPUT)
+            finally:
+                await llm_client.close()
+                await server.stop()
+            return callbacks
+
+        callbacks = asyncio.run(run())
+        self.assertEqual(callbacks.status_messages, ['error: breakdown service unavailable'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import cloudlanguagetools.options
+import cloudlanguagetools_chatbot.turn_cache
+
+TURN = {
+    'outputs': [{'type': 'message', 'text': 'I want to eat Chinese food.'}],
+    'message_history': [{'role': 'user', 'content': '我想吃中餐'}, {'role': 'assistant', 'content': 'I want to eat Chinese food.'}]
+}
+
+class TestTurnCache(unittest.TestCase):
+
+    def get_key(self, turn_cache, input_sentence):
+        return turn_cache.get_key('translate to English', input_sentence, 'deployment', cloudlanguagetools.options.AudioFormat.mp3)
+
+    def test_persistence(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            sqlite_path = os.path.join(temp_dir, 'turn_cache.db')
+            turn_cache = cloudlanguagetools_chatbot.turn_cache.TurnCache(sqlite_path=sqlite_path)
+            key = self.get_key(turn_cache, '我想吃中餐')
+            self.assertEqual(turn_cache.get(key), None)
+            turn_cache.put(key, TURN)
+            self.assertEqual(turn_cache.get(key), TURN)
+            turn_cache.close()
+
+            turn_cache = cloudlanguagetools_chatbot.turn_cache.TurnCache(sqlite_path=sqlite_path)
+            self.assertEqual(turn_cache.get(key), TURN)
+            turn_cache.invalidate(key)
+            self.assertEqual(turn_cache.get(key), None)
+            turn_cache.put(key, TURN)
+            turn_cache.close()
+
+            # the prompts have changed, the turns are deleted
+            turn_cache = cloudlanguagetools_chatbot.turn_cache.TurnCache(sqlite_path=sqlite_path)
+            turn_cache.prompts_hash = 'other prompts'
+            turn_cache.db.execute('UPDATE turn_cache SET prompts_hash=?', ('old prompts',))
+            turn_cache.db.commit()
+            turn_cache.close()
+            turn_cache = cloudlanguagetools_chatbot.turn_cache.TurnCache(sqlite_path=sqlite_path)
+            self.assertEqual(turn_cache.get(key), None)
+            turn_cache.close()
+
+    def test_eviction(self):
+        turn_cache = cloudlanguagetools_chatbot.turn_cache.TurnCache(max_entries=2)
+        keys = [self.get_key(turn_cache, f'sentence {i}') for i in range(3)]
+        for key in keys:
+            turn_cache.put(key, TURN)
+        self.assertEqual(turn_cache.get(keys[0]), None)
+        self.assertEqual(turn_cache.get(keys[2]), TURN)
+        self.assertEqual(turn_cache.get_stats()['evictions'], 1)
+
+        turn_cache = cloudlanguagetools_chatbot.turn_cache.TurnCache(max_bytes=1000)
+        for key in keys:
+            turn_cache.put(key, TURN)
+        self.assertLessEqual(turn_cache.get_stats()['bytes'], 1000)
+
+    def test_key(self):
+        turn_cache = cloudlanguagetools_chatbot.turn_cache.TurnCache()
+        key = self.get_key(turn_cache, '我想吃中餐')
+        self.assertEqual(key, self.get_key(turn_cache, '我想吃中餐'))
+        self.assertNotEqual(key, turn_cache.get_key('translate to French', '我想吃中餐', 'deployment', cloudlanguagetools.options.AudioFormat.mp3))
+
+if __name__ == '__main__':
+    unittest.main()